@@ -0,0 +1,57 @@
+import numpy as np
+from scipy import ndimage as ndi
+
+# The shapes of the synthetic images, which are small enough to run quickly
+# but large enough to represent realistic per-slice costs.
+SHAPES = {
+    '2D': ((512, 512), 2),
+    '2D+t': ((8, 256, 256), 2),
+    '3D': ((64, 128, 128), 3),
+    '3D+t': ((4, 32, 96, 96), 3),
+}
+
+# The number of blobs per million pixels of each slice.
+DENSITIES = {
+    'sparse': 50,
+    'dense': 1000,
+}
+
+
+def make_blobs_image(
+    shape,
+    dimensionality,
+    *,
+    density,
+    min_sigma,
+    max_sigma,
+    seed=0,
+):
+    """ Makes an image of bright Gaussian blobs on a dark background.
+
+    The blobs are placed uniformly at random in each leading dimension slice
+    and have sigmas drawn uniformly from a few values between the given
+    minimum and maximum. Returns the image and the blob centers.
+    """
+    rng = np.random.default_rng(seed)
+    feature_shape = shape[-dimensionality:]
+    num_blobs = max(1, int(density * np.prod(feature_shape) / 1e6)) * int(np.prod(shape[:-dimensionality]))
+    centers = rng.integers(0, shape, size=(num_blobs, len(shape)))
+    blob_sigmas = rng.choice(np.linspace(min_sigma, max_sigma, 4), size=num_blobs)
+    image = np.zeros(shape, dtype=np.float32)
+    for sigma in np.unique(blob_sigmas):
+        impulses = np.zeros(shape, dtype=np.float32)
+        selected = centers[blob_sigmas == sigma]
+        impulses[tuple(selected.T)] = 1
+        # Only blur along the feature dimensions and normalize the peaks to 1.
+        sigmas = (0,) * (len(shape) - dimensionality) + (sigma,) * dimensionality
+        blurred = ndi.gaussian_filter(impulses, sigmas)
+        image += blurred / blurred.max()
+    return image, centers
+
+
+def make_points(shape, *, num_points, max_size, seed=0):
+    """ Makes random point coordinates and sizes inside an image shape. """
+    rng = np.random.default_rng(seed)
+    coords = rng.uniform(0, shape, size=(num_points, len(shape)))
+    sizes = rng.uniform(1, max_size, size=num_points)
+    return coords, sizes
@@ -0,0 +1,131 @@
+import numpy as np
+from napari.layers import Image
+
+from napari_blob_detection import detect_blobs, detect_channel_blobs, difference_of_gaussian, laplacian_of_gaussian, sweep
+
+from ._data import DENSITIES, SHAPES, make_blobs_image
+
+METHODS = {
+    'difference_of_gaussian': difference_of_gaussian,
+    'laplacian_of_gaussian': laplacian_of_gaussian,
+}
+
+# The minimum and maximum sigmas of the blobs in the image and of the
+# detection parameters.
+SIGMA_RANGES = {
+    'small': (1, 4),
+    'large': (2, 16),
+}
+
+
+class DetectSuite:
+    """ Benchmarks blob detection for different images and parameters. """
+
+    params = (
+        list(SHAPES),
+        list(DENSITIES),
+        list(SIGMA_RANGES),
+        list(METHODS),
+        ['scikit-image', 'fast'],
+    )
+    param_names = ['dims', 'density', 'sigma_range', 'method', 'engine']
+    timeout = 300
+
+    def setup(self, dims, density, sigma_range, method, engine):
+        shape, self.dimensionality = SHAPES[dims]
+        self.min_sigma, self.max_sigma = SIGMA_RANGES[sigma_range]
+        data, _ = make_blobs_image(
+            shape,
+            self.dimensionality,
+            density=DENSITIES[density],
+            min_sigma=self.min_sigma,
+            max_sigma=self.max_sigma,
+        )
+        self.image = Image(data)
+        self.method = METHODS[method]
+        self.engine = engine
+
+    def _detect(self):
+        return self.method(
+            self.image,
+            dimensionality=self.dimensionality,
+            min_sigma=self.min_sigma,
+            max_sigma=self.max_sigma,
+            threshold=0.1,
+            engine=self.engine,
+        )
+
+    def time_detect(self, *args):
+        self._detect()
+
+    def peakmem_detect(self, *args):
+        self._detect()
+
+    def track_num_blobs(self, *args):
+        data, _, _ = self._detect()
+        return len(data)
+
+    track_num_blobs.unit = 'blobs'
+
+
+class SweepSuite:
+    """ Benchmarks sweeping thresholds and sigma ranges against detecting each combination. """
+
+    params = (['2D', '2D+t'], ['sweep', 'separate'])
+    param_names = ['dims', 'mode']
+    timeout = 600
+
+    thresholds = (0.05, 0.1, 0.2, 0.4)
+    sigma_ranges = ((1, 16), (1, 4), (4, 16))
+
+    def setup(self, dims, mode):
+        shape, self.dimensionality = SHAPES[dims]
+        self.data, _ = make_blobs_image(shape, self.dimensionality, density=DENSITIES['sparse'], min_sigma=1, max_sigma=16)
+
+    def time_sweep(self, dims, mode):
+        if mode == 'sweep':
+            sweep(
+                self.data,
+                thresholds=self.thresholds,
+                sigma_ranges=self.sigma_ranges,
+                dimensionality=self.dimensionality,
+                min_sigma=1,
+                max_sigma=16,
+                num_sigma=16,
+            )
+            return
+        for min_sigma, max_sigma in self.sigma_ranges:
+            for threshold in self.thresholds:
+                detect_blobs(
+                    self.data,
+                    dimensionality=self.dimensionality,
+                    min_sigma=min_sigma,
+                    max_sigma=max_sigma,
+                    num_sigma=max_sigma - min_sigma + 1,
+                    threshold=threshold,
+                )
+
+
+class ChannelSuite:
+    """ Benchmarks detecting the channels of an image together against detecting each channel separately. """
+
+    params = (['2D+t'], ['together', 'separate'])
+    param_names = ['dims', 'mode']
+    timeout = 300
+
+    num_channels = 3
+
+    def setup(self, dims, mode):
+        shape, self.dimensionality = SHAPES[dims]
+        channels = [
+            make_blobs_image(shape, self.dimensionality, density=DENSITIES['sparse'], min_sigma=1, max_sigma=4, seed=seed)[0]
+            for seed in range(self.num_channels)
+        ]
+        self.data = np.stack(channels, axis=1)
+
+    def time_detect_channels(self, dims, mode):
+        if mode == 'together':
+            detect_channel_blobs(self.data, channel_axis=1, dimensionality=self.dimensionality, max_sigma=4, threshold=0.1)
+            return
+        for channel in range(self.num_channels):
+            detect_blobs(self.data[:, channel], dimensionality=self.dimensionality, max_sigma=4, threshold=0.1)
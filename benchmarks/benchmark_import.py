@@ -0,0 +1,16 @@
+class ImportSuite:
+    """ Benchmarks importing the package and the modules of its commands in a fresh interpreter. """
+
+    timeout = 120
+
+    def timeraw_import_package(self):
+        return 'import napari_blob_detection'
+
+    def timeraw_import_command_line(self):
+        return 'import napari_blob_detection._cli'
+
+    def timeraw_import_detection(self):
+        return 'from napari_blob_detection import laplacian_of_gaussian'
+
+    def timeraw_import_widget(self):
+        return 'from napari_blob_detection import detect_blobs_widget'
@@ -0,0 +1,37 @@
+import numpy as np
+from napari.layers import Image, Points
+
+from napari_blob_detection import points_to_labels
+
+from ._data import make_points
+
+SHAPES = {
+    '2D': (1024, 1024),
+    '2D+t': (8, 512, 512),
+    '3D': (64, 256, 256),
+}
+
+
+class PointsToLabelsSuite:
+    """ Benchmarks converting points to labels for different images and points. """
+
+    params = (
+        list(SHAPES),
+        [100, 2000],
+        [False, True],
+    )
+    param_names = ['dims', 'num_points', 'sparse']
+    timeout = 300
+
+    def setup(self, dims, num_points, sparse):
+        shape = SHAPES[dims]
+        self.reference_image = Image(np.zeros(shape, dtype=np.uint8))
+        coords, sizes = make_points(shape, num_points=num_points, max_size=12)
+        self.points = Points(coords, size=sizes)
+
+    def time_points_to_labels(self, dims, num_points, sparse):
+        points_to_labels(self.points, self.reference_image, sparse=sparse)
+
+    def peakmem_points_to_labels(self, dims, num_points, sparse):
+        points_to_labels(self.points, self.reference_image, sparse=sparse)
+
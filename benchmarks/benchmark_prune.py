@@ -0,0 +1,32 @@
+import numpy as np
+
+from napari_blob_detection._prune import prune_blobs
+
+# The number of candidate peaks in one slice of a dense field.
+NUM_PEAKS = [10 ** 4, 10 ** 5, 10 ** 6]
+
+
+class PruneSuite:
+    """ Benchmarks pruning overlapping candidate peaks of a dense 2D field. """
+
+    params = NUM_PEAKS
+    param_names = ['num_peaks']
+    timeout = 300
+
+    def setup(self, num_peaks):
+        rng = np.random.default_rng(0)
+        # About the same number of peaks per pixel as a dense field at the
+        # smallest sigma, whatever the number of peaks.
+        width = np.sqrt(num_peaks) * 4
+        self.blobs = np.hstack([
+            rng.uniform(0, width, (num_peaks, 2)),
+            rng.choice([1, 1.6, 2.56, 4.1, 6.55], (num_peaks, 1)),
+        ])
+
+    def time_prune(self, num_peaks):
+        prune_blobs(self.blobs, 0.5)
+
+    def track_num_kept(self, num_peaks):
+        return len(prune_blobs(self.blobs, 0.5))
+
+    track_num_kept.unit = 'blobs'
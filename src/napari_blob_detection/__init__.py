@@ -1,5 +1,66 @@
 __version__ = "0.0.2"
 
-from ._detect import difference_of_gaussian, laplacian_of_gaussian
-from ._points_to_labels import points_to_labels
-from ._widget import difference_of_gaussian, laplacian_of_gaussian, detect_blobs_widget
+import importlib
+from typing import TYPE_CHECKING, Any, List
+
+# Maps each public name to the module that defines it. Modules are only
+# imported when one of their names is first used, e.g. when napari invokes
+# a command of the manifest, so that importing the package (for the
+# manifest, the command line or worker processes) does not import
+# scikit-image, magicgui or napari.
+_LAZY_NAMES = {
+    'Blobs': '_blobs',
+    'detect_blobs': '_blobs',
+    'ScaleSpaceCache': '_cache',
+    'ChannelBlobs': '_channels',
+    'detect_channel_blobs': '_channels',
+    'detect_blobs_in_files': '_cli',
+    'load_blobs': '_io',
+    'blob_intensities': '_measure',
+    'measure_blobs': '_measure',
+    'Profile': '_profile',
+    'Sweep': '_sweep',
+    'sweep': '_sweep',
+    'detect_blobs_in_channels': '_detect',
+    'determinant_of_hessian': '_detect',
+    'difference_of_gaussian': '_detect',
+    'laplacian_of_gaussian': '_detect',
+    'sweep_points': '_detect',
+    'points_to_labels': '_points_to_labels',
+    'detect_blobs_in_channels_widget': '_widget',
+    'detect_blobs_widget': '_widget',
+}
+
+__all__ = list(_LAZY_NAMES)
+
+if TYPE_CHECKING:
+    from ._blobs import Blobs, detect_blobs
+    from ._cache import ScaleSpaceCache
+    from ._channels import ChannelBlobs, detect_channel_blobs
+    from ._cli import detect_blobs_in_files
+    from ._detect import (
+        detect_blobs_in_channels,
+        determinant_of_hessian,
+        difference_of_gaussian,
+        laplacian_of_gaussian,
+        sweep_points,
+    )
+    from ._io import load_blobs
+    from ._measure import blob_intensities, measure_blobs
+    from ._points_to_labels import points_to_labels
+    from ._profile import Profile
+    from ._sweep import Sweep, sweep
+    from ._widget import detect_blobs_in_channels_widget, detect_blobs_widget
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_LAZY_NAMES[name]}', __name__), name)
+    # Later lookups find the name directly.
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
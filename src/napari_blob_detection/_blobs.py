@@ -0,0 +1,681 @@
+import time
+from functools import partial
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterable, Iterator, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from skimage.feature import blob_dog, blob_doh, blob_log
+
+from ._cache import ScaleSpaceCache
+from ._checkpoint import SliceCheckpoint
+from ._lazy import as_dask_array, chunk_sizes, is_dask_array
+from ._parallel import map_in_order, map_with_dask
+from ._scale_space import FAST_METHODS, max_filter_sigma
+from ._profile import Profile, measure
+from ._prune import prune_across_slices, prune_blobs
+from ._mask import blobs_in_mask, check_mask, mask_regions, mask_slice
+from ._tiling import detect_in_tile, halo_size, make_tiles, merge_regions, merge_tiles, profile_tile, tile_grid
+
+# Maps the names of the detection methods to their implementations.
+METHODS = {
+    'difference_of_gaussian': blob_dog,
+    'laplacian_of_gaussian': blob_log,
+    'determinant_of_hessian': blob_doh,
+}
+
+# The implementations of the scale spaces that can be used for detection.
+ENGINES = ('scikit-image', 'fast')
+
+Index = Tuple[int, ...]
+
+# Blobs with sigmas of at least this many pixels of the coarse level of a
+# multiscale image are detected on that level.
+_MIN_COARSE_SIGMA = 2
+
+# Smaller blobs are weakened by downsampling, so their candidates are found
+# on the coarse level with this fraction of the threshold, and with sigmas
+# of at least this many pixels of the coarse level.
+_CANDIDATE_THRESHOLD_RATIO = 0.5
+_MIN_CANDIDATE_SIGMA = 1
+
+# The factor by which the scale ranges of the levels overlap around the split.
+_SPLIT_MARGIN = 2
+
+# Spacings that only differ by this relative tolerance, like the rounding of
+# calibrated pixel sizes, are isotropic.
+_ISOTROPIC_RTOL = 1e-3
+
+
+class Blobs(NamedTuple):
+    """ The blobs detected in an array.
+
+    The rows of the blobs in the i-th detected slice are
+    `slice_offsets[i]:slice_offsets[i + 1]` and that slice's leading
+    dimension index is `slice_indices[i]`.
+    """
+    coords: np.ndarray
+    sigmas: np.ndarray
+    slice_indices: np.ndarray
+    slice_offsets: np.ndarray
+
+
+def detect_blobs(
+    data: np.ndarray,
+    *,
+    method: Union[str, Callable[..., np.ndarray]] = 'laplacian_of_gaussian',
+    dimensionality: int = 2,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    threshold: float = 0.5,
+    **kwargs,
+) -> Blobs:
+    """ Detects blobs in an array without needing napari layers.
+
+    Parameters
+    ----------
+    data : array-like or list of array-like
+        The image data. Can be a NumPy, dask or zarr array with at least
+        as many dimensions as the features, or a list of the levels of a
+        multiscale image from the full resolution level to the coarsest.
+    method : str or Callable
+        Either 'difference_of_gaussian', 'laplacian_of_gaussian',
+        'determinant_of_hessian', or a function like
+        `skimage.feature.blob_log`.
+    dimensionality : int
+        The dimensionality of the blobs to find. Any leading extra dimensions
+        are iterated over.
+    min_sigma : float
+        The smallest blob size to detect.
+    max_sigma : float
+        The largest blob size to detect.
+    threshold : float
+        Reduce this to detect blobs with lower intensities.
+    **kwargs
+        The other options of `difference_of_gaussian`, like `engine`,
+        `num_workers`, `worker_type`, `tile_size`, `cache`, `indices`,
+        `checkpoint_dir` and `coarse_level`, a `Profile` to record where
+        time goes, or the `spacing` of the pixels along each feature
+        dimension for anisotropic data. With a spacing, the sigmas are in
+        pixels of the last dimension.
+
+    Returns
+    -------
+    Blobs
+        The coordinates and sigmas of the blobs, and the table of which
+        rows belong to each detected slice.
+    """
+    if isinstance(data, (list, tuple)):
+        iter_blobs = iter_multiscale_slice_blobs
+        ndim = data[0].ndim
+    else:
+        iter_blobs = iter_slice_blobs
+        ndim = data.ndim
+    slice_blobs = iter_blobs(
+        data,
+        method=get_method(method),
+        dimensionality=dimensionality,
+        min_sigma=min_sigma,
+        max_sigma=max_sigma,
+        threshold=threshold,
+        **kwargs,
+    )
+    return assemble_blobs(
+        slice_blobs,
+        ndim=ndim,
+        dimensionality=dimensionality,
+        profile=kwargs.get('profile'),
+    )
+
+
+def get_method(method: Union[str, Callable[..., np.ndarray]]) -> Callable[..., np.ndarray]:
+    """ Returns the detection method with the given name or the given method. """
+    if callable(method):
+        return method
+    if method not in METHODS:
+        raise ValueError(f'Unknown method ({method}). Must be one of {tuple(METHODS)}.')
+    return METHODS[method]
+
+
+def get_engine_method(method: Callable[..., np.ndarray], engine: str) -> Callable[..., np.ndarray]:
+    """ Returns the implementation of a scikit-image detection method for an engine. """
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine ({engine}). Must be one of {ENGINES}.')
+    if engine == 'scikit-image':
+        return method
+    if method not in FAST_METHODS:
+        raise ValueError(f'The {engine} engine does not support {method.__name__}.')
+    return FAST_METHODS[method]
+
+
+def sigmas_per_axis(sigma: float, spacing: Sequence[float]) -> Union[float, Tuple[float, ...]]:
+    """ Converts a sigma in pixels of the last feature dimension to pixels of each feature dimension.
+
+    A single sigma is returned when the spacing is isotropic, within a
+    relative tolerance of 0.1%, so that detection is the same as without a
+    spacing.
+    """
+    return _level_sigma(sigma, _spacing_ratios(spacing))
+
+
+def num_sigma_columns(min_sigma: Union[float, Sequence[float]], dimensionality: int) -> int:
+    """ Returns the number of sigma columns of blobs detected with the given min_sigma.
+
+    Like scikit-image, blobs have one sigma when it is the same along every
+    dimension and otherwise one per dimension.
+    """
+    sigma = np.asarray(min_sigma, dtype=float)
+    return 1 if np.all(sigma == sigma.flat[0]) else dimensionality
+
+
+def iter_slice_blobs(
+    data: np.ndarray,
+    *,
+    method: Callable[..., np.ndarray],
+    dimensionality: int = 2,
+    engine: str = 'scikit-image',
+    num_workers: int = 1,
+    worker_type: str = 'thread',
+    tile_size: int = 0,
+    cache: Optional[ScaleSpaceCache] = None,
+    cache_key: Hashable = None,
+    indices: Optional[Iterable[Index]] = None,
+    checkpoint_dir: Optional[Path] = None,
+    prune_window: int = 0,
+    mask: Optional[Any] = None,
+    regions: Optional[Callable[[Index], np.ndarray]] = None,
+    spacing: Optional[Sequence[float]] = None,
+    profile: Optional[Profile] = None,
+    **kwargs,
+) -> Iterator[Tuple[Index, np.ndarray]]:
+    """ Lazily detects blobs in each leading dimension slice of some data.
+
+    Yields the index of each slice with the blobs in it, in index order.
+    The blobs are in the format returned by `method`, with coordinates
+    relative to the slice.
+    If a cache is given, the cache key should identify the data and defaults
+    to the identity of the data.
+    If a checkpoint directory is given, the blobs of each slice are saved
+    there and slices that were saved with the same parameters and data are
+    loaded instead of detected.
+    If the prune window is positive, blobs are also pruned against blobs in
+    slices up to that many steps away along the last leading dimension,
+    after any checkpointing.
+    If a mask is given, only the bounding boxes of its regions, padded by
+    the tiles' halo, are detected and blobs whose centers are outside of it
+    are discarded. Its nonzero values are inside the mask and it should have
+    the shape of the data or of the feature dimensions.
+    If a regions function is given instead, it should return the start and
+    stop corners of boxes in the feature dimensions of a slice, with the
+    shape (n, 2, dimensionality), and only those boxes are detected.
+    If a spacing is given, it is the size of the pixels along each feature
+    dimension, like the scale of an image layer, and the sigmas are in pixels
+    of the last dimension. When the spacing is anisotropic, each blob has a
+    sigma per feature dimension, which is detected on the native grid.
+    If a profile is given, the stages of detection and the duration of each
+    detected slice are recorded in it.
+    """
+    if data.ndim < dimensionality:
+        raise ValueError(f'The input image has fewer dimensions ({data.ndim}) than the feature dimensionality ({dimensionality})')
+    if spacing is not None:
+        for name in ('min_sigma', 'max_sigma'):
+            if name in kwargs:
+                kwargs[name] = sigmas_per_axis(kwargs[name], spacing)
+    if indices is None:
+        indices = np.ndindex(data.shape[:-dimensionality])
+    if mask is not None:
+        check_mask(mask, data.shape, dimensionality)
+    if prune_window > 0:
+        slice_blobs = iter_slice_blobs(
+            data,
+            method=method,
+            dimensionality=dimensionality,
+            engine=engine,
+            num_workers=num_workers,
+            worker_type=worker_type,
+            tile_size=tile_size,
+            cache=cache,
+            cache_key=cache_key,
+            indices=indices,
+            checkpoint_dir=checkpoint_dir,
+            mask=mask,
+            regions=regions,
+            profile=profile,
+            **kwargs,
+        )
+        yield from prune_across_slices(
+            slice_blobs,
+            dimensionality=dimensionality,
+            overlap=kwargs.get('overlap', 0.5),
+            window=prune_window,
+            profile=profile,
+        )
+        return
+    if checkpoint_dir is not None:
+        checkpoint = SliceCheckpoint(
+            checkpoint_dir,
+            data,
+            method=method,
+            dimensionality=dimensionality,
+            engine=engine,
+            tile_size=tile_size,
+            mask=mask,
+            **kwargs,
+        )
+        detect = partial(
+            iter_slice_blobs,
+            data,
+            method=method,
+            dimensionality=dimensionality,
+            engine=engine,
+            num_workers=num_workers,
+            worker_type=worker_type,
+            tile_size=tile_size,
+            cache=cache,
+            cache_key=cache_key,
+            mask=mask,
+            regions=regions,
+            profile=profile,
+            **kwargs,
+        )
+        yield from checkpoint.resume(indices, lambda missing: detect(indices=missing))
+        return
+    # Find features in the last dimensions of the image and iterate over
+    # leading dimensions. Each slice may be further split into overlapping
+    # tiles, which follow the storage chunks of lazy data by default.
+    # Lazy data is always detected using dask's active scheduler, otherwise
+    # tiles are detected concurrently when using multiple workers.
+    # In all cases, results are assembled in index order.
+    # Only the regions of masked slices are tiled.
+    method = get_engine_method(method, engine)
+    indices = [tuple(index) for index in indices]
+    if mask is not None:
+        regions = partial(_mask_regions_of_slice, mask, dimensionality=dimensionality)
+    data = as_dask_array(data)
+    chunks = chunk_sizes(data)
+    grid = tile_grid(
+        data.shape[-dimensionality:],
+        tile_size=tile_size,
+        chunks=None if chunks is None else chunks[-dimensionality:],
+    )
+    # The halo covers the largest filter, which for the Difference of
+    # Gaussian is wider than max_sigma.
+    halo = [halo_size(s) for s in np.broadcast_to(max_filter_sigma(method, **kwargs), dimensionality)]
+    tiles = (
+        tile
+        for index in indices
+        for tile in make_tiles(
+            index,
+            grid,
+            halo=halo,
+            regions=None if regions is None else merge_regions(regions(index)),
+        )
+    )
+    # Scale spaces can only be cached in this process.
+    if is_dask_array(data) or worker_type == 'process':
+        cache = None
+    if cache_key is None:
+        cache_key = (id(data), data.shape, str(data.dtype))
+    detect = partial(detect_in_tile, method=method, cache=cache, cache_key=cache_key, **kwargs)
+    if profile is not None:
+        detect = partial(profile_tile, detect=detect)
+    tasks = ((tile, data[tile.index + tile.outer]) for tile in tiles)
+    if is_dask_array(data):
+        all_tile_coords = map_with_dask(detect, tasks)
+    else:
+        all_tile_coords = map_in_order(
+            detect,
+            tasks,
+            num_workers=num_workers,
+            worker_type=worker_type,
+        )
+    overlap = kwargs.get('overlap', 0.5)
+    sigma_dim = num_sigma_columns(kwargs.get('min_sigma', 1), dimensionality)
+    # Slices without any tiles in their regions have no detected tiles.
+    groups = groupby(all_tile_coords, key=lambda tile_coords: tile_coords[0])
+    next_group = next(groups, None)
+    for index in indices:
+        group = []
+        if next_group is not None and next_group[0] == index:
+            group = list(next_group[1])
+            next_group = next(groups, None)
+        with measure(profile, 'merge'):
+            if regions is None:
+                blobs = merge_tiles([g[1] for g in group], grid=grid, overlap=overlap, sigma_dim=sigma_dim)
+            else:
+                # Blobs can overlap across the edges of regions as well as
+                # the seams of the grid.
+                blobs = prune_blobs(
+                    np.concatenate([np.empty((0, dimensionality + sigma_dim))] + [g[1] for g in group], axis=0),
+                    overlap,
+                    sigma_dim=sigma_dim,
+                )
+        if mask is not None:
+            blobs = blobs_in_mask(blobs, mask_slice(mask, index, dimensionality))
+        if profile is not None:
+            for _, _, tile_profile in group:
+                profile.merge(tile_profile)
+            seconds = sum(g[2].stages['tile'].seconds for g in group)
+            profile.record_slice(index, seconds, blobs.shape[0])
+        yield index, blobs
+
+
+def iter_multiscale_slice_blobs(
+    levels: Sequence[np.ndarray],
+    *,
+    method: Callable[..., np.ndarray],
+    dimensionality: int = 2,
+    coarse_level: int = 0,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    threshold: float = 0.5,
+    cache_key: Hashable = None,
+    indices: Optional[Iterable[Index]] = None,
+    checkpoint_dir: Optional[Path] = None,
+    prune_window: int = 0,
+    mask: Optional[Any] = None,
+    spacing: Optional[Sequence[float]] = None,
+    profile: Optional[Profile] = None,
+    **kwargs,
+) -> Iterator[Tuple[Index, np.ndarray]]:
+    """ Lazily detects blobs in each leading dimension slice of a multiscale image.
+
+    The levels are the arrays of an image pyramid, from the full resolution
+    level to the coarsest, that are downsampled in the feature dimensions.
+    Blobs that are at least `_MIN_COARSE_SIGMA` pixels of the coarse level
+    wide are detected on the coarse level. Smaller blobs are found as
+    candidates on the coarse level with a lower threshold, and are then only
+    detected on the full resolution level in tiles near those candidates.
+    The blobs are yielded like `iter_slice_blobs` with full resolution
+    coordinates and sigmas. If the coarse level is 0, all blobs are detected
+    on the full resolution level.
+    A mask should match the full resolution level, and candidates and blobs
+    outside of it are discarded.
+    A spacing should be the spacing of the full resolution level, which is
+    combined with the downsampling factors of the coarse level.
+    The other options are used like `iter_slice_blobs`.
+    """
+    full = levels[0]
+    coarse_level = min(coarse_level, len(levels) - 1)
+    if coarse_level <= 0:
+        yield from iter_slice_blobs(
+            full,
+            method=method,
+            dimensionality=dimensionality,
+            min_sigma=min_sigma,
+            max_sigma=max_sigma,
+            threshold=threshold,
+            cache_key=cache_key,
+            indices=indices,
+            checkpoint_dir=checkpoint_dir,
+            prune_window=prune_window,
+            mask=mask,
+            spacing=spacing,
+            profile=profile,
+            **kwargs,
+        )
+        return
+    coarse = levels[coarse_level]
+    if full.ndim < dimensionality:
+        raise ValueError(f'The input image has fewer dimensions ({full.ndim}) than the feature dimensionality ({dimensionality})')
+    if coarse.shape[:-dimensionality] != full.shape[:-dimensionality]:
+        raise ValueError(
+            f'The multiscale levels must only be downsampled in the feature dimensions, '
+            f'but level {coarse_level} has the shape {coarse.shape} and level 0 has {full.shape}.'
+        )
+    if mask is not None:
+        check_mask(mask, full.shape, dimensionality)
+    if indices is None:
+        indices = np.ndindex(full.shape[:-dimensionality])
+    detect = partial(
+        iter_multiscale_slice_blobs,
+        levels,
+        method=method,
+        dimensionality=dimensionality,
+        coarse_level=coarse_level,
+        min_sigma=min_sigma,
+        max_sigma=max_sigma,
+        threshold=threshold,
+        cache_key=cache_key,
+        mask=mask,
+        spacing=spacing,
+        profile=profile,
+        **kwargs,
+    )
+    if prune_window > 0:
+        yield from prune_across_slices(
+            detect(indices=indices, checkpoint_dir=checkpoint_dir),
+            dimensionality=dimensionality,
+            overlap=kwargs.get('overlap', 0.5),
+            window=prune_window,
+            profile=profile,
+        )
+        return
+    if checkpoint_dir is not None:
+        checkpoint = SliceCheckpoint(
+            checkpoint_dir,
+            full,
+            method=method,
+            dimensionality=dimensionality,
+            level_shapes=repr([level.shape for level in levels]),
+            coarse_level=coarse_level,
+            min_sigma=min_sigma,
+            max_sigma=max_sigma,
+            threshold=threshold,
+            mask=mask,
+            spacing=None if spacing is None else [float(s) for s in spacing],
+            # Like iter_slice_blobs, only the options that affect the blobs.
+            **{k: v for k, v in kwargs.items() if k not in ('num_workers', 'worker_type', 'cache')},
+        )
+        yield from checkpoint.resume(indices, lambda missing: detect(indices=missing))
+        return
+    indices = [tuple(index) for index in indices]
+    factors = np.array(full.shape[-dimensionality:]) / np.array(coarse.shape[-dimensionality:])
+    # Sigmas are in pixels of the last dimension of the full resolution
+    # level, which are converted to pixels of each dimension of a level by
+    # these ratios.
+    ratios = np.ones(dimensionality) if spacing is None else _spacing_ratios(spacing)
+    coarse_ratios = ratios / factors
+    sigma_dim = num_sigma_columns(ratios, dimensionality)
+    # Blobs with sigmas of at least this are detected on the coarse level.
+    split_sigma = _MIN_COARSE_SIGMA / coarse_ratios.min()
+
+    # Only the stages of detecting each level are added to the profile, so
+    # that each slice is only recorded once.
+    level_profile = None if profile is None else Profile()
+
+    def detect_level(data, level, **level_kwargs):
+        return iter_slice_blobs(
+            data,
+            method=method,
+            dimensionality=dimensionality,
+            cache_key=None if cache_key is None else (cache_key, level),
+            profile=level_profile,
+            **{**kwargs, **level_kwargs},
+        )
+
+    # Each level also detects sigmas on the other side of the split, so that
+    # blobs near the split are found as peaks inside the scale range of a
+    # level rather than at its edge, and then only keeps its own blobs.
+    large_blobs = None
+    if max_sigma >= split_sigma:
+        large_blobs = detect_level(
+            coarse,
+            coarse_level,
+            indices=indices,
+            min_sigma=_level_sigma(max(min_sigma, split_sigma / _SPLIT_MARGIN), coarse_ratios),
+            max_sigma=_level_sigma(max_sigma, coarse_ratios),
+            threshold=threshold,
+        )
+    candidates = None
+    if min_sigma < split_sigma:
+        candidates = detect_level(
+            coarse,
+            coarse_level,
+            indices=indices,
+            min_sigma=_level_sigma(max(min_sigma, _MIN_CANDIDATE_SIGMA / coarse_ratios.min()), coarse_ratios),
+            max_sigma=_level_sigma(min(max_sigma, split_sigma), coarse_ratios),
+            threshold=threshold * _CANDIDATE_THRESHOLD_RATIO,
+        )
+    overlap = kwargs.get('overlap', 0.5)
+    try:
+        for index in indices:
+            start = time.perf_counter()
+            slice_blobs = [np.empty((0, dimensionality + sigma_dim))]
+            if large_blobs is not None:
+                _, blobs = next(large_blobs)
+                blobs = _to_full_resolution(blobs, factors, ratios)
+                slice_blobs.append(blobs[(blobs[:, -1] >= split_sigma) | (min_sigma >= split_sigma)])
+            if candidates is not None:
+                _, blobs = next(candidates)
+                blobs = _to_full_resolution(blobs, factors, ratios)
+                if mask is not None:
+                    blobs = blobs_in_mask(blobs, mask_slice(mask, index, dimensionality))
+                boxes = _candidate_regions(
+                    blobs,
+                    shape=full.shape[-dimensionality:],
+                    min_radius=split_sigma * ratios + factors,
+                )
+                if boxes.shape[0] > 0:
+                    fine_blobs = detect_level(
+                        full,
+                        0,
+                        indices=[index],
+                        regions=lambda _: boxes,
+                        min_sigma=_level_sigma(min_sigma, ratios),
+                        max_sigma=_level_sigma(min(max_sigma, split_sigma * _SPLIT_MARGIN), ratios),
+                        threshold=threshold,
+                    )
+                    _, blobs = next(fine_blobs)
+                    fine_blobs.close()
+                    slice_blobs.append(blobs[(blobs[:, -1] < split_sigma) | (max_sigma < split_sigma)])
+            blobs = np.concatenate(slice_blobs, axis=0)
+            if mask is not None:
+                blobs = blobs_in_mask(blobs, mask_slice(mask, index, dimensionality))
+            with measure(profile, 'prune_levels') as measurement:
+                blobs = prune_blobs(blobs, overlap, sigma_dim=sigma_dim)
+                measurement.nbytes = blobs.nbytes
+            if profile is not None:
+                profile.record_slice(index, time.perf_counter() - start, blobs.shape[0])
+            yield index, blobs
+    finally:
+        for level_blobs in (large_blobs, candidates):
+            if level_blobs is not None:
+                level_blobs.close()
+        if profile is not None:
+            profile.merge(level_profile, slices=False)
+
+
+def _mask_regions_of_slice(mask: Any, index: Index, *, dimensionality: int) -> np.ndarray:
+    return mask_regions(mask_slice(mask, index, dimensionality))
+
+
+def _spacing_ratios(spacing: Sequence[float]) -> np.ndarray:
+    # Returns the number of pixels along each dimension that have the size
+    # of one pixel along the last dimension.
+    spacing = np.abs(np.asarray(spacing, dtype=float))
+    if np.allclose(spacing, spacing[-1], rtol=_ISOTROPIC_RTOL, atol=0):
+        return np.ones_like(spacing)
+    return spacing[-1] / spacing
+
+
+def _level_sigma(sigma: float, ratios: np.ndarray) -> Union[float, Tuple[float, ...]]:
+    # Converts a sigma in pixels of the last dimension of the full resolution
+    # level to pixels of each dimension of a level, with a single sigma when
+    # it is the same along every dimension.
+    sigmas = sigma * ratios
+    if np.all(sigmas == sigmas[-1]):
+        return float(sigmas[-1])
+    return tuple(float(s) for s in sigmas)
+
+
+def _to_full_resolution(blobs: np.ndarray, factors: np.ndarray, ratios: np.ndarray) -> np.ndarray:
+    # Maps blobs from a level that is downsampled by the given factors to the
+    # full resolution level, where each pixel of the level covers a block of
+    # full resolution pixels. The sigmas along the last dimension are
+    # converted to each dimension by the ratios of the full resolution level.
+    dimensionality = factors.size
+    coords = blobs[:, :dimensionality] * factors + (factors - 1) / 2
+    sigmas = blobs[:, -1:] * factors[-1]
+    if num_sigma_columns(ratios, dimensionality) > 1:
+        sigmas = sigmas * ratios
+    return np.hstack([coords, sigmas]).astype(np.float64)
+
+
+def _candidate_regions(candidates: np.ndarray, *, shape: Sequence[int], min_radius: np.ndarray) -> np.ndarray:
+    # Returns the boxes around candidates that contain any smaller blobs that
+    # they may be made of, clipped to the shape.
+    dimensionality = len(shape)
+    centers = candidates[:, :dimensionality]
+    radius = np.maximum(np.sqrt(dimensionality) * candidates[:, dimensionality:], min_radius)
+    starts = np.clip(np.floor(centers - radius), 0, shape)
+    stops = np.clip(np.ceil(centers + radius) + 1, 0, shape)
+    nonempty = np.all(stops > starts, axis=1)
+    return np.stack([starts[nonempty], stops[nonempty]], axis=1)
+
+
+def assemble_blobs(
+    slice_blobs: Iterable[Tuple[Tuple[int, ...], np.ndarray]],
+    *,
+    ndim: int,
+    dimensionality: int,
+    profile: Optional[Profile] = None,
+) -> Blobs:
+    """ Assembles the blobs of many slices into contiguous arrays.
+
+    If a profile is given, detecting all of the slices and assembling their
+    blobs are recorded in it as separate stages.
+    """
+    if profile is None:
+        return _assemble_blobs(slice_blobs, ndim=ndim, dimensionality=dimensionality)
+    with measure(profile, 'slices'):
+        slice_blobs = list(slice_blobs)
+    with measure(profile, 'assemble') as measurement:
+        blobs = _assemble_blobs(slice_blobs, ndim=ndim, dimensionality=dimensionality)
+        measurement.nbytes = blobs.coords.nbytes + blobs.sigmas.nbytes
+    return blobs
+
+
+def _assemble_blobs(
+    slice_blobs: Iterable[Tuple[Tuple[int, ...], np.ndarray]],
+    *,
+    ndim: int,
+    dimensionality: int,
+) -> Blobs:
+    num_leading = ndim - dimensionality
+    index_blocks = []
+    coord_blocks = []
+    sigma_blocks = []
+    counts = []
+    for index, blobs in slice_blobs:
+        index_blocks.append(index)
+        coord_blocks.append(blobs[:, :dimensionality])
+        sigma_blocks.append(blobs[:, -1])
+        counts.append(blobs.shape[0])
+    slice_indices = np.array(index_blocks, dtype=int).reshape(len(index_blocks), num_leading)
+    slice_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=slice_offsets[1:])
+    all_coords = np.empty((slice_offsets[-1], ndim), dtype=np.float64)
+    all_coords[:, :num_leading] = np.repeat(slice_indices, counts, axis=0)
+    if len(coord_blocks) > 0:
+        all_coords[:, num_leading:] = np.concatenate(coord_blocks, axis=0)
+        all_sigmas = np.concatenate(sigma_blocks).astype(np.float64)
+    else:
+        all_sigmas = np.empty((0,), dtype=np.float64)
+    return Blobs(all_coords, all_sigmas, slice_indices, slice_offsets)
+
+
+def slice_rows(metadata: Mapping[str, np.ndarray], index: Tuple[int, ...]) -> slice:
+    """ Returns the rows of the blobs in one slice of detection results.
+
+    The metadata should contain the slice indices and offsets of detection
+    results, like the metadata of the points layer returned by detection.
+    If the slice was not detected, the returned rows are empty.
+    """
+    slice_indices = metadata['slice_indices']
+    offsets = metadata['slice_offsets']
+    matches = np.flatnonzero(np.all(slice_indices == index, axis=1))
+    if matches.size == 0:
+        return slice(0, 0)
+    i = matches[0]
+    return slice(int(offsets[i]), int(offsets[i + 1]))
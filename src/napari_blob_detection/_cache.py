@@ -0,0 +1,132 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterator, Optional
+
+import numpy as np
+
+from ._profile import Profile, measure
+from ._scale_space import SCALE_SPACES, ScaleSpace, find_blobs
+
+
+class ScaleSpaceCache:
+    """ A least recently used cache of scale spaces with a memory budget.
+
+    Computing a scale space is the most expensive part of blob detection,
+    but it only depends on the image data and the sigma parameters.
+    Caching it means that only changing the threshold just needs to find
+    peaks again, which makes interactive tuning much faster.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total number of bytes of the cached scale spaces.
+        The least recently used scale spaces are evicted to stay within this.
+    """
+
+    def __init__(self, max_bytes: int = 2 ** 30):
+        self.max_bytes = max_bytes
+        self._items: 'OrderedDict[Hashable, ScaleSpace]' = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        """ The total number of bytes of the cached scale spaces. """
+        return self._nbytes
+
+    def get(self, key: Hashable) -> Optional[ScaleSpace]:
+        """ Returns the scale space for the given key or None if it is not cached. """
+        with self._lock:
+            scale_space = self._items.get(key)
+            if scale_space is not None:
+                self._items.move_to_end(key)
+            return scale_space
+
+    def put(self, key: Hashable, scale_space: ScaleSpace) -> None:
+        """ Caches a scale space, evicting others as needed to stay within budget.
+
+        Scale spaces that are larger than the whole budget are not cached.
+        """
+        nbytes = scale_space.nbytes
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes
+            while self._items and self._nbytes + nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+            self._items[key] = scale_space
+            self._nbytes += nbytes
+
+    def evict(self, data_key: Hashable) -> None:
+        """ Removes the cached scale spaces of some data.
+
+        These are the scale spaces whose keys given to `detect_with_cache`
+        start with the data key, possibly nested in tuples like the keys of
+        tiles.
+        """
+        with self._lock:
+            stale = [key for key in self._items if any(data_key == k for k in _leading_keys(key))]
+            for key in stale:
+                self._nbytes -= self._items.pop(key).nbytes
+
+    def clear(self) -> None:
+        """ Removes all cached scale spaces. """
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
+
+
+def detect_with_cache(
+    image: np.ndarray,
+    *,
+    method: Callable[..., np.ndarray],
+    cache: Optional[ScaleSpaceCache],
+    key: Hashable,
+    threshold: float,
+    overlap: float = 0.5,
+    profile: Optional[Profile] = None,
+    **kwargs,
+) -> np.ndarray:
+    """ Detects blobs like the given method, but reuses cached scale spaces.
+
+    The key should identify the image data. It is combined with the method,
+    its scale space parameters and a fingerprint of the image's contents to
+    make the key of the cached scale space, so that data that was edited in
+    place or reuses the key of other data is never detected with a stale
+    scale space.
+    If the cache is None, this just detects blobs in separate stages, which
+    are recorded in the profile if one is given.
+    """
+    if cache is not None:
+        key = (key, method.__name__, tuple(sorted(kwargs.items())), _fingerprint(image))
+    scale_space = None if cache is None else cache.get(key)
+    if scale_space is None:
+        with measure(profile, 'scale_space') as measurement:
+            scale_space = SCALE_SPACES[method](image, **kwargs)
+            measurement.nbytes = scale_space.nbytes
+        if cache is not None:
+            cache.put(key, scale_space)
+    return find_blobs(scale_space, threshold=threshold, overlap=overlap, profile=profile)
+
+
+def _fingerprint(image: np.ndarray) -> bytes:
+    # Hashing the image is much faster than computing its scale space.
+    image = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(image.view(np.uint8).reshape(-1), digest_size=16)
+    digest.update(repr((image.shape, image.dtype.str)).encode())
+    return digest.digest()
+
+
+def _leading_keys(key: Hashable) -> Iterator[Hashable]:
+    # Yields a key and the first elements of nested tuple keys.
+    yield key
+    while isinstance(key, tuple) and len(key) > 0:
+        key = key[0]
+        yield key
@@ -0,0 +1,190 @@
+from functools import partial
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ._blobs import Blobs, Index, assemble_blobs, get_method, iter_slice_blobs
+from ._mask import check_mask, mask_slice
+from ._parallel import map_in_order
+from ._profile import Profile, measure
+
+
+class ChannelBlobs(NamedTuple):
+    """ The blobs detected in several channels of the same image.
+
+    The blobs of all channels of each leading dimension slice are together,
+    in channel order, so the slice table of the blobs covers all channels.
+    The channel of each blob is the index of its array or of its position
+    along the channel axis. The axis sigmas are the sigma of each blob in
+    pixels of each feature dimension, which differ for anisotropic spacings
+    and are the same for channels with a single sigma.
+    """
+    blobs: Blobs
+    channels: np.ndarray
+    axis_sigmas: np.ndarray
+
+
+def detect_channel_blobs(
+    data: Union[Any, Sequence[Any]],
+    *,
+    channel_axis: Optional[int] = None,
+    parameters: Optional[Sequence[Mapping[str, Any]]] = None,
+    method: Union[str, Callable[..., np.ndarray]] = 'laplacian_of_gaussian',
+    dimensionality: int = 2,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    threshold: float = 0.5,
+    num_workers: int = 1,
+    worker_type: str = 'thread',
+    indices: Optional[Iterable[Index]] = None,
+    mask: Optional[Any] = None,
+    profile: Optional[Profile] = None,
+    **kwargs,
+) -> ChannelBlobs:
+    """ Detects blobs in several channels of an image, reading each slice once.
+
+    Each leading dimension slice of all of the channels is read once, and
+    the channels of each slice are detected concurrently when using multiple
+    workers, so channels that are stored together, like the channel axis
+    of a zarr array, are only read from storage once.
+
+    Parameters
+    ----------
+    data : array-like or Sequence[array-like]
+        Either one NumPy, dask or zarr array per channel, which must all have
+        the same shape, or one array with a channel axis.
+    channel_axis : int, optional
+        The axis of the channels of a single array, which must be one of its
+        leading dimensions. The blobs' coordinates do not include it.
+    parameters : Sequence[Mapping[str, Any]], optional
+        The parameters of each channel, like `threshold`, `min_sigma`,
+        `max_sigma` or `method`, which override those that are shared by all
+        channels. If None, all channels use the shared parameters.
+    method : str or Callable
+        The detection method of the channels, like in `detect_blobs`.
+    dimensionality : int
+        The dimensionality of the blobs to find. Any leading extra dimensions
+        are iterated over.
+    min_sigma : float
+        The smallest blob size to detect.
+    max_sigma : float
+        The largest blob size to detect.
+    threshold : float
+        Reduce this to detect blobs with lower intensities.
+    num_workers : int
+        The number of workers used to detect the channels and slices
+        concurrently. If 1, they are detected serially.
+    worker_type : Literal['thread', 'process']
+        Whether to use a pool of threads or processes for the workers.
+    indices : Iterable[Tuple[int, ...]], optional
+        If given, only detect blobs on the slices with these leading
+        dimension indices (without the channel axis), in this order.
+        Otherwise detect all slices.
+    mask : array-like, optional
+        If given, only detect blobs whose centers are inside this mask in
+        every channel, like in `detect_blobs`. It should have the shape of a
+        channel or of its feature dimensions.
+    profile : Profile, optional
+        If given, reading the slices is recorded in it.
+    **kwargs
+        The other parameters shared by all channels, like `engine`,
+        `tile_size` and `spacing`.
+
+    Returns
+    -------
+    ChannelBlobs
+        The blobs of all channels and the channel of each blob.
+    """
+    read_slice, num_channels, shape = _channel_reader(data, channel_axis, dimensionality)
+    if parameters is None:
+        parameters = [{}] * num_channels
+    if len(parameters) != num_channels:
+        raise ValueError(f'There are {len(parameters)} sets of parameters, but {num_channels} channels.')
+    shared_kwargs = {
+        'method': method,
+        'min_sigma': min_sigma,
+        'max_sigma': max_sigma,
+        'threshold': threshold,
+        **kwargs,
+    }
+    channel_kwargs = [{**shared_kwargs, **channel_parameters} for channel_parameters in parameters]
+    if indices is None:
+        indices = np.ndindex(shape[:len(shape) - dimensionality])
+    indices = [tuple(index) for index in indices]
+    if mask is not None:
+        check_mask(mask, shape, dimensionality)
+
+    def _tasks() -> Iterator[Tuple[Index, int, np.ndarray, Optional[np.ndarray]]]:
+        for index in indices:
+            with measure(profile, 'read') as measurement:
+                images = read_slice(index)
+                measurement.nbytes = sum(image.nbytes for image in images)
+            # All channels of a slice share its mask.
+            slice_mask = None if mask is None else mask_slice(mask, index, dimensionality)
+            for channel, image in enumerate(images):
+                yield index, channel, image, slice_mask
+
+    results = map_in_order(
+        partial(_detect_channel, channel_kwargs=channel_kwargs),
+        _tasks(),
+        num_workers=num_workers,
+        worker_type=worker_type,
+    )
+    channels = [np.empty(0, dtype=int)]
+    slice_blobs = []
+    for index, group in groupby(results, key=lambda result: result[0]):
+        blocks = [(channel, blobs) for _, channel, blobs in group]
+        channels.extend(np.full(blobs.shape[0], channel) for channel, blobs in blocks)
+        # Channels may have one sigma or one per dimension, so pad them all
+        # to one per dimension, whose last one is the sigma of the blobs.
+        slice_blobs.append((index, np.concatenate([
+            np.hstack([
+                blobs[:, :dimensionality],
+                np.broadcast_to(blobs[:, dimensionality:], (blobs.shape[0], dimensionality)),
+            ])
+            for _, blobs in blocks
+        ] + [np.empty((0, 2 * dimensionality))], axis=0)))
+    axis_sigmas = np.concatenate([blobs[:, dimensionality:] for _, blobs in slice_blobs] + [np.empty((0, dimensionality))])
+    blobs = assemble_blobs(slice_blobs, ndim=len(shape), dimensionality=dimensionality)
+    return ChannelBlobs(blobs, np.concatenate(channels).astype(int), axis_sigmas)
+
+
+def _channel_reader(
+    data: Union[Any, Sequence[Any]],
+    channel_axis: Optional[int],
+    dimensionality: int,
+) -> Tuple[Callable[[Index], Sequence[np.ndarray]], int, Tuple[int, ...]]:
+    # Returns a function that reads one leading dimension slice of all
+    # channels, the number of channels, and the shape of each channel.
+    if channel_axis is None:
+        if len(data) == 0:
+            raise ValueError('At least one channel is needed.')
+        shapes = {tuple(channel.shape) for channel in data}
+        if len(shapes) > 1:
+            raise ValueError(f'All channels must have the same shape, but they have the shapes {sorted(shapes)}.')
+        return (lambda index: [np.asarray(channel[index]) for channel in data]), len(data), shapes.pop()
+    num_leading = data.ndim - dimensionality
+    axis = channel_axis + data.ndim if channel_axis < 0 else channel_axis
+    if not 0 <= axis < num_leading:
+        raise ValueError(f'The channel axis ({channel_axis}) must be one of the {num_leading} leading dimensions.')
+
+    def _read(index: Index) -> np.ndarray:
+        # One read of the block of all channels, which is then split.
+        return np.asarray(data[index[:axis] + (slice(None),) + index[axis:]])
+
+    shape = data.shape[:axis] + data.shape[axis + 1:]
+    return _read, data.shape[axis], shape
+
+
+def _detect_channel(
+    task: Tuple[Index, int, np.ndarray, Optional[np.ndarray]],
+    *,
+    channel_kwargs: Sequence[Dict[str, Any]],
+) -> Tuple[Index, int, np.ndarray]:
+    # Detects the blobs of one channel of one slice.
+    index, channel, image, mask = task
+    kwargs = dict(channel_kwargs[channel])
+    method = get_method(kwargs.pop('method'))
+    _, blobs = next(iter_slice_blobs(image, method=method, dimensionality=image.ndim, indices=[()], mask=mask, **kwargs))
+    return index, channel, blobs
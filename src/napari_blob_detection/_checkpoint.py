@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+Index = Tuple[int, ...]
+
+# Array parameters with more elements than this are hashed rather than listed.
+_MAX_LISTED_SIZE = 64
+
+
+class SliceCheckpoint:
+    """ Persists the blobs of each detected slice so that detection can resume.
+
+    The blobs of each slice are saved to their own file in a subdirectory of
+    the checkpoint directory that is named by a hash of the detection
+    parameters and the shape and type of the data. Each file also contains a
+    hash of the slice's data, and is only reused while that data is the same.
+    Files are written to a temporary path and then renamed, so a file either
+    contains a complete slice or does not exist.
+
+    Parameters
+    ----------
+    directory : Path
+        The checkpoint directory, which is created if needed.
+    data : array-like
+        The data that blobs are detected in.
+    **parameters
+        All of the parameters that affect the detected blobs.
+    """
+
+    def __init__(self, directory: Path, data: Any, **parameters):
+        self._data = data
+        description = {
+            'shape': list(data.shape),
+            'dtype': str(data.dtype),
+            'parameters': {k: _describe(v) for k, v in sorted(parameters.items())},
+        }
+        text = json.dumps(description, sort_keys=True)
+        self.directory = Path(directory) / hashlib.sha256(text.encode()).hexdigest()[:16]
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Only for people looking at the directory, since the name is a hash.
+        _write_atomically(self.directory / 'parameters.json', text.encode())
+
+    def is_finished(self, index: Index) -> bool:
+        """ Returns True if the blobs in a slice are saved and its data has not changed. """
+        path = self._path(index)
+        if not path.exists():
+            return False
+        with np.load(path) as saved:
+            return str(saved['data_hash']) == self._data_hash(index)
+
+    def load(self, index: Index) -> np.ndarray:
+        """ Loads the saved blobs in a slice. """
+        with np.load(self._path(index)) as saved:
+            return saved['blobs']
+
+    def save(self, index: Index, blobs: np.ndarray) -> None:
+        """ Saves the blobs in a slice. """
+        with _open_atomically(self._path(index)) as file:
+            np.savez(file, blobs=blobs, data_hash=self._data_hash(index))
+
+    def resume(
+        self,
+        indices: Iterable[Index],
+        detect: Callable[[List[Index]], Iterator[Tuple[Index, np.ndarray]]],
+    ) -> Iterator[Tuple[Index, np.ndarray]]:
+        """ Yields the blobs in each slice, only detecting unfinished slices.
+
+        The detect function is given the indices of the unfinished slices and
+        should yield the blobs in each, in that order.
+        The blobs in each slice are saved as soon as they are detected.
+        """
+        indices = [tuple(index) for index in indices]
+        finished = {index for index in indices if self.is_finished(index)}
+        detected = detect([index for index in indices if index not in finished])
+        try:
+            for index in indices:
+                if index in finished:
+                    yield index, self.load(index)
+                else:
+                    index, blobs = next(detected)
+                    self.save(index, blobs)
+                    yield index, blobs
+        finally:
+            detected.close()
+
+    def _path(self, index: Index) -> Path:
+        name = '_'.join(map(str, index)) if len(index) > 0 else 'all'
+        return self.directory / f'{name}.npz'
+
+    def _data_hash(self, index: Index) -> str:
+        data = np.ascontiguousarray(self._data[index])
+        digest = hashlib.blake2b(data.view(np.uint8).reshape(-1), digest_size=16)
+        return digest.hexdigest()
+
+
+class _open_atomically:
+    # Opens a temporary file for writing that replaces the path when closed
+    # without an error.
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._partial_path = self._path.with_name(self._path.name + '.partial')
+
+    def __enter__(self):
+        self._file = open(self._partial_path, 'wb')
+        return self._file
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+        if exc_type is None:
+            os.replace(self._partial_path, self._path)
+        else:
+            os.remove(self._partial_path)
+
+
+def _write_atomically(path: Path, content: bytes) -> None:
+    with _open_atomically(path) as file:
+        file.write(content)
+
+
+def _describe(value: Any) -> Any:
+    # Describes a parameter value in JSON, using qualified names for functions.
+    if callable(value):
+        return f'{value.__module__}.{value.__qualname__}'
+    if isinstance(value, np.ndarray) or _is_array_like(value):
+        # Large arrays, like masks, are described by a hash of their data.
+        # Lazy arrays, like zarr or dask masks, are read to hash their data
+        # rather than their repr, so that edits to them are not missed.
+        value = np.asarray(value)
+        if value.size > _MAX_LISTED_SIZE:
+            data = np.ascontiguousarray(value)
+            return hashlib.blake2b(data.view(np.uint8).reshape(-1), digest_size=16).hexdigest()
+        return value.tolist()
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    return repr(value)
+
+
+def _is_array_like(value: Any) -> bool:
+    return hasattr(value, 'shape') and hasattr(value, 'dtype') and hasattr(value, '__array__')
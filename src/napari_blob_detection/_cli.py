@@ -0,0 +1,177 @@
+import argparse
+import logging
+import sys
+from functools import partial
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from ._blobs import ENGINES, METHODS, get_method, iter_slice_blobs
+from ._io import OUTPUT_FORMATS, expand_paths, expand_paths_with_roots, is_complete, output_path_for, read_image, relative_dir, write_blobs
+from ._parallel import WORKER_TYPES, map_in_order
+
+logger = logging.getLogger(__name__)
+
+
+def detect_blobs_in_files(
+    paths: Iterable[str],
+    *,
+    output_dir: Optional[Path] = None,
+    output_format: str = 'csv',
+    overwrite: bool = False,
+    method: str = 'laplacian_of_gaussian',
+    dimensionality: int = 2,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    threshold: float = 0.5,
+    checkpoint_dir: Optional[Path] = None,
+    num_workers: int = 1,
+    worker_type: str = 'thread',
+    **kwargs,
+) -> List[Path]:
+    """ Detects blobs in image files and writes them to one file per image.
+
+    Files that already have complete outputs are skipped unless overwriting,
+    so an interrupted batch can be re-run to finish it. The skipped and
+    written files are logged at the INFO level.
+
+    Parameters
+    ----------
+    paths : Iterable[str]
+        The paths of, or glob patterns that match, NumPy (.npy), zarr (.zarr)
+        or TIFF (.tif, .tiff) image files.
+    output_dir : Path, optional
+        The directory of the output files, in which the directories of the
+        images under the fixed start of each glob pattern are mirrored, e.g.
+        'plates/p1/A01.tif' matched by 'plates/**/*.tif' is written to
+        'p1/A01-blobs.csv'. Defaults to the directory of each image file.
+    output_format : Literal['csv', 'parquet', 'zarr']
+        The format of the output files. Parquet requires pyarrow and zarr
+        requires zarr. Both can be loaded a few slices at a time with
+        `load_blobs`.
+    overwrite : bool
+        If True, detect blobs in files that already have outputs.
+    method : str
+        The name of the detection method.
+    dimensionality : int
+        The dimensionality of the blobs to find.
+    min_sigma : float
+        The smallest blob size to detect.
+    max_sigma : float
+        The largest blob size to detect.
+    threshold : float
+        Reduce this to detect blobs with lower intensities.
+    checkpoint_dir : Path, optional
+        If given, the blobs of each finished slice of each image are saved in
+        a subdirectory of this named after the image, which mirrors its
+        directory like the outputs, so that an interrupted run can resume in
+        the middle of an image.
+    num_workers : int
+        The number of files that are detected concurrently, each by one
+        worker. If only one file is detected, its slices are detected
+        concurrently by this many workers instead.
+    worker_type : Literal['thread', 'process']
+        Whether to use a pool of threads or processes for the workers.
+    **kwargs
+        The other options of `detect_blobs`, like `overlap`, `tile_size` and
+        `spacing`.
+
+    Returns
+    -------
+    List[Path]
+        The paths of the output files that were written.
+    """
+    roots = expand_paths_with_roots(paths)
+    tasks = []
+    for path in sorted(roots):
+        # Mirror the directories under the root of each pattern, so images
+        # with the same name in different directories do not collide.
+        output_path = output_path_for(
+            path,
+            path.parent if output_dir is None else output_dir,
+            output_format,
+            root=None if output_dir is None else roots[path],
+        )
+        if is_complete(output_path) and not overwrite:
+            logger.info('Skipping %s because %s exists', path, output_path)
+            continue
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        file_checkpoint_dir = None
+        if checkpoint_dir is not None:
+            file_checkpoint_dir = Path(checkpoint_dir) / relative_dir(path, roots[path]) / path.name
+        tasks.append((path, output_path, file_checkpoint_dir))
+    # Batches of files, like the single slice images of plates, are detected
+    # in parallel one file per worker, rather than nesting pools of workers.
+    file_workers = num_workers if len(tasks) > 1 else 1
+    detect = partial(
+        _detect_file,
+        method=method,
+        dimensionality=dimensionality,
+        min_sigma=min_sigma,
+        max_sigma=max_sigma,
+        threshold=threshold,
+        num_workers=1 if file_workers > 1 else num_workers,
+        worker_type=worker_type,
+        **kwargs,
+    )
+    written = []
+    for path, output_path in map_in_order(detect, tasks, num_workers=file_workers, worker_type=worker_type):
+        logger.info('Wrote blobs in %s to %s', path, output_path)
+        written.append(output_path)
+    return written
+
+
+def _detect_file(
+    task: Tuple[Path, Path, Optional[Path]],
+    *,
+    method: str,
+    dimensionality: int,
+    **kwargs,
+) -> Tuple[Path, Path]:
+    # Detects the blobs in one image file and writes them to its output path.
+    path, output_path, checkpoint_dir = task
+    data = read_image(path)
+    slice_blobs = iter_slice_blobs(
+        data,
+        method=get_method(method),
+        dimensionality=dimensionality,
+        checkpoint_dir=checkpoint_dir,
+        **kwargs,
+    )
+    write_blobs(slice_blobs, output_path, ndim=data.ndim)
+    return path, output_path
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='napari-blob-detection',
+        description='Detects blobs in image files without a viewer.',
+    )
+    parser.add_argument('paths', nargs='+', help='image files or glob patterns (.npy, .zarr, .tif, .tiff)')
+    parser.add_argument('-o', '--output-dir', type=Path, help='directory of the outputs (default: next to each image)')
+    parser.add_argument('--format', dest='output_format', choices=OUTPUT_FORMATS, default='csv')
+    parser.add_argument('--overwrite', action='store_true', help='detect blobs in images that already have outputs')
+    parser.add_argument('--method', choices=tuple(METHODS), default='laplacian_of_gaussian')
+    parser.add_argument('--dimensionality', type=int, choices=(2, 3), default=2)
+    parser.add_argument('--min-sigma', type=float, default=1)
+    parser.add_argument('--max-sigma', type=float, default=50)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--overlap', type=float, default=0.5, help='fraction of a blob that can overlap a larger blob before it is removed')
+    parser.add_argument('--prune-window', type=int, default=0, help='also prune blobs against blobs in slices this many steps away along the last leading dimension')
+    parser.add_argument('--spacing', type=float, nargs='+', help='pixel size along each feature dimension, e.g. 5 1 1 for anisotropic stacks (sigmas are then in pixels of the last dimension)')
+    parser.add_argument('--engine', choices=ENGINES, default='scikit-image', help='implementation of the scale space')
+    parser.add_argument('--num-workers', type=int, default=1, help='number of files, or of slices or tiles of a single file, to detect concurrently')
+    parser.add_argument('--worker-type', choices=WORKER_TYPES, default='thread')
+    parser.add_argument('--tile-size', type=int, default=0, help='size of the tiles of the feature dimensions (default: no tiling)')
+    parser.add_argument('--checkpoint-dir', type=Path, help='directory of the blobs of finished slices, so interrupted runs can resume')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    kwargs = vars(args)
+    paths = kwargs.pop('paths')
+    if len(expand_paths(paths)) == 0:
+        parser.error('no image files match the given paths')
+    detect_blobs_in_files(paths, **kwargs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,49 @@
-from typing import Callable
+import weakref
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
 from typing_extensions import Annotated
-from skimage.feature import blob_dog, blob_log
+from skimage.feature import blob_dog, blob_doh, blob_log
 import numpy as np
-from napari.layers import Image
+from scipy import ndimage as ndi
+from napari.layers import Image, Labels, Layer, Shapes
 from napari.types import LayerDataTuple
+from ._blobs import (
+    ENGINES,
+    Blobs,
+    Index,
+    assemble_blobs,
+    get_method,
+    iter_multiscale_slice_blobs,
+    iter_slice_blobs,
+    sigmas_per_axis,
+)
+from ._cache import ScaleSpaceCache
+from ._channels import detect_channel_blobs
+from ._io import write_blobs
+from ._parallel import WORKER_TYPES
+from ._profile import Profile, measure
+from ._sweep import sweep
 
 # Define common argument types.
 Dimensionality = Annotated[int, {'choices': [2, 3]}]
 MinSigma = Annotated[float, {'min': 0.5, 'max': 15, 'step': 0.5}]
 MaxSigma = Annotated[float, {'min': 1, 'max': 1000, 'step': 0.5}]
 Threshold = Annotated[float, {'min': 0, 'max': 1000, 'step': 0.1}]
+# The determinant of Hessian only supports 2D features and has much smaller responses.
+PlanarDimensionality = Annotated[int, {'choices': [2]}]
+HessianThreshold = Annotated[float, {'min': 0, 'max': 1000, 'step': 0.001}]
+Overlap = Annotated[float, {'min': 0, 'max': 1, 'step': 0.05}]
+PruneWindow = Annotated[int, {'min': 0, 'max': 1000}]
+Engine = Annotated[str, {'choices': list(ENGINES)}]
+NumWorkers = Annotated[int, {'min': 1, 'max': 256}]
+WorkerType = Annotated[str, {'choices': list(WORKER_TYPES)}]
+TileSize = Annotated[int, {'min': 0, 'max': 65536, 'step': 64}]
+CoarseLevel = Annotated[int, {'min': 0, 'max': 32}]
+# A labels or shapes layer, or a boolean array when not using the widget.
+Mask = Optional[Layer]
+Indices = Optional[Sequence[Tuple[int, ...]]]
+CheckpointDir = Annotated[Optional[Path], {'mode': 'd'}]
+BlobsPath = Annotated[Optional[Path], {'mode': 'w', 'filter': '*.parquet *.zarr'}]
 
 
 def difference_of_gaussian(
@@ -19,6 +53,20 @@ def difference_of_gaussian(
     min_sigma: MinSigma = 1,
     max_sigma: MaxSigma = 50,
     threshold: Threshold = 0.5,
+    overlap: Overlap = 0.5,
+    prune_window: PruneWindow = 0,
+    engine: Engine = 'scikit-image',
+    num_workers: NumWorkers = 1,
+    worker_type: WorkerType = 'thread',
+    tile_size: TileSize = 0,
+    coarse_level: CoarseLevel = 0,
+    use_scale: bool = True,
+    mask: Mask = None,
+    cache: Optional[ScaleSpaceCache] = None,
+    indices: Indices = None,
+    checkpoint_dir: CheckpointDir = None,
+    output_path: BlobsPath = None,
+    profile: bool = False,
 ) -> LayerDataTuple:
     """ Detects features points on an image layer using the Difference of Gaussian method.
 
@@ -26,6 +74,11 @@ def difference_of_gaussian(
     features. If the image has more dimensions than the features, this will iterate over
     the leading extra dimensions.
 
+    If the image's scale differs between the feature dimensions, like the z spacing of a
+    confocal stack, the sigmas are in pixels of the last dimension and each blob is
+    detected with a sigma per dimension that follows the scale, without resampling the
+    image. The sigma along each feature axis is added to the features as 'sigma_<axis>'.
+
     Parameters
     ----------
     image : Image
@@ -38,6 +91,81 @@ def difference_of_gaussian(
         The largest blob size to detect.
     threshold : float
         Reduce this to detect blobs with lower intensities.
+    overlap : float
+        A value between 0 and 1. If the fraction of the area (or volume) of a
+        blob that overlaps a larger blob is greater than this, the smaller
+        blob is removed.
+    prune_window : int
+        If positive, blobs are also removed when they overlap larger blobs in
+        slices up to this many steps away along the last leading dimension,
+        e.g. to keep only one of the same blob found in neighboring planes
+        or frames. The slices that only differ in that dimension are pruned
+        together, so their blobs are only returned once all of them are
+        detected.
+    engine : Literal['scikit-image', 'fast']
+        The implementation of the scale space. 'scikit-image' filters the
+        whole image at every sigma like scikit-image does. 'fast' reuses
+        each Gaussian to make the next one, downsamples the image for large
+        sigmas, and uses float32, which is much faster and uses less memory
+        but only approximates scikit-image's results.
+    num_workers : int
+        The number of workers used to detect blobs on the leading dimension
+        slices concurrently. If 1, slices are processed serially.
+        Ignored for dask image data (and zarr image data if dask is
+        installed), which is processed with dask's active scheduler instead.
+    worker_type : Literal['thread', 'process']
+        Whether to use a pool of threads or processes for the workers.
+    tile_size : int
+        If positive, the feature dimensions are processed in tiles of this
+        size that overlap by a halo derived from the largest filter sigma,
+        which bounds peak memory by the tile size rather than the image size.
+        If 0, each slice is processed as a whole, unless the image data is a
+        dask or zarr array in which case tiles follow its storage chunks.
+    coarse_level : int
+        For multiscale images, the pyramid level that larger blobs are
+        detected on. Blobs smaller than 2 pixels of that level are found as
+        candidates on it with a lower threshold and then only detected on the
+        full resolution level near those candidates, which is much faster
+        when blobs are sparse. If 0, or for other images, all blobs are
+        detected on the full resolution level.
+    use_scale : bool
+        If True, the sigmas follow the image's scale along the feature
+        dimensions. If False, the scale is ignored and each blob has the same
+        sigma in pixels of every dimension.
+    mask : Labels, Shapes or np.ndarray, optional
+        If given, only detect blobs whose centers are inside this mask, which
+        is the nonzero labels, the filled shapes or the True values of a
+        boolean array. Only the bounding boxes of the mask's regions, padded
+        by the filters' extent, are filtered, so mostly empty images are
+        processed much faster. Labels and shapes layers are mapped onto the
+        image's pixels through world coordinates, so they can have another
+        scale or transform. An array should have the same shape as the image
+        or as its feature dimensions.
+    cache : ScaleSpaceCache, optional
+        If given, the filtered scale space of each slice or tile is cached,
+        so that running again with only a different threshold just needs to
+        find peaks again. Not used with process workers or dask image data.
+    indices : Sequence[Tuple[int, ...]], optional
+        If given, only detect blobs on the slices with these leading dimension
+        indices, in this order. Otherwise detect blobs on all slices.
+    checkpoint_dir : Path, optional
+        If given, the blobs of each slice are saved in this directory as soon
+        as they are detected, along with a hash of the parameters and of the
+        slice's data. Running again with the same parameters and data loads
+        the saved slices instead of detecting them again, so an interrupted
+        run only needs to detect the slices that it had not finished.
+    output_path : Path, optional
+        If given, stream the blobs of each slice to this Parquet file or zarr
+        store as it is detected, instead of keeping them in memory, and
+        return an empty points layer whose metadata contains the path as
+        'blobs_path'. Use `load_blobs` to load the blobs of some slices.
+        Parquet requires pyarrow and zarr requires zarr.
+    profile : bool
+        If True, record the time spent in each stage of detection (reading
+        data, computing the scale space, finding and pruning peaks, merging
+        tiles and assembling results), the bytes of the arrays each stage
+        allocates, and the duration and number of blobs of each slice.
+        The report is added to the metadata of the points layer as 'profile'.
 
     Returns
     -------
@@ -60,6 +188,20 @@ def laplacian_of_gaussian(
     min_sigma: MinSigma = 1,
     max_sigma: MaxSigma = 50,
     threshold: Threshold = 0.5,
+    overlap: Overlap = 0.5,
+    prune_window: PruneWindow = 0,
+    engine: Engine = 'scikit-image',
+    num_workers: NumWorkers = 1,
+    worker_type: WorkerType = 'thread',
+    tile_size: TileSize = 0,
+    coarse_level: CoarseLevel = 0,
+    use_scale: bool = True,
+    mask: Mask = None,
+    cache: Optional[ScaleSpaceCache] = None,
+    indices: Indices = None,
+    checkpoint_dir: CheckpointDir = None,
+    output_path: BlobsPath = None,
+    profile: bool = False,
 ) -> LayerDataTuple:
     """ Detects features points on an image layer.
 
@@ -67,6 +209,11 @@ def laplacian_of_gaussian(
     features. If the image has more dimensions than the features, this will iterate over
     the leading extra dimensions.
 
+    If the image's scale differs between the feature dimensions, like the z spacing of a
+    confocal stack, the sigmas are in pixels of the last dimension and each blob is
+    detected with a sigma per dimension that follows the scale, without resampling the
+    image. The sigma along each feature axis is added to the features as 'sigma_<axis>'.
+
     Parameters
     ----------
     image : Image
@@ -79,6 +226,81 @@ def laplacian_of_gaussian(
         The largest blob size to detect.
     threshold : float
         Reduce this to detect blobs with lower intensities.
+    overlap : float
+        A value between 0 and 1. If the fraction of the area (or volume) of a
+        blob that overlaps a larger blob is greater than this, the smaller
+        blob is removed.
+    prune_window : int
+        If positive, blobs are also removed when they overlap larger blobs in
+        slices up to this many steps away along the last leading dimension,
+        e.g. to keep only one of the same blob found in neighboring planes
+        or frames. The slices that only differ in that dimension are pruned
+        together, so their blobs are only returned once all of them are
+        detected.
+    engine : Literal['scikit-image', 'fast']
+        The implementation of the scale space. 'scikit-image' filters the
+        whole image at every sigma like scikit-image does. 'fast' reuses
+        each Gaussian to make the next one, downsamples the image for large
+        sigmas, and uses float32, which is much faster and uses less memory
+        but only approximates scikit-image's results.
+    num_workers : int
+        The number of workers used to detect blobs on the leading dimension
+        slices concurrently. If 1, slices are processed serially.
+        Ignored for dask image data (and zarr image data if dask is
+        installed), which is processed with dask's active scheduler instead.
+    worker_type : Literal['thread', 'process']
+        Whether to use a pool of threads or processes for the workers.
+    tile_size : int
+        If positive, the feature dimensions are processed in tiles of this
+        size that overlap by a halo derived from the largest filter sigma,
+        which bounds peak memory by the tile size rather than the image size.
+        If 0, each slice is processed as a whole, unless the image data is a
+        dask or zarr array in which case tiles follow its storage chunks.
+    coarse_level : int
+        For multiscale images, the pyramid level that larger blobs are
+        detected on. Blobs smaller than 2 pixels of that level are found as
+        candidates on it with a lower threshold and then only detected on the
+        full resolution level near those candidates, which is much faster
+        when blobs are sparse. If 0, or for other images, all blobs are
+        detected on the full resolution level.
+    use_scale : bool
+        If True, the sigmas follow the image's scale along the feature
+        dimensions. If False, the scale is ignored and each blob has the same
+        sigma in pixels of every dimension.
+    mask : Labels, Shapes or np.ndarray, optional
+        If given, only detect blobs whose centers are inside this mask, which
+        is the nonzero labels, the filled shapes or the True values of a
+        boolean array. Only the bounding boxes of the mask's regions, padded
+        by the filters' extent, are filtered, so mostly empty images are
+        processed much faster. Labels and shapes layers are mapped onto the
+        image's pixels through world coordinates, so they can have another
+        scale or transform. An array should have the same shape as the image
+        or as its feature dimensions.
+    cache : ScaleSpaceCache, optional
+        If given, the filtered scale space of each slice or tile is cached,
+        so that running again with only a different threshold just needs to
+        find peaks again. Not used with process workers or dask image data.
+    indices : Sequence[Tuple[int, ...]], optional
+        If given, only detect blobs on the slices with these leading dimension
+        indices, in this order. Otherwise detect blobs on all slices.
+    checkpoint_dir : Path, optional
+        If given, the blobs of each slice are saved in this directory as soon
+        as they are detected, along with a hash of the parameters and of the
+        slice's data. Running again with the same parameters and data loads
+        the saved slices instead of detecting them again, so an interrupted
+        run only needs to detect the slices that it had not finished.
+    output_path : Path, optional
+        If given, stream the blobs of each slice to this Parquet file or zarr
+        store as it is detected, instead of keeping them in memory, and
+        return an empty points layer whose metadata contains the path as
+        'blobs_path'. Use `load_blobs` to load the blobs of some slices.
+        Parquet requires pyarrow and zarr requires zarr.
+    profile : bool
+        If True, record the time spent in each stage of detection (reading
+        data, computing the scale space, finding and pruning peaks, merging
+        tiles and assembling results), the bytes of the arrays each stage
+        allocates, and the duration and number of blobs of each slice.
+        The report is added to the metadata of the points layer as 'profile'.
 
     Returns
     -------
@@ -94,40 +316,442 @@ def laplacian_of_gaussian(
     )
 
 
+def determinant_of_hessian(
+    image: Image,
+    *,
+    dimensionality: PlanarDimensionality = 2,
+    min_sigma: MinSigma = 1,
+    max_sigma: MaxSigma = 30,
+    threshold: HessianThreshold = 0.01,
+    overlap: Overlap = 0.5,
+    prune_window: PruneWindow = 0,
+    num_workers: NumWorkers = 1,
+    worker_type: WorkerType = 'thread',
+    tile_size: TileSize = 0,
+    coarse_level: CoarseLevel = 0,
+    use_scale: bool = True,
+    mask: Mask = None,
+    cache: Optional[ScaleSpaceCache] = None,
+    indices: Indices = None,
+    checkpoint_dir: CheckpointDir = None,
+    output_path: BlobsPath = None,
+    profile: bool = False,
+) -> LayerDataTuple:
+    """ Detects features points on an image layer using the Determinant of Hessian method.
+
+    The Hessian is approximated with box filters over an integral image, so the cost
+    is nearly independent of the blob size, which makes this fast for large blobs.
+    Only 2D features with the same scale along both dimensions, within 0.1%, are
+    supported unless the scale is not used. If the image has more dimensions, this will
+    iterate over the leading extra dimensions.
+
+    Parameters
+    ----------
+    image : Image
+        Image layer for blob detection. Can be a 2D, 3D, or higher dimensionality image.
+    dimensionality : Literal[2]
+        The dimensionality of the blobs to find.
+    min_sigma : float
+        The smallest blob size to detect. Values below 3 are less accurate.
+    max_sigma : float
+        The largest blob size to detect.
+    threshold : float
+        Reduce this to detect blobs with lower intensities.
+    overlap : float
+        A value between 0 and 1. If the fraction of the area (or volume) of a
+        blob that overlaps a larger blob is greater than this, the smaller
+        blob is removed.
+    prune_window : int
+        If positive, blobs are also removed when they overlap larger blobs in
+        slices up to this many steps away along the last leading dimension,
+        e.g. to keep only one of the same blob found in neighboring planes
+        or frames. The slices that only differ in that dimension are pruned
+        together, so their blobs are only returned once all of them are
+        detected.
+    num_workers : int
+        The number of workers used to detect blobs on the leading dimension
+        slices concurrently. If 1, slices are processed serially.
+        Ignored for dask image data (and zarr image data if dask is
+        installed), which is processed with dask's active scheduler instead.
+    worker_type : Literal['thread', 'process']
+        Whether to use a pool of threads or processes for the workers.
+    tile_size : int
+        If positive, the feature dimensions are processed in tiles of this
+        size that overlap by a halo derived from the largest filter sigma,
+        which bounds peak memory by the tile size rather than the image size.
+        If 0, each slice is processed as a whole, unless the image data is a
+        dask or zarr array in which case tiles follow its storage chunks.
+    coarse_level : int
+        For multiscale images, the pyramid level that larger blobs are
+        detected on. Blobs smaller than 2 pixels of that level are found as
+        candidates on it with a lower threshold and then only detected on the
+        full resolution level near those candidates, which is much faster
+        when blobs are sparse. If 0, or for other images, all blobs are
+        detected on the full resolution level.
+    use_scale : bool
+        If True, the sigmas follow the image's scale along the feature
+        dimensions. If False, the scale is ignored and each blob has the same
+        sigma in pixels of every dimension.
+    mask : Labels, Shapes or np.ndarray, optional
+        If given, only detect blobs whose centers are inside this mask, which
+        is the nonzero labels, the filled shapes or the True values of a
+        boolean array. Only the bounding boxes of the mask's regions, padded
+        by the filters' extent, are filtered, so mostly empty images are
+        processed much faster. Labels and shapes layers are mapped onto the
+        image's pixels through world coordinates, so they can have another
+        scale or transform. An array should have the same shape as the image
+        or as its feature dimensions.
+    cache : ScaleSpaceCache, optional
+        If given, the filtered scale space of each slice or tile is cached,
+        so that running again with only a different threshold just needs to
+        find peaks again. Not used with process workers or dask image data.
+    indices : Sequence[Tuple[int, ...]], optional
+        If given, only detect blobs on the slices with these leading dimension
+        indices, in this order. Otherwise detect blobs on all slices.
+    checkpoint_dir : Path, optional
+        If given, the blobs of each slice are saved in this directory as soon
+        as they are detected, along with a hash of the parameters and of the
+        slice's data. Running again with the same parameters and data loads
+        the saved slices instead of detecting them again, so an interrupted
+        run only needs to detect the slices that it had not finished.
+    output_path : Path, optional
+        If given, stream the blobs of each slice to this Parquet file or zarr
+        store as it is detected, instead of keeping them in memory, and
+        return an empty points layer whose metadata contains the path as
+        'blobs_path'. Use `load_blobs` to load the blobs of some slices.
+        Parquet requires pyarrow and zarr requires zarr.
+    profile : bool
+        If True, record the time spent in each stage of detection (reading
+        data, computing the scale space, finding and pruning peaks, merging
+        tiles and assembling results), the bytes of the arrays each stage
+        allocates, and the duration and number of blobs of each slice.
+        The report is added to the metadata of the points layer as 'profile'.
+
+    Returns
+    -------
+    LayerDataTuple
+        A 3-tuple containing the feature points data, other state, and 'Points'.
+    """
+    if dimensionality != 2:
+        raise ValueError(f'The determinant of Hessian only supports 2D features, not {dimensionality}D.')
+    kwargs = locals()
+    return _detect_blobs(
+        image=kwargs.pop('image'),
+        method=blob_doh,
+        dimensionality=kwargs.pop('dimensionality'),
+        **kwargs,
+    )
+
+
+def sweep_points(
+    image: Image,
+    *,
+    thresholds: Sequence[float],
+    sigma_ranges: Optional[Sequence[Tuple[float, float]]] = None,
+    method: Union[str, Callable[..., np.ndarray]] = 'laplacian_of_gaussian',
+    dimensionality: int = 2,
+    use_scale: bool = True,
+    **kwargs,
+) -> List[LayerDataTuple]:
+    """ Detects blobs on an image layer with every combination of some parameters.
+
+    This is like `sweep`, but detects blobs on the native grid of an image
+    layer with sigmas that follow its scale, and returns a points layer for
+    each combination of a sigma range and a threshold, in the order of
+    `Sweep.blobs`. Each layer's metadata contains its 'threshold',
+    'sigma_range' and number of blobs as 'count'.
+
+    Parameters
+    ----------
+    image : Image
+        Image layer for blob detection.
+    thresholds : Sequence[float]
+        The thresholds to detect blobs with.
+    sigma_ranges : Sequence[Tuple[float, float]], optional
+        The smallest and largest sigma of each range of blob sizes to detect.
+    method : str or Callable
+        The detection method, like in `sweep`.
+    dimensionality : int
+        The dimensionality of the blobs to find.
+    use_scale : bool
+        If False, the image's scale is ignored, like in `laplacian_of_gaussian`.
+    **kwargs
+        The other options of `sweep`, like `min_sigma` and `max_sigma`.
+
+    Returns
+    -------
+    List[LayerDataTuple]
+        The points layer of each combination of parameters.
+    """
+    method = get_method(method)
+    data = image.data[0] if image.multiscale else image.data
+    result = sweep(
+        data,
+        thresholds=thresholds,
+        sigma_ranges=sigma_ranges,
+        method=method,
+        dimensionality=dimensionality,
+        spacing=_image_spacing(image, dimensionality, use_scale),
+        **kwargs,
+    )
+    layers = []
+    for (low, high), range_blobs in zip(result.sigma_ranges, result.blobs):
+        for threshold, blobs in zip(result.thresholds, range_blobs):
+            data, state, layer_type = _points_layer_data(image, method, dimensionality, blobs, use_scale=use_scale)
+            state['name'] = f'{state["name"]}-sigma-{low:g}-{high:g}-threshold-{threshold:g}'
+            state['metadata'].update(
+                threshold=float(threshold),
+                sigma_range=(float(low), float(high)),
+                count=blobs.coords.shape[0],
+            )
+            layers.append((data, state, layer_type))
+    return layers
+
+
+def detect_blobs_in_channels(
+    images: Sequence[Image],
+    *,
+    parameters: Optional[Sequence[Mapping[str, Any]]] = None,
+    method: Union[str, Callable[..., np.ndarray]] = 'laplacian_of_gaussian',
+    dimensionality: int = 2,
+    num_workers: int = 1,
+    worker_type: str = 'thread',
+    use_scale: bool = True,
+    mask: Optional[Any] = None,
+    **kwargs,
+) -> LayerDataTuple:
+    """ Detects blobs in several image layers of the same acquisition, like its channels.
+
+    This is like `detect_channel_blobs`, which reads each leading dimension
+    slice of every layer once and detects the layers concurrently, and
+    returns one points layer with the blobs of all layers. The name of the
+    layer that each blob was detected in is added to the features as
+    'channel'. The layers should have the same shape and scale, like those
+    added with the `channel_axis` of `Viewer.add_image`, and the blobs are
+    detected with sigmas that follow the scale of the first layer.
+
+    Parameters
+    ----------
+    images : Sequence[Image]
+        The image layers of the channels.
+    parameters : Sequence[Mapping[str, Any]], optional
+        The parameters of each layer, like `threshold`, `min_sigma`,
+        `max_sigma` or `method`, which override those shared by all layers.
+    method : str or Callable
+        The detection method, like in `detect_blobs`.
+    dimensionality : int
+        The dimensionality of the blobs to find.
+    num_workers : int
+        The number of workers used to detect the layers and slices
+        concurrently.
+    worker_type : Literal['thread', 'process']
+        Whether to use a pool of threads or processes for the workers.
+    use_scale : bool
+        If False, the scale of the layers is ignored, like in
+        `laplacian_of_gaussian`.
+    mask : Labels, Shapes or np.ndarray, optional
+        If given, only detect blobs whose centers are inside this mask, like
+        in `laplacian_of_gaussian`. Layers are mapped onto the pixels of the
+        first image layer.
+    **kwargs
+        The parameters shared by all layers, like `min_sigma`, `max_sigma`,
+        `threshold`, `engine` and `tile_size`.
+
+    Returns
+    -------
+    LayerDataTuple
+        A 3-tuple containing the feature points data, other state, and 'Points'.
+    """
+    if len(images) == 0:
+        raise ValueError('At least one image layer is needed.')
+    method = get_method(method)
+    image = images[0]
+    result = detect_channel_blobs(
+        [layer.data[0] if layer.multiscale else layer.data for layer in images],
+        parameters=parameters,
+        method=method,
+        dimensionality=dimensionality,
+        num_workers=num_workers,
+        worker_type=worker_type,
+        spacing=_image_spacing(image, dimensionality, use_scale),
+        mask=None if mask is None else _mask_data(mask, image),
+        **kwargs,
+    )
+    data, state, layer_type = _points_layer_data(image, method, dimensionality, result.blobs, use_scale=use_scale)
+    # Use the sigmas per axis of each channel, whose parameters can have
+    # another spacing than the first layer's scale.
+    sigma_names = [f'sigma_{axis}' for axis in range(image.ndim - dimensionality, image.ndim)]
+    if sigma_names[0] in state['features'] or np.any(result.axis_sigmas != result.axis_sigmas[:, -1:]):
+        state['features'].update(zip(sigma_names, result.axis_sigmas.T))
+    names = [layer.name for layer in images]
+    state['name'] = f'{"-".join(names)}-features-{method.__name__}'
+    state['features']['channel'] = np.array(names)[result.channels]
+    return data, state, layer_type
+
+
 def _detect_blobs(
+    *,
+    image: Image,
+    method: Callable[..., np.ndarray],
+    dimensionality: Dimensionality = 2,
+    output_path: Optional[Path] = None,
+    profile: bool = False,
+    use_scale: bool = True,
+    **kwargs,
+) -> LayerDataTuple:
+    profile = Profile() if profile else None
+    slice_blobs = _iter_image_blobs(
+        image=image,
+        method=method,
+        dimensionality=dimensionality,
+        profile=profile,
+        use_scale=use_scale,
+        **kwargs,
+    )
+    if output_path is None:
+        blobs = assemble_blobs(slice_blobs, ndim=image.ndim, dimensionality=dimensionality, profile=profile)
+        data, state, layer_type = _points_layer_data(image, method, dimensionality, blobs, use_scale=use_scale)
+    else:
+        with measure(profile, 'write'):
+            write_blobs(slice_blobs, output_path, ndim=image.ndim)
+        blobs = assemble_blobs([], ndim=image.ndim, dimensionality=dimensionality)
+        data, state, layer_type = _points_layer_data(image, method, dimensionality, blobs, use_scale=use_scale)
+        state['metadata']['blobs_path'] = str(output_path)
+    if profile is not None:
+        state['metadata']['profile'] = profile.report()
+    return data, state, layer_type
+
+
+def _iter_image_blobs(
     *,
     image: Image,
     method: Callable[..., np.ndarray],
     dimensionality: Dimensionality = 2,
     **kwargs,
+) -> Iterator[Tuple[Index, np.ndarray]]:
+    cache_key = _layer_cache_key(image, kwargs.get('cache'))
+    kwargs['spacing'] = _image_spacing(image, dimensionality, kwargs.pop('use_scale', True))
+    if kwargs.get('mask') is not None:
+        kwargs['mask'] = _mask_data(kwargs['mask'], image)
+    if image.multiscale:
+        return iter_multiscale_slice_blobs(
+            list(image.data),
+            method=method,
+            dimensionality=dimensionality,
+            cache_key=cache_key,
+            **kwargs,
+        )
+    kwargs.pop('coarse_level', None)
+    return iter_slice_blobs(
+        image.data,
+        method=method,
+        dimensionality=dimensionality,
+        cache_key=cache_key,
+        **kwargs,
+    )
+
+
+def _image_spacing(image: Image, dimensionality: int, use_scale: bool) -> Optional[Tuple[float, ...]]:
+    # Blobs are detected on the native grid with sigmas that follow the
+    # layer's scale, unless it is not used.
+    return tuple(image.scale[-dimensionality:]) if use_scale else None
+
+
+# The cache key of each image layer and the caches of its scale spaces.
+_LAYER_CACHE_KEYS: 'weakref.WeakKeyDictionary[Image, Tuple[object, weakref.WeakSet]]' = weakref.WeakKeyDictionary()
+
+
+def _layer_cache_key(image: Image, cache: Optional[ScaleSpaceCache]) -> object:
+    # Returns a key of the scale spaces of an image layer that is never
+    # reused by another layer. Its scale spaces are evicted from the caches
+    # when the layer's data is replaced or the layer is deleted.
+    if image not in _LAYER_CACHE_KEYS:
+        key, caches = object(), weakref.WeakSet()
+
+        def _evict(*_) -> None:
+            for layer_cache in list(caches):
+                layer_cache.evict(key)
+
+        image.events.data.connect(_evict)
+        weakref.finalize(image, _evict)
+        _LAYER_CACHE_KEYS[image] = (key, caches)
+    key, caches = _LAYER_CACHE_KEYS[image]
+    if cache is not None:
+        caches.add(cache)
+    return key
+
+
+def _mask_data(mask: Any, image: Image) -> Any:
+    # Returns the array of a mask layer on the pixels of the image, or the
+    # mask itself if it is an array. The layer's dimensions are the image's
+    # last dimensions.
+    if not isinstance(mask, Layer):
+        return mask
+    if not isinstance(mask, (Labels, Shapes)):
+        raise TypeError(f'The mask must be a labels or shapes layer, not a {type(mask).__name__} layer.')
+    if mask.ndim > image.ndim:
+        raise ValueError(f'The mask has more dimensions ({mask.ndim}) than the image ({image.ndim}).')
+    shape = image.data.shape[-mask.ndim:]
+    image_axes = range(image.ndim - mask.ndim, image.ndim)
+    mask_to_image = mask._data_to_world.compose(image._data_to_world.set_slice(image_axes).inverse)
+    if isinstance(mask, Shapes):
+        shapes = Shapes(
+            [mask_to_image(vertices) for vertices in mask.data],
+            shape_type=mask.shape_type,
+            ndim=mask.ndim,
+        )
+        return shapes.to_labels(labels_shape=shape) > 0
+    data = mask.data[0] if mask.multiscale else mask.data
+    if np.allclose(mask_to_image.affine_matrix, np.eye(mask.ndim + 1)):
+        return data
+    # Resample the labels onto the image's pixels, which needs them in memory.
+    return ndi.affine_transform(
+        (np.asarray(data) != 0).astype(np.uint8),
+        mask_to_image.inverse.affine_matrix,
+        output_shape=shape,
+        order=0,
+    ) > 0
+
+
+def _points_layer_data(
+    image: Image,
+    method: Callable[..., np.ndarray],
+    dimensionality: int,
+    blobs: Blobs,
+    *,
+    use_scale: bool = True,
 ) -> LayerDataTuple:
-    data = image.data
-    if data.ndim < dimensionality:
-        raise ValueError(f'The input image has fewer dimensions ({data.ndim}) than the feature dimensionality ({dimensionality})')
-    # Find features in the last dimensions of the image and iterate over
-    # leading dimensions.
-    feature_slices = tuple(slice(n) for n in data.shape[-dimensionality:])
-    all_coords = []
-    all_sigmas = []
-    for index in np.ndindex(data.shape[:-dimensionality]):
-        full_index = index + feature_slices
-        indexed_image_data = data[full_index]
-        coords = method(indexed_image_data, **kwargs)
-        for c in coords:
-            all_coords.append(index + tuple(c[:-1]))
-            all_sigmas.append(c[-1])
-    all_coords = np.reshape(all_coords, (-1, image.ndim))
-    all_sigmas = np.array(all_sigmas)
+    features = {'sigma': blobs.sigmas}
+    # The sigmas are in pixels of the last dimension, so blobs on an image
+    # with an anisotropic scale also get their sigma in pixels of each
+    # feature dimension, which is what points_to_labels uses.
+    axis_ratios = sigmas_per_axis(1.0, image.scale[-dimensionality:]) if use_scale else 1.0
+    if isinstance(axis_ratios, tuple):
+        first_axis = image.ndim - dimensionality
+        for i, ratio in enumerate(axis_ratios):
+            features[f'sigma_{first_axis + i}'] = blobs.sigmas * ratio
     state = {
         'name': f'{image.name}-features-{method.__name__}',
-        'features': {'sigma': all_sigmas},
+        'features': features,
         'scale': image.scale,
         'translate': image.translate,
         'rotate': image.rotate,
         'shear': image.shear,
-        'affine': image.affine, 
+        'affine': image.affine,
         'opacity': 0.5,
         'face_color': 'red',
-        'size': np.sqrt(dimensionality) * all_sigmas,
+        'size': np.sqrt(dimensionality) * blobs.sigmas,
+        'metadata': {
+            'slice_indices': blobs.slice_indices,
+            'slice_offsets': blobs.slice_offsets,
+        },
     }
-    return (all_coords, state, 'Points')
+    return (blobs.coords, state, 'Points')
+
+
+# Maps each detection function to the scikit-image method that it uses.
+_BLOB_METHODS = {
+    difference_of_gaussian: blob_dog,
+    laplacian_of_gaussian: blob_log,
+    determinant_of_hessian: blob_doh,
+}
@@ -0,0 +1,353 @@
+import csv
+import glob
+import json
+import os
+import shutil
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ._blobs import Blobs, Index
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'zarr')
+
+# The key of the frame index in the metadata of Parquet files.
+_PARQUET_INDEX_KEY = b'napari_blob_detection.slices'
+
+# The number of rows in each chunk of the arrays in zarr blob stores.
+_ZARR_CHUNK_ROWS = 65536
+
+# The attribute of zarr blob stores that marks them as complete.
+_ZARR_COMPLETE_KEY = 'napari_blob_detection.complete'
+
+# The suffixes of the image files that can be read.
+IMAGE_SUFFIXES = ('.npy', '.zarr', '.tif', '.tiff')
+
+
+def expand_paths(patterns: Iterable[str]) -> List[Path]:
+    """ Expands file paths and glob patterns into a sorted list of unique paths. """
+    return sorted(expand_paths_with_roots(patterns))
+
+
+def expand_paths_with_roots(patterns: Iterable[str]) -> Dict[Path, Path]:
+    """ Expands file paths and glob patterns into the root directory of each path.
+
+    The root of a path is the longest leading directory of the first
+    pattern that matches it without any glob characters, e.g. 'plates' for
+    'plates/**/*.tif', or the directory of a file path.
+    """
+    roots = {}
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if len(matches) == 0 and os.path.exists(pattern):
+            matches = [pattern]
+        root = _glob_root(pattern)
+        for match in matches:
+            path = Path(match)
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                roots.setdefault(path, root)
+    return roots
+
+
+def _glob_root(pattern: str) -> Path:
+    parts = Path(pattern).parts
+    literal = 0
+    while literal < len(parts) - 1 and not glob.has_magic(parts[literal]):
+        literal += 1
+    return Path(*parts[:literal]) if literal > 0 else Path('.')
+
+
+def read_image(path: Path) -> Any:
+    """ Opens an image file as an array without reading all of its data if possible.
+
+    NumPy and TIFF files are memory-mapped where possible and zarr arrays
+    are opened lazily. Reading TIFF files requires tifffile and reading
+    zarr arrays requires zarr.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == '.npy':
+        return np.load(path, mmap_mode='r')
+    if suffix == '.zarr':
+        import zarr
+
+        return zarr.open_array(str(path), mode='r')
+    if suffix in ('.tif', '.tiff'):
+        import tifffile
+
+        try:
+            return tifffile.memmap(path, mode='r')
+        except ValueError:
+            # Compressed or otherwise non-contiguous data cannot be mapped.
+            return tifffile.imread(path)
+    raise ValueError(f'Unsupported image file ({path}). Must end with one of {IMAGE_SUFFIXES}.')
+
+
+def output_path_for(
+    image_path: Path,
+    output_dir: Path,
+    output_format: str,
+    *,
+    root: Optional[Path] = None,
+) -> Path:
+    """ Returns the path of the blobs file for an image file.
+
+    If a root directory of the image is given, the output mirrors the image's
+    directory relative to it, so images with the same name in different
+    directories have different outputs.
+    """
+    return Path(output_dir) / relative_dir(image_path, root) / f'{Path(image_path).stem}-blobs.{output_format}'
+
+
+def relative_dir(path: Path, root: Optional[Path] = None) -> Path:
+    """ Returns the directory of a path relative to a root directory, or '.' without one. """
+    if root is None:
+        return Path('.')
+    return Path(os.path.relpath(Path(path).parent, root))
+
+
+class BlobWriter:
+    """ Streams blobs to a CSV or Parquet file, or a zarr store, one slice at a time.
+
+    The columns are compatible with napari's points CSV format: the row
+    index, the coordinates of each axis, and the sigma.
+    Parquet files and zarr stores also contain the leading index of each
+    slice and the offsets of its rows, so that `load_blobs` can read only
+    some slices. Each slice of a Parquet file is its own row group.
+    Zarr stores are written in place, and each slice's offset is written
+    after its rows, so the slices that were finished before a crash or an
+    error can still be loaded. A store is marked as complete when the writer
+    is closed without an error. CSV and Parquet files cannot be read without
+    their end, so their rows are written to a temporary file that only
+    replaces the output path when the writer is closed without an error,
+    so an existing output file always contains complete results.
+    """
+
+    def __init__(self, path: Path, *, ndim: int, output_format: str = 'csv'):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'Unknown output format ({output_format}). Must be one of {OUTPUT_FORMATS}.')
+        self.path = Path(path)
+        self.columns = ['index'] + [f'axis-{d}' for d in range(ndim)] + ['sigma']
+        self.slice_indices: List[Index] = []
+        self.slice_offsets = [0]
+        self._partial_path = self.path.with_name(self.path.name + '.partial')
+        self._format = output_format
+        if output_format == 'csv':
+            self._file = open(self._partial_path, 'w', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.columns)
+        elif output_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self._schema = pa.schema(
+                [('index', pa.int64())] + [(c, pa.float64()) for c in self.columns[1:]]
+            )
+            self._writer = pq.ParquetWriter(str(self._partial_path), self._schema)
+        else:
+            import zarr
+
+            _remove(self.path)
+            self._group = zarr.open_group(str(self.path), mode='w')
+            self._group.attrs[_ZARR_COMPLETE_KEY] = False
+            self._group.zeros(name='coords', shape=(0, ndim), chunks=(_ZARR_CHUNK_ROWS, ndim), dtype='f8')
+            self._group.zeros(name='sigmas', shape=(0,), chunks=(_ZARR_CHUNK_ROWS,), dtype='f8')
+            self._group.zeros(name='slice_indices', shape=(0, 0), chunks=(_ZARR_CHUNK_ROWS, 1), dtype='i8')
+            self._group.zeros(name='slice_offsets', shape=(1,), chunks=(_ZARR_CHUNK_ROWS,), dtype='i8')
+
+    @property
+    def _num_rows(self) -> int:
+        return self.slice_offsets[-1]
+
+    def write(self, index: Index, blobs: np.ndarray) -> None:
+        """ Writes the blobs in one slice, which has the given leading index. """
+        num_blobs = blobs.shape[0]
+        rows = np.empty((num_blobs, len(self.columns) - 1), dtype=np.float64)
+        rows[:, :len(index)] = index
+        # Blobs with a sigma per dimension are written with the sigma of the
+        # last dimension, which the others are proportional to.
+        rows[:, len(index):-1] = blobs[:, :rows.shape[1] - 1 - len(index)]
+        rows[:, -1] = blobs[:, -1]
+        row_indices = np.arange(self._num_rows, self._num_rows + num_blobs)
+        if self._format == 'csv':
+            for i, row in zip(row_indices, rows):
+                self._writer.writerow([i, *row])
+        elif self._format == 'parquet':
+            import pyarrow as pa
+
+            columns = [pa.array(row_indices)] + [pa.array(c) for c in rows.T]
+            table = pa.Table.from_arrays(columns, schema=self._schema)
+            self._writer.write_table(table, row_group_size=max(num_blobs, 1))
+        else:
+            if len(self.slice_indices) == 0:
+                self._group['slice_indices'].resize((0, len(index)))
+            self._group['coords'].append(rows[:, :-1])
+            self._group['sigmas'].append(rows[:, -1])
+            # The slice is only visible to readers once its offset is written.
+            self._group['slice_indices'].append(np.array([index], dtype=np.int64).reshape(1, len(index)))
+            self._group['slice_offsets'].append(np.array([self._num_rows + num_blobs]))
+        self.slice_indices.append(tuple(index))
+        self.slice_offsets.append(self._num_rows + num_blobs)
+
+    def close(self, *, commit: bool = True) -> None:
+        """ Closes the file, and moves it to the output path if committing.
+
+        Zarr stores are already at the output path, and are only marked as
+        complete if committing.
+        """
+        if self._format == 'zarr':
+            if commit:
+                self._group.attrs[_ZARR_COMPLETE_KEY] = True
+            return
+        if self._format == 'csv':
+            self._file.close()
+        elif self._format == 'parquet':
+            self._writer.add_key_value_metadata({
+                _PARQUET_INDEX_KEY: json.dumps({
+                    'slice_indices': [list(map(int, i)) for i in self.slice_indices],
+                    'slice_offsets': list(map(int, self.slice_offsets)),
+                }),
+            })
+            self._writer.close()
+        if commit:
+            _remove(self.path)
+            os.replace(self._partial_path, self.path)
+        else:
+            _remove(self._partial_path)
+
+    def __enter__(self) -> 'BlobWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(commit=exc_type is None)
+
+
+def write_blobs(slice_blobs: Iterable[Tuple[Index, np.ndarray]], path: Path, *, ndim: int) -> None:
+    """ Streams the blobs of each slice to a file in the format of its suffix. """
+    output_format = Path(path).suffix.lower().lstrip('.')
+    with BlobWriter(path, ndim=ndim, output_format=output_format) as writer:
+        for index, blobs in slice_blobs:
+            writer.write(index, blobs)
+
+
+def is_complete(path: Path) -> bool:
+    """ Returns whether a BlobWriter finished writing the blobs at a path.
+
+    Zarr stores that were interrupted exist but are not complete.
+    """
+    path = Path(path)
+    if not path.exists():
+        return False
+    if path.suffix != '.zarr':
+        return True
+    import zarr
+
+    return bool(zarr.open_group(str(path), mode='r').attrs.get(_ZARR_COMPLETE_KEY, True))
+
+
+def read_blobs(path: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """ Reads the coordinates and sigmas of blobs written by a BlobWriter. """
+    path = Path(path)
+    if path.suffix == '.zarr':
+        blobs = load_blobs(path)
+        return blobs.coords, blobs.sigmas
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(str(path))
+        rows = np.column_stack([np.asarray(table.column(name)) for name in table.column_names[1:]])
+    else:
+        with open(path, newline='') as file:
+            num_columns = len(next(csv.reader(file)))
+            with warnings.catch_warnings():
+                # Files with no blobs are expected.
+                warnings.simplefilter('ignore', UserWarning)
+                rows = np.loadtxt(file, delimiter=',', ndmin=2)
+        rows = rows.reshape(-1, num_columns)[:, 1:]
+    return rows[:, :-1], rows[:, -1]
+
+
+def load_blobs(path: Path, *, indices: Optional[Sequence[Index]] = None) -> Blobs:
+    """ Loads the blobs in some slices of a Parquet file or zarr store.
+
+    Only the data of the requested slices is read, using the index of the
+    slices that is stored with the blobs.
+
+    Parameters
+    ----------
+    path : Path
+        The path of a Parquet file or zarr store written by a BlobWriter,
+        for example with the `output_path` option of detection. Zarr stores
+        whose writing was interrupted contain the slices that were finished.
+    indices : Sequence[Tuple[int, ...]], optional
+        The leading dimension indices of the slices to load, in this order.
+        Slices that were not detected are skipped. Defaults to all slices.
+
+    Returns
+    -------
+    Blobs
+        The blobs in the requested slices, where the table of slices refers
+        to the loaded rows.
+    """
+    path = Path(path)
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+
+        file = pq.ParquetFile(str(path))
+        slices = json.loads(file.metadata.metadata[_PARQUET_INDEX_KEY])
+        slice_indices = np.array(slices['slice_indices'], dtype=np.int64)
+        slice_offsets = np.array(slices['slice_offsets'], dtype=np.int64)
+        ndim = len(file.schema_arrow.names) - 2
+        # Only read the row groups that contain the requested slices.
+        group_rows = [file.metadata.row_group(i).num_rows for i in range(file.num_row_groups)]
+        group_offsets = np.concatenate([[0], np.cumsum(group_rows)]).astype(np.int64)
+
+        def read_rows(start: int, stop: int) -> np.ndarray:
+            if start == stop:
+                return np.empty((0, ndim + 1))
+            first = np.searchsorted(group_offsets, start, side='right') - 1
+            last = np.searchsorted(group_offsets, stop, side='left')
+            table = file.read_row_groups(list(range(first, last)))
+            rows = np.column_stack([np.asarray(c) for c in table.columns[1:]]).reshape(-1, ndim + 1)
+            return rows[start - group_offsets[first]:stop - group_offsets[first]]
+    elif path.suffix == '.zarr':
+        import zarr
+
+        group = zarr.open_group(str(path), mode='r')
+        # Only slices whose offsets were written are complete.
+        slice_offsets = np.asarray(group['slice_offsets'][:])
+        slice_indices = np.asarray(group['slice_indices'][:len(slice_offsets) - 1])
+        coords, sigmas = group['coords'], group['sigmas']
+        ndim = coords.shape[1]
+
+        def read_rows(start: int, stop: int) -> np.ndarray:
+            return np.column_stack([coords[start:stop], sigmas[start:stop]])
+    else:
+        raise ValueError(f'Only Parquet and zarr blobs can be loaded by slice, not {path}.')
+
+    if indices is None:
+        positions = np.arange(len(slice_indices))
+    else:
+        lookup = {tuple(i): p for p, i in enumerate(slice_indices.tolist())}
+        positions = np.array([lookup[tuple(i)] for i in indices if tuple(i) in lookup], dtype=int)
+    blocks = [read_rows(slice_offsets[p], slice_offsets[p + 1]) for p in positions]
+    counts = np.diff(slice_offsets)[positions]
+    offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    rows = np.concatenate(blocks) if len(blocks) > 0 else np.empty((0, ndim + 1))
+    return Blobs(
+        rows[:, :-1],
+        rows[:, -1],
+        slice_indices[positions].reshape(len(positions), slice_indices.shape[1]),
+        offsets,
+    )
+
+
+def _remove(path: Path) -> None:
+    # Removes a file or a directory, like a zarr store, if it exists.
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
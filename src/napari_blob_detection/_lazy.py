@@ -0,0 +1,49 @@
+import sys
+from typing import Any, Optional, Tuple
+
+# Chunk sizes along each dimension, in the style of dask's chunks.
+Chunks = Tuple[Tuple[int, ...], ...]
+
+
+def is_dask_array(data: Any) -> bool:
+    """ Returns True if the data is a dask array.
+
+    This never imports dask, because if dask has not already been imported
+    then the data cannot be a dask array.
+    """
+    da = sys.modules.get('dask.array')
+    return da is not None and isinstance(data, da.Array)
+
+
+def is_zarr_array(data: Any) -> bool:
+    """ Returns True if the data is a zarr array, without importing zarr. """
+    zarr = sys.modules.get('zarr')
+    return zarr is not None and isinstance(data, zarr.Array)
+
+
+def as_dask_array(data: Any) -> Any:
+    """ Wraps a zarr array as a dask array with the same chunks if possible.
+
+    Other data, including zarr arrays when dask is not installed,
+    is returned unchanged.
+    """
+    if not is_zarr_array(data):
+        return data
+    try:
+        import dask.array as da
+    except ImportError:
+        return data
+    return da.from_array(data, chunks=data.chunks)
+
+
+def chunk_sizes(data: Any) -> Optional[Chunks]:
+    """ Returns the storage chunk sizes of chunked data or None otherwise. """
+    if is_dask_array(data):
+        return data.chunks
+    if is_zarr_array(data):
+        return tuple(
+            (c,) * (n // c) + ((n % c,) if n % c else ())
+            for n, c in zip(data.shape, data.chunks)
+        )
+    return None
+
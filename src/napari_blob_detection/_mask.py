@@ -0,0 +1,53 @@
+from typing import Any, Sequence, Tuple
+
+import numpy as np
+from scipy import ndimage as ndi
+
+Index = Tuple[int, ...]
+
+
+def check_mask(mask: Any, shape: Sequence[int], dimensionality: int) -> None:
+    """ Raises a ValueError if a mask does not match the shape of some data.
+
+    A mask should have the same shape as the data or as its feature
+    dimensions, in which case it is used for every leading dimension slice.
+    """
+    shape = tuple(shape)
+    if tuple(mask.shape) not in (shape, shape[-dimensionality:]):
+        raise ValueError(
+            f'The mask must have the same shape as the image ({shape}) or as its feature dimensions '
+            f'({shape[-dimensionality:]}), but has the shape {tuple(mask.shape)}.'
+        )
+
+
+def mask_slice(mask: Any, index: Index, dimensionality: int) -> np.ndarray:
+    """ Returns the boolean mask of one leading dimension slice.
+
+    The mask can be any array-like, like a labels array, where nonzero
+    values are inside the mask.
+    """
+    if mask.ndim == dimensionality:
+        index = ()
+    return np.asarray(mask[index]) != 0
+
+
+def mask_regions(mask: np.ndarray) -> np.ndarray:
+    """ Returns the bounding boxes of the connected regions of a mask.
+
+    The boxes are given by their start and stop corners, with the shape
+    (n, 2, ndim).
+    """
+    labels, _ = ndi.label(mask)
+    boxes = [
+        [[s.start for s in box], [s.stop for s in box]]
+        for box in ndi.find_objects(labels)
+        if box is not None
+    ]
+    return np.array(boxes, dtype=int).reshape(len(boxes), 2, mask.ndim)
+
+
+def blobs_in_mask(blobs: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """ Returns the blobs whose centers are inside a mask. """
+    dimensionality = mask.ndim
+    pixels = np.clip(np.round(blobs[:, :dimensionality]).astype(int), 0, np.array(mask.shape) - 1)
+    return blobs[mask[tuple(pixels.T)]]
@@ -0,0 +1,229 @@
+import math
+from typing import Any, Dict
+
+import numpy as np
+from napari.layers import Image, Points
+from scipy.stats import gmean
+from typing_extensions import Annotated
+
+Dimensionality = Annotated[int, {'choices': [2, 3]}]
+BackgroundWidth = Annotated[float, {'min': 0, 'max': 100, 'step': 0.5}]
+
+# The names of the statistics measured for each blob, in the order of the
+# columns that are added to the features of a points layer.
+STATISTICS = (
+    'intensity_mean',
+    'intensity_max',
+    'intensity_integrated',
+    'background',
+    'intensity_mean_corrected',
+    'intensity_integrated_corrected',
+)
+
+# The most pixels that are gathered at once, which bounds the memory used to
+# measure blobs with large windows.
+_MAX_GATHERED_PIXELS = 2 ** 22
+
+
+def measure_blobs(
+    points: Points,
+    image: Image,
+    dimensionality: Dimensionality = 2,
+    background_width: BackgroundWidth = 2,
+) -> None:
+    """ Measures the intensity of each blob in an image and adds it to the points' features.
+
+    This measures each blob directly in a window around it, so there is no
+    need to convert the points to labels first.
+
+    Parameters
+    ----------
+    points : Points
+        The detected blobs. Each blob's window is the disk or ball with the
+        point's size as its diameter, like the labels of `points_to_labels`,
+        or an ellipse or ellipsoid if the points have a sigma per feature
+        axis, like blobs detected on an image with an anisotropic scale.
+    image : Image
+        The image to measure the blobs in, which is usually the image that
+        they were detected on.
+    dimensionality : Literal[2, 3]
+        The dimensionality of the blobs. The windows of blobs only extend
+        along the last dimensions, so each blob is measured in its own slice
+        of any leading dimensions.
+    background_width : float
+        The width of the shell around each window that the local background
+        is measured in.
+
+    The added features are the mean, maximum and integrated (summed)
+    intensity in each blob's window, the median intensity of the background
+    shell, and the mean and integrated intensity minus the background.
+    """
+    points_to_image = points._data_to_world.compose(image._data_to_world.inverse)
+    coords = np.atleast_2d(points_to_image(points.data)).reshape(-1, image.ndim)
+    sigma_axes = range(points.ndim - dimensionality, points.ndim)
+    if all(f'sigma_{axis}' in points.features for axis in sigma_axes):
+        sigmas = np.stack([points.features[f'sigma_{axis}'] for axis in sigma_axes], axis=1).astype(float)
+        sigmas = sigmas * np.abs(points_to_image.scale[-dimensionality:])
+    else:
+        # Detection makes points with a size of sqrt(dimensionality) * sigma.
+        sigmas = np.asarray(points.size, dtype=float) / math.sqrt(dimensionality)
+        sigmas = sigmas * gmean(np.abs(points_to_image.scale))
+    data = image.data[0] if image.multiscale else image.data
+    statistics = blob_intensities(
+        data,
+        coords,
+        sigmas,
+        dimensionality=dimensionality,
+        background_width=background_width,
+    )
+    features = points.features.copy()
+    for name, values in statistics.items():
+        features[name] = values
+    points.features = features
+
+
+def blob_intensities(
+    data: Any,
+    coords: np.ndarray,
+    sigmas: np.ndarray,
+    *,
+    dimensionality: int = 2,
+    background_width: float = 2,
+) -> Dict[str, np.ndarray]:
+    """ Measures the intensity of blobs in an array without needing napari layers.
+
+    Each blob's window is the ball of radius sqrt(dimensionality) * sigma / 2
+    around its center in the feature dimensions of its slice, which is the
+    size of the points that detection makes. Its background is the median of
+    the shell that extends the window by the background width. Pixels outside
+    the data are ignored, and the statistics of windows without any pixels
+    are NaN. Blobs with a sigma per dimension have ellipsoidal windows and
+    shells, whose radii and width are in pixels of the last dimension.
+    Blobs are measured together in batches of the same window size, one
+    slice at a time, so lazy data is only read one slice at a time.
+
+    Parameters
+    ----------
+    data : array-like
+        The image data, which can be a NumPy, dask or zarr array.
+    coords : np.ndarray
+        The coordinates of the blobs in the data, like those returned by
+        `detect_blobs`, with leading dimension indices followed by the
+        feature coordinates.
+    sigmas : np.ndarray
+        The sigma of each blob, or its sigma along each feature dimension
+        with the shape (n, dimensionality).
+    dimensionality : int
+        The dimensionality of the blobs.
+    background_width : float
+        The width of the background shell.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Each of the `STATISTICS` of each blob.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, data.ndim)
+    statistics = {name: np.full(coords.shape[0], np.nan) for name in STATISTICS}
+    if coords.shape[0] == 0:
+        return statistics
+    sigmas = np.asarray(sigmas, dtype=float).reshape(coords.shape[0], -1)
+    num_leading = data.ndim - dimensionality
+    slice_indices = np.round(coords[:, :num_leading]).astype(int)
+    radii = math.sqrt(dimensionality) * sigmas[:, -1] / 2
+    # Distances are measured in pixels of the last dimension, which are
+    # this many pixels along each dimension.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        axis_scales = np.broadcast_to(sigmas / sigmas[:, -1:], (coords.shape[0], dimensionality))
+    axis_scales = np.where(np.isfinite(axis_scales), axis_scales, 1)
+    box_radii = np.ceil((radii + background_width)[:, np.newaxis] * axis_scales).astype(int) + 1
+    in_data = np.all((slice_indices >= 0) & (slice_indices < data.shape[:num_leading]), axis=1)
+    # Group the blobs by slice and then by box size with one sort, so each
+    # slice is only read once.
+    rows_in_data = np.flatnonzero(in_data)
+    keys = np.concatenate([slice_indices, box_radii], axis=1)[rows_in_data]
+    unique_keys, groups = np.unique(keys, axis=0, return_inverse=True)
+    groups = groups.reshape(-1)
+    order = np.argsort(groups, kind='stable')
+    starts = np.searchsorted(groups[order], np.arange(unique_keys.shape[0] + 1))
+    # Blobs with the same box size share the offsets of the pixels in their boxes.
+    box_offsets = {}
+    index, image = None, None
+    for key, start, stop in zip(unique_keys, starts[:-1], starts[1:]):
+        rows = rows_in_data[order[start:stop]]
+        # The unique keys are sorted, so the keys of each slice are together.
+        if index != tuple(key[:num_leading]):
+            index = tuple(key[:num_leading])
+            image = np.asarray(data[index])
+        box_radius = tuple(key[num_leading:])
+        if box_radius not in box_offsets:
+            box_offsets[box_radius] = _box_offsets(np.array(box_radius))
+        offsets = box_offsets[box_radius]
+        batch_size = max(1, _MAX_GATHERED_PIXELS // offsets.shape[0])
+        for batch_start in range(0, rows.size, batch_size):
+            batch = rows[batch_start:batch_start + batch_size]
+            batch_statistics = _measure_batch(
+                image,
+                coords[batch, num_leading:],
+                radii[batch],
+                axis_scales[batch],
+                offsets=offsets,
+                background_width=background_width,
+            )
+            for name, values in batch_statistics.items():
+                statistics[name][batch] = values
+    return statistics
+
+
+def _box_offsets(box_radius: np.ndarray) -> np.ndarray:
+    # Returns the offsets of the pixels in a box that can be in a window or
+    # shell. Rounding the centers moves pixels by at most half a pixel, so
+    # the corners of the box are never in one.
+    offsets = np.stack(
+        np.meshgrid(*[np.arange(-r, r + 1) for r in box_radius], indexing='ij'),
+        axis=-1,
+    ).reshape(-1, box_radius.size)
+    reach = 1 + np.linalg.norm(0.5 / box_radius)
+    return offsets[np.linalg.norm(offsets / box_radius, axis=1) <= reach]
+
+
+def _measure_batch(
+    image: np.ndarray,
+    centers: np.ndarray,
+    radii: np.ndarray,
+    axis_scales: np.ndarray,
+    *,
+    offsets: np.ndarray,
+    background_width: float,
+) -> Dict[str, np.ndarray]:
+    # Measures blobs in one slice whose boxes have the given pixel offsets
+    # from their rounded centers.
+    pixels = np.round(centers).astype(int)[:, np.newaxis, :] + offsets
+    distances = np.linalg.norm((pixels - centers[:, np.newaxis, :]) / axis_scales[:, np.newaxis, :], axis=-1)
+    valid = np.all((pixels >= 0) & (pixels < image.shape), axis=-1)
+    values = image[tuple(np.moveaxis(np.where(valid[..., np.newaxis], pixels, 0), -1, 0))].astype(np.float64)
+    radii = radii[:, np.newaxis]
+    inside = valid & (distances <= radii)
+    shell = valid & (distances > radii) & (distances <= radii + background_width)
+    counts = np.count_nonzero(inside, axis=1)
+    integrated = np.sum(values, axis=1, where=inside)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts > 0, integrated / counts, np.nan)
+    maximum = np.max(values, axis=1, where=inside, initial=-np.inf)
+    maximum[counts == 0] = np.nan
+    # Sorting puts the shell's values first, which is faster than nanmedian.
+    shell_counts = np.count_nonzero(shell, axis=1)
+    shell_values = np.sort(np.where(shell, values, np.inf), axis=1)
+    rows = np.arange(centers.shape[0])
+    lower = shell_values[rows, np.maximum(shell_counts - 1, 0) // 2]
+    upper = shell_values[rows, shell_counts // 2]
+    background = np.where(shell_counts > 0, (lower + upper) / 2, np.nan)
+    integrated[counts == 0] = np.nan
+    return {
+        'intensity_mean': mean,
+        'intensity_max': maximum,
+        'intensity_integrated': integrated,
+        'background': background,
+        'intensity_mean_corrected': mean - background,
+        'intensity_integrated_corrected': integrated - background * counts,
+    }
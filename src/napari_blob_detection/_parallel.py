@@ -0,0 +1,105 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+WORKER_TYPES = ('thread', 'process')
+
+
+def make_executor(num_workers: int, worker_type: str = 'thread') -> Executor:
+    """ Makes an executor with the given number and type of workers.
+
+    Process workers are always spawned rather than forked, so that they
+    do not inherit any Qt or other threaded state from the parent.
+    """
+    if worker_type == 'thread':
+        return ThreadPoolExecutor(max_workers=num_workers)
+    if worker_type == 'process':
+        return ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    raise ValueError(f'Unknown worker type ({worker_type}). Must be one of {WORKER_TYPES}.')
+
+
+def map_in_order(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    *,
+    num_workers: int = 1,
+    worker_type: str = 'thread',
+) -> Iterator[R]:
+    """ Lazily maps a function over some items, possibly in parallel.
+
+    Results are always yielded in the same order as the input items.
+    Unlike `Executor.map`, at most a few items per worker are consumed ahead
+    of the results, so that lazily generated items (e.g. image slices) are
+    not all materialized at once.
+
+    Parameters
+    ----------
+    func : Callable
+        The function to call on each item. Must be picklable if using
+        process workers.
+    items : Iterable
+        The items to call the function on.
+    num_workers : int
+        The number of workers. If 1, the function is called serially
+        in the calling thread.
+    worker_type : str
+        Either 'thread' or 'process'.
+
+    Yields
+    ------
+    The result of calling the function on each item.
+    """
+    if num_workers < 1:
+        raise ValueError(f'The number of workers ({num_workers}) must be at least 1.')
+    if num_workers == 1:
+        yield from map(func, items)
+        return
+    max_pending = 2 * num_workers
+    executor = make_executor(num_workers, worker_type)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # If the consumer stops early, e.g. when detection is cancelled from
+        # the viewer's thread, do not wait on work that has not started yet
+        # or block until the running work finishes.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def map_with_dask(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    *,
+    batch_size: int = 1024,
+) -> Iterator[R]:
+    """ Lazily maps a function over some items using dask's active scheduler.
+
+    Any dask collections in the items are computed as dependencies of each
+    call, so only the chunks needed by each item are read. The items are
+    submitted in batches to bound the size of each task graph, and results
+    are always yielded in the same order as the input items.
+    """
+    import dask
+
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if len(batch) == 0:
+            return
+        tasks = [dask.delayed(func)(item) for item in batch]
+        yield from dask.compute(*tasks)
@@ -1,18 +1,39 @@
 # convert points layer to labels layer
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import ndimage as ndi
+from scipy.spatial import cKDTree
+from scipy.stats import gmean
 from skimage.morphology import label
+from typing_extensions import Annotated
 
 from napari.layers import Image, Points
 from napari.types import LayerDataTuple
 
+from ._profile import Profile, measure
+
+OutputPath = Annotated[Optional[Path], {'mode': 'w', 'filter': '*.npy *.zarr'}]
+
 
 def points_to_labels(
     points: Points,
     reference_image: Image,
+    sparse: bool = False,
+    output_path: OutputPath = None,
+    profile: bool = False,
 ) -> LayerDataTuple:
     """ Converts a points layer to a labels layer.
 
     Any overlapping points will be assigned the same label value.
 
+    Points with a sigma per feature axis, like the blobs detected on an image
+    with an anisotropic scale, are converted to ellipsoids with a radius of
+    sqrt(dimensionality) * sigma / 2 along each of those axes, which only
+    cover their own slice of any leading dimensions. Other points are
+    converted to balls like `Points.to_mask` with isotropic output.
+
     Parameters
     ----------
     points : Points
@@ -21,18 +42,54 @@ def points_to_labels(
         The reference image layer that the points were detected on.
         The shape and transforms of this image will be used for the output
         labels layer.
+    sparse : bool
+        If True, rasterize each point directly into its bounding box in the
+        labels and merge overlapping points using a spatial index, instead of
+        making a dense mask and labeling its connected components. This gives
+        the same result, but the cost is proportional to the volume of the
+        points rather than the volume of the image. Points with a sigma per
+        feature axis are always converted like this.
+    output_path : Path, optional
+        If given, write the labels to this file on disk and return them as a
+        memory-mapped array, so that they do not need to fit in memory.
+        If the path ends with '.zarr' the labels are written to a zarr array,
+        which requires zarr, and otherwise to a '.npy' file. This implies
+        sparse conversion.
+    profile : bool
+        If True, record the time spent in each stage of the conversion and
+        the bytes of the arrays each stage allocates, and add the report to
+        the metadata of the labels layer as 'profile'.
 
     Returns
     -------
     LayerDataTuple
         A 3-tuple containing the labels data, other state, and 'Labels'.
+        The labels data has the smallest unsigned integer type that can
+        represent all of the labels.
     """
-    mask_data = points.to_mask(
-        shape=reference_image.data.shape,
-        data_to_world=reference_image._data_to_world,
-        isotropic_output=True,
-    )
-    data = label(mask_data)
+    profile = Profile() if profile else None
+    shape = reference_image.data.shape
+    # Points.to_mask only makes balls, so ellipsoids are always rasterized.
+    if sparse or output_path is not None or len(_sigma_axes(points)) > 0:
+        with measure(profile, 'label_balls') as measurement:
+            balls, ball_labels, num_labels = _label_balls(points, reference_image, shape)
+            measurement.nbytes = sum(mask.nbytes for _, _, mask in balls)
+        with measure(profile, 'write_labels') as measurement:
+            data = _zeros(shape, _labels_dtype(num_labels), output_path)
+            _write_labels(data, balls, ball_labels)
+            measurement.nbytes = 0 if output_path is not None else data.nbytes
+    else:
+        with measure(profile, 'to_mask') as measurement:
+            mask_data = points.to_mask(
+                shape=shape,
+                data_to_world=reference_image._data_to_world,
+                isotropic_output=True,
+            )
+            measurement.nbytes = mask_data.nbytes
+        with measure(profile, 'label') as measurement:
+            data, num_labels = label(mask_data, return_num=True)
+            data = data.astype(_labels_dtype(num_labels), copy=False)
+            measurement.nbytes = data.nbytes
     state = {
         'name': f'{points.name}-labels',
         'scale': reference_image.scale,
@@ -42,4 +99,171 @@ def points_to_labels(
         'affine': reference_image.affine,
         'opacity': 0.5,
     }
+    if profile is not None:
+        state['metadata'] = {'profile': profile.report()}
     return data, state, 'Labels'
+
+
+# The bounding box of a ball as the start and stop of each dimension,
+# and the ball's mask within that box.
+Ball = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def _labels_dtype(num_labels: int) -> np.dtype:
+    """ Returns the smallest unsigned integer type that can hold the labels. """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if num_labels <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def _zeros(shape: Tuple[int, ...], dtype: np.dtype, path: Optional[Path] = None):
+    """ Returns an array of zeros, which is memory-mapped if a path is given. """
+    if path is None:
+        return np.zeros(shape, dtype=dtype)
+    path = Path(path)
+    if path.suffix == '.zarr':
+        import zarr
+
+        # Unwritten chunks are implicitly zero, so this does not write the
+        # whole array.
+        return zarr.open(str(path), mode='w', shape=shape, dtype=dtype, fill_value=0)
+    return np.lib.format.open_memmap(str(path), mode='w+', shape=shape, dtype=dtype)
+
+
+def _label_balls(
+    points: Points,
+    reference_image: Image,
+    shape: Tuple[int, ...],
+) -> Tuple[List[Ball], np.ndarray, int]:
+    """ Finds the balls of the points and their labels in the reference image.
+
+    The labels are identical to those made by labeling the connected
+    components of `Points.to_mask`. Balls that are outside of the image
+    have label 0.
+
+    Returns the balls, the label of each ball, and the number of labels.
+    """
+    shape = np.array(shape)
+    centers, radii = _points_in_reference_data(points, reference_image)
+    balls = [_ball(c, r, shape) for c, r in zip(centers, radii)]
+    ball_labels = np.zeros(len(balls), dtype=np.int64)
+    nonempty = [i for i, ball in enumerate(balls) if ball[2].any()]
+    if len(nonempty) == 0:
+        return balls, ball_labels, 0
+
+    # Points with touching balls have the same label, so find the candidate
+    # pairs with a spatial index and check them exactly.
+    parents = np.arange(len(balls))
+    tree = cKDTree(centers[nonempty])
+    max_radius = radii[nonempty].max(initial=0)
+    pairs = tree.query_pairs(2 * max_radius + 3, p=np.inf, output_type='ndarray')
+    for i, j in pairs:
+        a, b = nonempty[i], nonempty[j]
+        if _balls_touch(balls[a], balls[b]):
+            _union(parents, a, b)
+
+    # Match the label order of a raster scan of the mask, which is the order
+    # of the first voxel in each connected component.
+    roots = np.array([_find(parents, i) for i in nonempty])
+    first_voxels = np.array([_first_voxel(balls[i], shape) for i in nonempty])
+    component_roots, components = np.unique(roots, return_inverse=True)
+    component_first_voxels = np.full(component_roots.size, np.iinfo(np.int64).max)
+    np.minimum.at(component_first_voxels, components, first_voxels)
+    component_labels = np.empty(component_roots.size, dtype=np.int64)
+    component_labels[np.argsort(component_first_voxels)] = np.arange(1, component_roots.size + 1)
+    ball_labels[nonempty] = component_labels[components]
+    return balls, ball_labels, component_roots.size
+
+
+def _write_labels(out, balls: Sequence[Ball], ball_labels: np.ndarray) -> None:
+    """ Writes the labels of the balls into an array that is all zeros.
+
+    The array can be any array-like that supports NumPy style slicing for
+    reading and writing, such as a zarr array or a memory-mapped array.
+    Only the bounding boxes of the balls are ever read or written.
+    """
+    for (lower, upper, mask), ball_label in zip(balls, ball_labels):
+        if ball_label == 0:
+            continue
+        box = tuple(slice(lo, up) for lo, up in zip(lower, upper))
+        region = np.asarray(out[box])
+        region[mask] = ball_label
+        out[box] = region
+
+
+def _sigma_axes(points: Points) -> List[int]:
+    # Returns the axes of the points' data that they have a sigma feature for.
+    return [axis for axis in range(points.ndim) if f'sigma_{axis}' in points.features]
+
+
+def _points_in_reference_data(points: Points, reference_image: Image) -> Tuple[np.ndarray, np.ndarray]:
+    # Follows Points.to_mask with isotropic output, so that the balls are
+    # the same as the ones in that mask, unless the points have a sigma per
+    # feature axis. Then the radii are along each axis of the points' data,
+    # and half a pixel along the other axes.
+    data_to_world = reference_image._data_to_world
+    world_to_data = data_to_world.inverse
+    points_to_reference = points._data_to_world.compose(world_to_data)
+    centers = np.atleast_2d(points_to_reference(points.data)).reshape(-1, len(data_to_world.scale))
+    sigma_axes = _sigma_axes(points)
+    if len(sigma_axes) > 0:
+        radii = np.full(centers.shape, 0.5)
+        for axis in sigma_axes:
+            radii[:, axis] = np.sqrt(len(sigma_axes)) * np.asarray(points.features[f'sigma_{axis}'], dtype=float) / 2
+        return centers, radii * np.abs(points_to_reference.scale)
+    radii_scale = gmean(np.abs(points._data_to_world.scale)) * gmean(np.abs(world_to_data.scale))
+    radii = (np.asarray(points.size, dtype=float) / 2)[:, np.newaxis] * radii_scale
+    radii = np.broadcast_to(radii, centers.shape)
+    return centers, radii
+
+
+def _ball(center: np.ndarray, radii: np.ndarray, shape: np.ndarray) -> Ball:
+    lower = np.maximum(np.floor(center - radii), 0).astype(int)
+    upper = np.minimum(np.ceil(center + radii) + 1, shape).astype(int)
+    upper = np.maximum(upper, lower)
+    normalized_square_distances = np.zeros(tuple(upper - lower))
+    for d, (lo, up, c, r) in enumerate(zip(lower, upper, center, radii)):
+        axis_shape = [1] * len(shape)
+        axis_shape[d] = up - lo
+        normalized_square_distances = normalized_square_distances + (
+            ((np.arange(lo, up) - c) / r) ** 2
+        ).reshape(axis_shape)
+    return lower, upper, normalized_square_distances <= 1
+
+
+def _balls_touch(a: Ball, b: Ball) -> bool:
+    # Balls touch if any voxel of one is next to (including diagonally) or
+    # inside the other, which is when labeling would connect them.
+    a_lower, a_upper, a_mask = a
+    b_lower, b_upper, b_mask = b
+    lower = np.maximum(a_lower - 1, b_lower)
+    upper = np.minimum(a_upper + 1, b_upper)
+    if np.any(upper <= lower):
+        return False
+    dilated_a = ndi.binary_dilation(
+        np.pad(a_mask, 1),
+        structure=np.ones((3,) * a_mask.ndim, dtype=bool),
+    )
+    in_a = tuple(slice(lo - (alo - 1), up - (alo - 1)) for lo, up, alo in zip(lower, upper, a_lower))
+    in_b = tuple(slice(lo - blo, up - blo) for lo, up, blo in zip(lower, upper, b_lower))
+    return bool(np.any(dilated_a[in_a] & b_mask[in_b]))
+
+
+def _first_voxel(ball: Ball, shape: np.ndarray) -> int:
+    lower, _, mask = ball
+    first = np.unravel_index(np.argmax(mask), mask.shape)
+    return int(np.ravel_multi_index(tuple(lower + first), tuple(shape)))
+
+
+def _find(parents: np.ndarray, i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def _union(parents: np.ndarray, i: int, j: int) -> None:
+    root_i, root_j = _find(parents, i), _find(parents, j)
+    if root_i != root_j:
+        parents[max(root_i, root_j)] = min(root_i, root_j)
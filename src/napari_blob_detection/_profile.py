@@ -0,0 +1,133 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class StageStats(NamedTuple):
+    """ The total time and output size of all runs of one stage. """
+    count: int
+    seconds: float
+    nbytes: int
+
+
+class SliceStats(NamedTuple):
+    """ The time spent detecting one slice and the number of blobs in it.
+
+    The time is the sum of the times of the slice's tiles, which may have
+    been detected concurrently.
+    """
+    index: Tuple[int, ...]
+    seconds: float
+    num_blobs: int
+
+
+class Profile:
+    """ Records where time goes while detecting blobs or converting points.
+
+    Stages, like reading data, computing the scale space and finding peaks,
+    are timed each time they run, along with the number of bytes of the
+    arrays that they allocate. Detection also records the duration and
+    number of blobs of each slice.
+    A profile can be shared between threads and profiles from other
+    processes can be merged into it.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, StageStats] = {}
+        self._slices: List[SliceStats] = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Locks cannot be pickled, which is needed to use process workers.
+        return {'stages': self.stages, 'slices': self.slices}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self._stages = state['stages']
+        self._slices = state['slices']
+        self._lock = threading.Lock()
+
+    @property
+    def stages(self) -> Dict[str, StageStats]:
+        """ The stats of each stage, in the order they first ran. """
+        with self._lock:
+            return dict(self._stages)
+
+    @property
+    def slices(self) -> List[SliceStats]:
+        """ The stats of each slice, in the order they finished. """
+        with self._lock:
+            return list(self._slices)
+
+    @classmethod
+    def from_report(cls, report: Dict[str, Any]) -> 'Profile':
+        """ Makes a profile from a report returned by `report`. """
+        profile = cls()
+        for name, stats in report['stages'].items():
+            profile._add_stage(name, StageStats(**stats))
+        for stats in report['slices']:
+            profile.record_slice(**stats)
+        return profile
+
+    def record(self, stage: str, seconds: float, *, nbytes: int = 0) -> None:
+        """ Records one run of a stage. """
+        self._add_stage(stage, StageStats(1, seconds, nbytes))
+
+    def record_slice(self, index: Tuple[int, ...], seconds: float, num_blobs: int) -> None:
+        """ Records the detection of one slice. """
+        with self._lock:
+            self._slices.append(SliceStats(tuple(index), seconds, num_blobs))
+
+    def merge(self, other: 'Profile', *, slices: bool = True) -> None:
+        """ Adds the stages and optionally the slices recorded by another profile to this. """
+        for stage, stats in other.stages.items():
+            self._add_stage(stage, stats)
+        if slices:
+            with self._lock:
+                self._slices.extend(other.slices)
+
+    def report(self) -> Dict[str, Any]:
+        """ Returns the recorded stats as plain data, e.g. for layer metadata or JSON. """
+        return {
+            'stages': {name: stats._asdict() for name, stats in self.stages.items()},
+            'slices': [stats._asdict() for stats in self.slices],
+        }
+
+    def summary(self) -> str:
+        """ Returns a table of the stages, slowest first. """
+        stages = sorted(self.stages.items(), key=lambda item: item[1].seconds, reverse=True)
+        lines = [f'{"stage":<16}{"count":>8}{"seconds":>12}{"MiB":>12}']
+        for name, stats in stages:
+            lines.append(f'{name:<16}{stats.count:>8}{stats.seconds:>12.3f}{stats.nbytes / 2 ** 20:>12.1f}')
+        slices = self.slices
+        if len(slices) > 0:
+            slowest = max(slices, key=lambda s: s.seconds)
+            lines.append(
+                f'{len(slices)} slices, {sum(s.num_blobs for s in slices)} blobs, '
+                f'slowest slice {slowest.index} took {slowest.seconds:.3f}s'
+            )
+        return '\n'.join(lines)
+
+    def _add_stage(self, stage: str, stats: StageStats) -> None:
+        with self._lock:
+            old = self._stages.get(stage, StageStats(0, 0.0, 0))
+            self._stages[stage] = StageStats(
+                old.count + stats.count,
+                old.seconds + stats.seconds,
+                old.nbytes + stats.nbytes,
+            )
+
+
+class Measurement:
+    """ The output size of a measured stage, which is set by the stage. """
+    nbytes: int = 0
+
+
+@contextmanager
+def measure(profile: Optional[Profile], stage: str) -> Iterator[Measurement]:
+    """ Records the time of the enclosed code as a stage of the profile, if any. """
+    measurement = Measurement()
+    start = time.perf_counter()
+    yield measurement
+    if profile is not None:
+        profile.record(stage, time.perf_counter() - start, nbytes=measurement.nbytes)
@@ -0,0 +1,446 @@
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import ndimage as ndi
+from skimage.feature import blob_dog, blob_doh, blob_log, hessian_matrix_det, peak_local_max
+from skimage.transform import integral_image
+from skimage.util import img_as_float, img_as_float32
+
+from ._profile import Profile, measure
+from ._prune import prune_blobs
+
+try:
+    # The private function that blob_doh uses, which reuses one integral
+    # image for every sigma.
+    from skimage.feature._hessian_det_appx import _hessian_matrix_det
+except ImportError:  # pragma: no cover
+    _hessian_matrix_det = None
+
+
+class ScaleSpace(NamedTuple):
+    """ A stack of filtered images and the sigmas used to filter them.
+
+    The filtered images are stacked along the last dimension of the cube
+    and each row of sigmas contains the per-axis sigmas of one image.
+    """
+    cube: np.ndarray
+    sigmas: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return self.cube.nbytes + self.sigmas.nbytes
+
+
+def dog_scale_space(
+    image: np.ndarray,
+    *,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    sigma_ratio: float = 1.6,
+) -> ScaleSpace:
+    """ Computes the Difference of Gaussian scale space used by `blob_dog`. """
+    image = _as_float_image(image)
+    min_sigma = np.full(image.ndim, min_sigma, dtype=image.dtype)
+    max_sigma = np.full(image.ndim, max_sigma, dtype=image.dtype)
+    if sigma_ratio <= 1.0:
+        raise ValueError('sigma_ratio must be > 1.0')
+    # k such that min_sigma*(sigma_ratio**k) > max_sigma
+    k = int(np.mean(np.log(max_sigma / min_sigma) / np.log(sigma_ratio) + 1))
+    sigmas = np.array([min_sigma * (sigma_ratio ** i) for i in range(k + 1)])
+    cube = np.empty(image.shape + (k,), dtype=image.dtype)
+    gaussian_previous = ndi.gaussian_filter(image, sigmas[0], mode='reflect')
+    for i, s in enumerate(sigmas[1:]):
+        gaussian_current = ndi.gaussian_filter(image, s, mode='reflect')
+        cube[..., i] = gaussian_previous - gaussian_current
+        gaussian_previous = gaussian_current
+    # Normalize for consistency in DoG magnitude.
+    cube *= 1 / (sigma_ratio - 1)
+    return ScaleSpace(cube=cube, sigmas=sigmas[:-1])
+
+
+def log_scale_space(
+    image: np.ndarray,
+    *,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    num_sigma: int = 10,
+    log_scale: bool = False,
+) -> ScaleSpace:
+    """ Computes the Laplacian of Gaussian scale space used by `blob_log`. """
+    image = _as_float_image(image)
+    min_sigma = np.full(image.ndim, min_sigma, dtype=image.dtype)
+    max_sigma = np.full(image.ndim, max_sigma, dtype=image.dtype)
+    if log_scale:
+        sigmas = np.logspace(np.log10(min_sigma), np.log10(max_sigma), num_sigma)
+    else:
+        sigmas = np.linspace(min_sigma, max_sigma, num_sigma)
+    cube = np.empty(image.shape + (len(sigmas),), dtype=image.dtype)
+    for i, s in enumerate(sigmas):
+        # Average s**2 provides scale invariance.
+        cube[..., i] = -ndi.gaussian_laplace(image, s) * np.mean(s) ** 2
+    return ScaleSpace(cube=cube, sigmas=sigmas)
+
+
+def doh_scale_space(
+    image: np.ndarray,
+    *,
+    min_sigma: float = 1,
+    max_sigma: float = 30,
+    num_sigma: int = 10,
+    log_scale: bool = False,
+) -> ScaleSpace:
+    """ Computes the Determinant of Hessian scale space used by `blob_doh`.
+
+    Each determinant is approximated with box filters over the integral
+    image, so the cost does not depend on the sigmas.
+    """
+    image = _as_float_image(image)
+    if image.ndim != 2:
+        raise ValueError(f'The determinant of Hessian only supports 2D images, not {image.ndim}D.')
+    if np.ndim(min_sigma) > 0 or np.ndim(max_sigma) > 0:
+        raise ValueError('The determinant of Hessian only supports isotropic sigmas.')
+    if log_scale:
+        sigmas = np.logspace(np.log10(min_sigma), np.log10(max_sigma), num_sigma)
+    else:
+        sigmas = np.linspace(min_sigma, max_sigma, num_sigma)
+    cube = np.empty(image.shape + (len(sigmas),), dtype=image.dtype)
+    if _hessian_matrix_det is None:
+        # Other versions of scikit-image may not have the private function,
+        # so use the public one, which makes the same integral image for
+        # each sigma.
+        for i, s in enumerate(sigmas):
+            cube[..., i] = hessian_matrix_det(image, s, approximate=True)
+    else:
+        integral = integral_image(image)
+        for i, s in enumerate(sigmas):
+            cube[..., i] = _hessian_matrix_det(integral, s)
+    return ScaleSpace(cube=cube, sigmas=np.repeat(sigmas[:, np.newaxis], image.ndim, axis=1))
+
+
+def find_blobs(
+    scale_space: ScaleSpace,
+    *,
+    threshold: float = 0.5,
+    overlap: float = 0.5,
+    profile: Optional[Profile] = None,
+) -> np.ndarray:
+    """ Finds blobs as the local maxima of a scale space.
+
+    Returns the blobs in the same format as `blob_dog`, `blob_log` and `blob_doh`,
+    with a single sigma column when the sigmas are isotropic.
+    If a profile is given, finding peaks and pruning them are recorded in it.
+    """
+    return find_blobs_at_thresholds(scale_space, [threshold], overlap=overlap, profile=profile)[0]
+
+
+def find_blobs_at_thresholds(
+    scale_space: ScaleSpace,
+    thresholds: Sequence[float],
+    *,
+    overlap: float = 0.5,
+    profile: Optional[Profile] = None,
+) -> List[np.ndarray]:
+    """ Finds blobs like `find_blobs` at each of several thresholds.
+
+    The local maxima are only found once, at the lowest threshold, and those
+    above each threshold are then pruned separately, which gives the same
+    blobs as finding them at each threshold in turn.
+    """
+    cube, sigmas = scale_space
+    ndim = cube.ndim - 1
+    isotropic = bool(np.all(sigmas == sigmas[:, :1]))
+    sigma_dim = 1 if isotropic else ndim
+    with measure(profile, 'peaks') as measurement:
+        local_maxima = peak_local_max(
+            cube,
+            threshold_abs=min(thresholds),
+            exclude_border=False,
+            footprint=np.ones((3,) * (ndim + 1)),
+        )
+        measurement.nbytes = local_maxima.nbytes
+    if local_maxima.size == 0:
+        return [np.empty((0, ndim + sigma_dim)) for _ in thresholds]
+    # Compare with the thresholds like peak_local_max, which keeps the peaks
+    # in order of decreasing value.
+    values = cube[tuple(local_maxima.T)]
+    sigmas_of_peaks = sigmas[local_maxima[:, -1], :sigma_dim]
+    candidates = np.hstack([local_maxima[:, :-1].astype(cube.dtype), sigmas_of_peaks])
+    all_blobs = []
+    with measure(profile, 'prune') as measurement:
+        for threshold in thresholds:
+            blobs = prune_blobs(candidates[values > threshold], overlap, sigma_dim=sigma_dim)
+            measurement.nbytes += blobs.nbytes
+            all_blobs.append(blobs)
+    return all_blobs
+
+
+def fast_dog_scale_space(
+    image: np.ndarray,
+    *,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    sigma_ratio: float = 1.6,
+) -> ScaleSpace:
+    """ Computes an approximation of the Difference of Gaussian scale space.
+
+    This has the same sigmas as `dog_scale_space`, but each Gaussian is made
+    by blurring the previous one by the difference in sigma, on an image
+    that is downsampled by a factor of 2 whenever its blur is wide enough
+    to avoid aliasing. All filtering uses float32.
+    """
+    image = img_as_float32(image)
+    if sigma_ratio <= 1.0:
+        raise ValueError('sigma_ratio must be > 1.0')
+    min_sigma = np.full(image.ndim, min_sigma, dtype=np.float64)
+    max_sigma = np.full(image.ndim, max_sigma, dtype=np.float64)
+    k = int(np.mean(np.log(max_sigma / min_sigma) / np.log(sigma_ratio) + 1))
+    sigmas = np.array([min_sigma * (sigma_ratio ** i) for i in range(k + 1)])
+    cube = np.empty(image.shape + (k,), dtype=np.float32)
+    level = _GaussianLevel.of(image)
+    level = level.blurred_to(sigmas[0])
+    for i, s in enumerate(sigmas[1:]):
+        next_level = level.blurred_to(s)
+        cube[..., i] = _upsample(level.image - next_level.image, level, image.shape)
+        level = next_level.downsampled()
+    cube *= 1 / (sigma_ratio - 1)
+    return ScaleSpace(cube=cube, sigmas=sigmas[:-1])
+
+
+def fast_log_scale_space(
+    image: np.ndarray,
+    *,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    num_sigma: int = 10,
+    log_scale: bool = False,
+) -> ScaleSpace:
+    """ Computes an approximation of the Laplacian of Gaussian scale space.
+
+    This has the same sigmas as `log_scale_space`, but the Laplacian at each
+    sigma is applied to a Gaussian that is reused from the previous sigma,
+    on an image that is downsampled by a factor of 2 whenever its blur is
+    wide enough to avoid aliasing. All filtering uses float32.
+    """
+    image = img_as_float32(image)
+    min_sigma = np.full(image.ndim, min_sigma, dtype=np.float64)
+    max_sigma = np.full(image.ndim, max_sigma, dtype=np.float64)
+    if log_scale:
+        sigmas = np.logspace(np.log10(min_sigma), np.log10(max_sigma), num_sigma)
+    else:
+        sigmas = np.linspace(min_sigma, max_sigma, num_sigma)
+    cube = np.empty(image.shape + (len(sigmas),), dtype=np.float32)
+    level = _GaussianLevel.of(image)
+    for i, s in enumerate(sigmas):
+        level = level.downsampled()
+        # Leave at least one pixel of blur for the Laplacian's kernel, which
+        # is poorly sampled when it is narrower, and only blur the Gaussian
+        # when that is also at least one pixel.
+        base = np.sqrt(np.maximum(s ** 2 - level.factors ** 2, 0))
+        step = np.sqrt(np.maximum(base ** 2 - level.sigma ** 2, 0)) / level.factors
+        level = level.blurred_to(np.where(step >= 1, base, level.sigma))
+        laplace = _laplace(level.image, level.blur_to(s), level.factors)
+        cube[..., i] = _upsample(laplace, level, image.shape)
+        # Average s**2 provides scale invariance.
+        cube[..., i] *= -np.mean(s) ** 2
+    return ScaleSpace(cube=cube, sigmas=sigmas)
+
+
+def fast_blob_dog(
+    image: np.ndarray,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    sigma_ratio: float = 1.6,
+    threshold: float = 0.5,
+    overlap: float = 0.5,
+) -> np.ndarray:
+    """ Finds blobs like `blob_dog`, but using `fast_dog_scale_space`. """
+    scale_space = fast_dog_scale_space(
+        image,
+        min_sigma=min_sigma,
+        max_sigma=max_sigma,
+        sigma_ratio=sigma_ratio,
+    )
+    return find_blobs(scale_space, threshold=threshold, overlap=overlap)
+
+
+def fast_blob_log(
+    image: np.ndarray,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    num_sigma: int = 10,
+    threshold: float = 0.2,
+    overlap: float = 0.5,
+    log_scale: bool = False,
+) -> np.ndarray:
+    """ Finds blobs like `blob_log`, but using `fast_log_scale_space`. """
+    scale_space = fast_log_scale_space(
+        image,
+        min_sigma=min_sigma,
+        max_sigma=max_sigma,
+        num_sigma=num_sigma,
+        log_scale=log_scale,
+    )
+    return find_blobs(scale_space, threshold=threshold, overlap=overlap)
+
+
+def max_filter_sigma(
+    method: Callable[..., np.ndarray],
+    *,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    sigma_ratio: float = 1.6,
+    **kwargs,
+) -> np.ndarray:
+    """ Returns the largest sigma that a detection method filters the image with.
+
+    The Difference of Gaussian subtracts a Gaussian one sigma ratio beyond
+    the largest sigma of its scale space, which can be up to sigma_ratio
+    times max_sigma. The other methods filter with sigmas up to max_sigma.
+    """
+    min_sigma, max_sigma = np.broadcast_arrays(np.asarray(min_sigma, dtype=float), np.asarray(max_sigma, dtype=float))
+    if method not in (blob_dog, fast_blob_dog) or sigma_ratio <= 1:
+        return max_sigma
+    # Like dog_scale_space, whose last Gaussian has this many sigma ratios.
+    k = int(np.mean(np.log(max_sigma / min_sigma) / np.log(sigma_ratio) + 1))
+    return np.maximum(min_sigma * sigma_ratio ** k, max_sigma)
+
+
+# Maps each supported blob detection method to the function that computes
+# its scale space.
+SCALE_SPACES: Dict[Callable[..., np.ndarray], Callable[..., ScaleSpace]] = {
+    blob_dog: dog_scale_space,
+    blob_log: log_scale_space,
+    blob_doh: doh_scale_space,
+    fast_blob_dog: fast_dog_scale_space,
+    fast_blob_log: fast_log_scale_space,
+}
+
+# Maps each scikit-image blob detection method to its faster approximation.
+FAST_METHODS: Dict[Callable[..., np.ndarray], Callable[..., np.ndarray]] = {
+    blob_dog: fast_blob_dog,
+    blob_log: fast_blob_log,
+}
+
+# Downsample a Gaussian once its sigma spans this many of its pixels along
+# an axis, so that it is still at least half this after downsampling.
+# Then aliasing is negligible and upsampling is accurate.
+_DOWNSAMPLE_SIGMA = 8
+
+
+class _GaussianLevel(NamedTuple):
+    """ A Gaussian blurred image, which may be downsampled.
+
+    The sigmas are per-axis and in pixels of the original image. The i-th
+    pixel along each axis is at `offsets + i * factors` in the original.
+    """
+    image: np.ndarray
+    sigma: np.ndarray
+    factors: np.ndarray
+    offsets: np.ndarray
+
+    @classmethod
+    def of(cls, image: np.ndarray) -> '_GaussianLevel':
+        return cls(image, np.zeros(image.ndim), np.ones(image.ndim, dtype=int), np.zeros(image.ndim))
+
+    def blur_to(self, sigma: np.ndarray) -> np.ndarray:
+        """ Returns the per-axis sigmas in pixels that blur this to the given sigmas. """
+        return np.sqrt(np.maximum(sigma ** 2 - self.sigma ** 2, 0)) / self.factors
+
+    def blurred_to(self, sigma: np.ndarray) -> '_GaussianLevel':
+        blurred = ndi.gaussian_filter(self.image, self.blur_to(sigma), mode='reflect')
+        return self._replace(image=blurred, sigma=np.maximum(sigma, self.sigma))
+
+    def downsampled(self) -> '_GaussianLevel':
+        """ Halves the size of the axes that are blurred enough to do so.
+
+        Pairs of pixels are averaged, so that the reflected boundaries of the
+        downsampled image stay close to those of the original.
+        """
+        image = self.image
+        sigma = self.sigma.copy()
+        factors = self.factors.copy()
+        offsets = self.offsets.copy()
+        for axis in np.flatnonzero(sigma / factors >= _DOWNSAMPLE_SIGMA):
+            if image.shape[axis] % 2 == 1:
+                image = np.concatenate([image, np.take(image, [-1], axis=axis)], axis=axis)
+            even = np.take(image, np.arange(0, image.shape[axis], 2), axis=axis)
+            odd = np.take(image, np.arange(1, image.shape[axis], 2), axis=axis)
+            image = (even + odd) / 2
+            # Averaging a pair has the variance of a uniform pair of pixels.
+            sigma[axis] = np.sqrt(sigma[axis] ** 2 + (factors[axis] / 2) ** 2)
+            offsets[axis] += factors[axis] / 2
+            factors[axis] *= 2
+        return _GaussianLevel(image, sigma, factors, offsets)
+
+
+def _laplace(image: np.ndarray, sigma: np.ndarray, factors: np.ndarray) -> np.ndarray:
+    # Like ndi.gaussian_laplace, but with the second derivatives scaled to
+    # pixels of the original image and kernels that are exact for quadratics.
+    # The image is usually already very smooth, so even the tiny nonzero sum
+    # of scipy's second derivative kernels would dominate its result.
+    kernels = [_gaussian_kernels(s) for s in sigma]
+    laplace = np.zeros_like(image)
+    for axis in range(image.ndim):
+        derivative = image
+        for other, (smooth, second) in enumerate(kernels):
+            weights = second / factors[axis] ** 2 if other == axis else smooth
+            derivative = ndi.correlate1d(derivative, weights, axis=other, mode='reflect')
+        laplace += derivative
+    return laplace
+
+
+def _gaussian_kernels(sigma: float) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns a normalized Gaussian kernel and its second derivative with the
+    # same radius as scipy's, which sums to 0 and has a second moment of 2.
+    x = np.arange(-int(4 * sigma + 0.5), int(4 * sigma + 0.5) + 1)
+    smooth = np.exp(-0.5 * (x / sigma) ** 2)
+    smooth /= smooth.sum()
+    second = (x ** 2 / sigma ** 4 - 1 / sigma ** 2) * smooth
+    second -= second.sum() * smooth
+    second *= 2 / np.sum(x ** 2 * second)
+    return smooth, second
+
+
+def _upsample(level_image: np.ndarray, level: _GaussianLevel, shape: Tuple[int, ...]) -> np.ndarray:
+    # Interpolates an image on the pixels of a level back to the original
+    # pixels with separable cubic convolution, which unlike linear
+    # interpolation does not snap peaks to the level's pixels.
+    image = level_image
+    for axis, (factor, offset, size) in enumerate(zip(level.factors, level.offsets, shape)):
+        if factor == 1:
+            continue
+        position = (np.arange(size) - offset) / factor
+        lower = np.floor(position).astype(int)
+        t = position - lower
+        weight_shape = [1] * image.ndim
+        weight_shape[axis] = size
+        upsampled = np.zeros(image.shape[:axis] + (size,) + image.shape[axis + 1:], dtype=image.dtype)
+        for tap, weight in zip(range(-1, 3), _cubic_weights(t)):
+            indices = _reflect_indices(lower + tap, image.shape[axis])
+            upsampled += np.take(image, indices, axis=axis) * weight.astype(image.dtype).reshape(weight_shape)
+        image = upsampled
+    return image
+
+
+def _cubic_weights(t: np.ndarray) -> Tuple[np.ndarray, ...]:
+    # The weights of Keys' cubic convolution with a = -0.5 for the pixels at
+    # -1, 0, 1 and 2 relative to the one below each position.
+    return (
+        ((-0.5 * t + 1) * t - 0.5) * t,
+        (1.5 * t - 2.5) * t * t + 1,
+        ((-1.5 * t + 2) * t + 0.5) * t,
+        (0.5 * t - 0.5) * t * t,
+    )
+
+
+def _reflect_indices(indices: np.ndarray, size: int) -> np.ndarray:
+    # Matches the 'reflect' mode of scipy.ndimage, which repeats the edge.
+    indices = np.where(indices < 0, -indices - 1, indices)
+    return np.where(indices >= size, 2 * size - indices - 1, indices).clip(0, size - 1)
+
+
+def _as_float_image(image: np.ndarray) -> np.ndarray:
+    image = img_as_float(image)
+    if image.dtype == np.float16:
+        image = image.astype(np.float32)
+    return image
@@ -0,0 +1,146 @@
+from typing import Any, Callable, Iterable, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ._blobs import Blobs, assemble_blobs, get_engine_method, get_method, sigmas_per_axis
+from ._profile import Profile, measure
+from ._scale_space import SCALE_SPACES, ScaleSpace, find_blobs_at_thresholds
+
+Index = Tuple[int, ...]
+
+# The relative tolerance of the sigmas of the scale space's levels when
+# selecting those in a sigma range, which absorbs rounding in their spacing.
+_SIGMA_TOLERANCE = 1e-6
+
+
+class Sweep(NamedTuple):
+    """ The blobs detected with each combination of the parameters of a sweep.
+
+    The blobs detected with the i-th sigma range and j-th threshold are
+    `blobs[i][j]` and there are `counts[i, j]` of them.
+    """
+    thresholds: np.ndarray
+    sigma_ranges: np.ndarray
+    counts: np.ndarray
+    blobs: Tuple[Tuple[Blobs, ...], ...]
+
+
+def sweep(
+    data: Any,
+    *,
+    thresholds: Sequence[float],
+    sigma_ranges: Optional[Sequence[Tuple[float, float]]] = None,
+    method: Union[str, Callable[..., np.ndarray]] = 'laplacian_of_gaussian',
+    dimensionality: int = 2,
+    min_sigma: float = 1,
+    max_sigma: float = 50,
+    overlap: float = 0.5,
+    engine: str = 'scikit-image',
+    indices: Optional[Iterable[Index]] = None,
+    spacing: Optional[Sequence[float]] = None,
+    profile: Optional[Profile] = None,
+    **kwargs,
+) -> Sweep:
+    """ Detects blobs with every combination of some thresholds and sigma ranges.
+
+    The scale space of each leading dimension slice is only computed once,
+    from min_sigma to max_sigma. The blobs of each sigma range are the local
+    maxima of the levels of that scale space whose sigmas are in the range,
+    which are only found once for all of the thresholds. So sweeping many
+    parameters costs little more than detecting blobs once, which makes
+    tuning them for new images much faster.
+
+    Parameters
+    ----------
+    data : array-like
+        The image data, which can be a NumPy, dask or zarr array. Lazy data
+        is read one slice at a time.
+    thresholds : Sequence[float]
+        The thresholds to detect blobs with.
+    sigma_ranges : Sequence[Tuple[float, float]], optional
+        The smallest and largest sigma of each range of blob sizes to detect,
+        which must be within min_sigma and max_sigma. If None, the only range
+        is from min_sigma to max_sigma.
+    method : str or Callable
+        Either 'difference_of_gaussian', 'laplacian_of_gaussian',
+        'determinant_of_hessian', or a function like
+        `skimage.feature.blob_log`.
+    dimensionality : int
+        The dimensionality of the blobs to find. Any leading extra dimensions
+        are iterated over.
+    min_sigma : float
+        The smallest sigma of the scale space.
+    max_sigma : float
+        The largest sigma of the scale space.
+    overlap : float
+        A value between 0 and 1. If the fraction of the area (or volume) of a
+        blob that overlaps a larger blob is greater than this, the smaller
+        blob is removed.
+    engine : Literal['scikit-image', 'fast']
+        The implementation of the scale space.
+    indices : Iterable[Tuple[int, ...]], optional
+        If given, only detect blobs on the slices with these leading
+        dimension indices, in this order. Otherwise detect all slices.
+    spacing : Sequence[float], optional
+        The size of the pixels along each feature dimension for anisotropic
+        data. With a spacing, the sigmas are in pixels of the last dimension.
+    profile : Profile, optional
+        If given, the stages of the sweep are recorded in it.
+    **kwargs
+        The other options of the scale space, like `num_sigma`,
+        `log_scale` and `sigma_ratio`.
+
+    Returns
+    -------
+    Sweep
+        The number of blobs and the blobs of each combination of parameters.
+    """
+    if data.ndim < dimensionality:
+        raise ValueError(f'The input image has fewer dimensions ({data.ndim}) than the feature dimensionality ({dimensionality})')
+    thresholds = np.asarray(thresholds, dtype=float).reshape(-1)
+    if thresholds.size == 0:
+        raise ValueError('At least one threshold is needed.')
+    if sigma_ranges is None:
+        sigma_ranges = [(min_sigma, max_sigma)]
+    sigma_ranges = np.asarray(sigma_ranges, dtype=float).reshape(-1, 2)
+    tolerance = _SIGMA_TOLERANCE * max_sigma
+    outside = (sigma_ranges[:, 0] < min_sigma - tolerance) | (sigma_ranges[:, 1] > max_sigma + tolerance)
+    if np.any(outside | (sigma_ranges[:, 0] > sigma_ranges[:, 1])):
+        raise ValueError(f'Each sigma range must be within min_sigma ({min_sigma}) and max_sigma ({max_sigma}).')
+    scale_space_kwargs = {'min_sigma': min_sigma, 'max_sigma': max_sigma, **kwargs}
+    if spacing is not None:
+        for name in ('min_sigma', 'max_sigma'):
+            scale_space_kwargs[name] = sigmas_per_axis(scale_space_kwargs[name], spacing)
+    compute_scale_space = SCALE_SPACES[get_engine_method(get_method(method), engine)]
+    if indices is None:
+        indices = np.ndindex(data.shape[:data.ndim - dimensionality])
+    indices = [tuple(index) for index in indices]
+    # Compare with Python floats like detection does.
+    threshold_values = [float(threshold) for threshold in thresholds]
+    slice_blobs = [[[] for _ in thresholds] for _ in sigma_ranges]
+    for index in indices:
+        with measure(profile, 'read') as measurement:
+            image = np.asarray(data[index])
+            measurement.nbytes = image.nbytes
+        with measure(profile, 'scale_space') as measurement:
+            scale_space = compute_scale_space(image, **scale_space_kwargs)
+            measurement.nbytes = scale_space.nbytes
+        # The sigmas are in pixels of the last dimension, like the ranges.
+        level_sigmas = scale_space.sigmas[:, -1]
+        for i, (low, high) in enumerate(sigma_ranges):
+            levels = np.flatnonzero((level_sigmas >= low - tolerance) & (level_sigmas <= high + tolerance))
+            if levels.size == 0:
+                all_blobs = [np.empty((0, dimensionality + 1)) for _ in thresholds]
+            else:
+                # The levels are contiguous, so this is a view of the scale space.
+                levels = slice(levels[0], levels[-1] + 1)
+                range_space = ScaleSpace(cube=scale_space.cube[..., levels], sigmas=scale_space.sigmas[levels])
+                all_blobs = find_blobs_at_thresholds(range_space, threshold_values, overlap=overlap, profile=profile)
+            for j, blobs in enumerate(all_blobs):
+                slice_blobs[i][j].append((index, blobs))
+    blobs = tuple(
+        tuple(assemble_blobs(s, ndim=data.ndim, dimensionality=dimensionality) for s in range_blobs)
+        for range_blobs in slice_blobs
+    )
+    counts = np.array([[b.coords.shape[0] for b in range_blobs] for range_blobs in blobs], dtype=int)
+    return Sweep(thresholds, sigma_ranges, counts.reshape(sigma_ranges.shape[0], thresholds.size), blobs)
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+from scipy import ndimage as ndi
+from napari.layers import Image, Labels
+from .. import detect_blobs, detect_blobs_in_channels, detect_channel_blobs, laplacian_of_gaussian
+
+
+class _CountingArray:
+    # Wraps an array to record the keys that it is read with.
+    def __init__(self, data):
+        self._data = data
+        self.shape = data.shape
+        self.ndim = data.ndim
+        self.keys = []
+
+    def __getitem__(self, key):
+        self.keys.append(key)
+        return self._data[key]
+
+
+def _channels_image():
+    data = np.zeros((2, 3, 30, 30))
+    data[:, 0, 5:8, 5:8] = 1
+    data[:, 1, 15:20, 15:20] = 0.3
+    data[1, 2, 22:25, 3:6] = 1
+    return data
+
+
+def test_detect_channel_blobs_matches_each_channel_with_its_parameters():
+    data = _channels_image()
+    parameters = [{'threshold': 0.5}, {'threshold': 0.1, 'min_sigma': 2}, {}]
+
+    result = detect_channel_blobs(data, channel_axis=1, parameters=parameters, max_sigma=5, threshold=0.2, num_workers=3)
+
+    for channel, channel_parameters in enumerate(parameters):
+        expected = detect_blobs(data[:, channel], **{'max_sigma': 5, 'threshold': 0.2, **channel_parameters})
+        np.testing.assert_array_equal(result.blobs.coords[result.channels == channel], expected.coords)
+        np.testing.assert_array_equal(result.blobs.sigmas[result.channels == channel], expected.sigmas)
+    np.testing.assert_array_equal(result.channels, [0, 1, 0, 1, 2])
+    np.testing.assert_array_equal(result.blobs.slice_indices, [[0], [1]])
+    np.testing.assert_array_equal(result.blobs.slice_offsets, [0, 2, 5])
+
+
+def test_detect_channel_blobs_reads_each_slice_once():
+    data = _CountingArray(_channels_image())
+
+    detect_channel_blobs(data, channel_axis=1, max_sigma=5)
+
+    assert data.keys == [(0, slice(None)), (1, slice(None))]
+
+
+def test_detect_channel_blobs_checks_parameters():
+    with pytest.raises(ValueError, match='2 sets of parameters, but 3 channels'):
+        detect_channel_blobs(_channels_image(), channel_axis=1, parameters=[{}, {}])
+    with pytest.raises(ValueError, match='leading dimensions'):
+        detect_channel_blobs(_channels_image(), channel_axis=2)
+
+
+def test_detect_blobs_in_channels_adds_channel_feature():
+    data = _channels_image()
+    images = [Image(data[:, channel], name=name) for channel, name in enumerate(('dapi', 'gfp', 'rfp'))]
+
+    points_data, state, layer_type = detect_blobs_in_channels(images, parameters=[{}, {'threshold': 0.1}, {}], max_sigma=5)
+
+    assert layer_type == 'Points'
+    assert state['name'] == 'dapi-gfp-rfp-features-blob_log'
+    assert list(state['features']['channel']) == ['dapi', 'gfp', 'dapi', 'gfp', 'rfp']
+    np.testing.assert_allclose(points_data[-1], [1, 23, 4])
+
+
+def test_detect_channel_blobs_with_mask_of_each_slice():
+    data = _channels_image()
+    mask = np.zeros((2, 30, 30), dtype=bool)
+    mask[0, :10, :10] = True
+    mask[1, 10:, :] = True
+
+    result = detect_channel_blobs(data, channel_axis=1, max_sigma=5, threshold=0.2, mask=mask)
+
+    np.testing.assert_allclose(result.blobs.coords, [[0, 6, 6], [1, 17, 17], [1, 23, 4]])
+    np.testing.assert_array_equal(result.channels, [0, 1, 2])
+
+
+def test_detect_blobs_in_channels_with_labels_mask():
+    data = _channels_image()
+    images = [Image(data[:, channel], scale=(1, 2, 2)) for channel in range(3)]
+    # The labels are in world coordinates, where the image pixels are 2 wide.
+    mask = np.zeros((30, 30), dtype=int)
+    mask[:10, :] = 1
+    labels = Labels(mask, scale=(2, 2))
+
+    points_data, state, _ = detect_blobs_in_channels(images, max_sigma=5, threshold=0.2, mask=labels)
+
+    np.testing.assert_allclose(points_data, [[0, 6, 6], [1, 6, 6]])
+
+
+def _anisotropic_stack():
+    data = np.zeros((20, 40, 40))
+    for center in ((5, 10, 10), (12, 28, 24)):
+        data[center] = 1
+    data = ndi.gaussian_filter(data, (0.6, 3, 3))
+    return data / data.max()
+
+
+def test_detect_channel_blobs_keeps_sigmas_per_axis_of_each_channel():
+    data = _anisotropic_stack()
+
+    result = detect_channel_blobs(
+        [data, data],
+        parameters=[{'spacing': (5, 1, 1)}, {}],
+        dimensionality=3,
+        max_sigma=6,
+        threshold=0.05,
+    )
+
+    anisotropic = result.axis_sigmas[result.channels == 0]
+    isotropic = result.axis_sigmas[result.channels == 1]
+    np.testing.assert_allclose(anisotropic, anisotropic[:, -1:] * [0.2, 1, 1])
+    np.testing.assert_allclose(isotropic, np.repeat(isotropic[:, -1:], 3, axis=1))
+    np.testing.assert_allclose(result.axis_sigmas[:, -1], result.blobs.sigmas)
+
+
+def test_detect_blobs_in_channels_adds_sigmas_per_axis_like_one_layer():
+    images = [Image(_anisotropic_stack(), scale=(5, 1, 1), name=name) for name in ('a', 'b')]
+
+    _, state, _ = detect_blobs_in_channels(images, dimensionality=3, max_sigma=6, threshold=0.05)
+
+    _, expected_state, _ = laplacian_of_gaussian(images[0], dimensionality=3, max_sigma=6, threshold=0.05)
+    features = state['features']
+    for name in ('sigma', 'sigma_0', 'sigma_1', 'sigma_2'):
+        np.testing.assert_allclose(features[name][features['channel'] == 'a'], expected_state['features'][name])
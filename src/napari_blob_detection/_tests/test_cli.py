@@ -0,0 +1,161 @@
+import logging
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+from .. import detect_blobs, load_blobs
+from .. import _cli
+from .._cli import detect_blobs_in_files, main
+from .._io import is_complete, read_blobs, read_image, write_blobs
+
+
+def _make_image(seed):
+    rng = np.random.default_rng(seed)
+    data = np.zeros((2, 20, 20))
+    for t in range(2):
+        y, x = rng.integers(2, 15, size=2)
+        data[t, y:y + 3, x:x + 3] = 1
+    return data
+
+
+def test_detect_blobs_array():
+    data = _make_image(0)
+
+    blobs = detect_blobs(data, method='difference_of_gaussian', max_sigma=5)
+
+    assert blobs.coords.shape == (2, 3)
+    np.testing.assert_array_equal(blobs.coords[:, 0], [0, 1])
+    np.testing.assert_array_equal(blobs.slice_offsets, [0, 1, 2])
+
+
+@pytest.mark.parametrize('output_format', ('csv', 'parquet', 'zarr'))
+def test_main_writes_and_skips_outputs(tmp_path, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    if output_format == 'zarr':
+        pytest.importorskip('zarr')
+    for i in range(3):
+        np.save(tmp_path / f'image{i}.npy', _make_image(i))
+    output_dir = tmp_path / 'blobs'
+    args = [str(tmp_path / '*.npy'), '-o', str(output_dir), '--format', output_format, '--max-sigma', '5']
+
+    assert main(args) == 0
+
+    for i in range(3):
+        expected = detect_blobs(_make_image(i), max_sigma=5)
+        coords, sigmas = read_blobs(output_dir / f'image{i}-blobs.{output_format}')
+        np.testing.assert_allclose(coords, expected.coords)
+        np.testing.assert_allclose(sigmas, expected.sigmas)
+
+    removed = output_dir / f'image0-blobs.{output_format}'
+    if removed.is_dir():
+        shutil.rmtree(removed)
+    else:
+        removed.unlink()
+    mtime = (output_dir / f'image1-blobs.{output_format}').stat().st_mtime_ns
+
+    assert main(args) == 0
+
+    assert (output_dir / f'image0-blobs.{output_format}').exists()
+    assert (output_dir / f'image1-blobs.{output_format}').stat().st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize('compression', (None, 'zlib'))
+def test_main_reads_tiff_images(tmp_path, compression):
+    tifffile = pytest.importorskip('tifffile')
+    data = _make_image(0).astype(np.float32)
+    tifffile.imwrite(tmp_path / 'image.tif', data, compression=compression)
+
+    np.testing.assert_array_equal(read_image(tmp_path / 'image.tif'), data)
+    assert main([str(tmp_path / 'image.tif'), '--max-sigma', '5']) == 0
+
+    coords, _ = read_blobs(tmp_path / 'image-blobs.csv')
+    np.testing.assert_allclose(coords, detect_blobs(data, max_sigma=5).coords)
+
+
+def test_detect_blobs_in_files_detects_files_concurrently(tmp_path, monkeypatch, caplog):
+    for i in range(3):
+        np.save(tmp_path / f'image{i}.npy', _make_image(i))
+    # Each file waits for the others to be read, which needs concurrent files.
+    barrier = threading.Barrier(3, timeout=10)
+    read_image = _cli.read_image
+
+    def _read_image_together(path):
+        barrier.wait()
+        return read_image(path)
+
+    monkeypatch.setattr(_cli, 'read_image', _read_image_together)
+
+    with caplog.at_level(logging.INFO, logger=_cli.__name__):
+        written = detect_blobs_in_files([str(tmp_path / '*.npy')], max_sigma=5, num_workers=3)
+
+    assert written == [tmp_path / f'image{i}-blobs.csv' for i in range(3)]
+    for i in range(3):
+        expected = detect_blobs(_make_image(i), max_sigma=5)
+        coords, sigmas = read_blobs(written[i])
+        np.testing.assert_allclose(coords, expected.coords)
+        np.testing.assert_allclose(sigmas, expected.sigmas)
+    assert sum('Wrote blobs' in record.getMessage() for record in caplog.records) == 3
+
+
+def test_main_mirrors_directories_of_images_with_same_name(tmp_path):
+    for plate in ('p1', 'p2'):
+        (tmp_path / 'plates' / plate).mkdir(parents=True)
+        np.save(tmp_path / 'plates' / plate / 'A01.npy', _make_image(int(plate[1])))
+    output_dir = tmp_path / 'blobs'
+    checkpoint_dir = tmp_path / 'checkpoints'
+
+    main([str(tmp_path / 'plates' / '**' / '*.npy'), '-o', str(output_dir), '--checkpoint-dir', str(checkpoint_dir), '--max-sigma', '5'])
+
+    for plate in ('p1', 'p2'):
+        expected = detect_blobs(_make_image(int(plate[1])), max_sigma=5)
+        coords, _ = read_blobs(output_dir / plate / 'A01-blobs.csv')
+        np.testing.assert_allclose(coords, expected.coords)
+        assert (checkpoint_dir / plate / 'A01.npy').is_dir()
+
+
+def _interrupted_slice_blobs(num_slices):
+    for t in range(num_slices):
+        yield (t,), np.array([[t + 1.0, 2.0, 1.0]])
+    raise RuntimeError('Interrupted')
+
+
+def test_interrupted_zarr_output_keeps_finished_slices(tmp_path):
+    pytest.importorskip('zarr')
+    output_path = tmp_path / 'blobs.zarr'
+
+    with pytest.raises(RuntimeError):
+        write_blobs(_interrupted_slice_blobs(2), output_path, ndim=3)
+
+    assert not is_complete(output_path)
+    blobs = load_blobs(output_path)
+    np.testing.assert_array_equal(blobs.slice_indices, [[0], [1]])
+    np.testing.assert_allclose(blobs.coords, [[0, 1, 2], [1, 2, 2]])
+
+
+@pytest.mark.parametrize('output_format', ('csv', 'parquet'))
+def test_interrupted_file_output_is_not_written(tmp_path, output_format):
+    if output_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    output_path = tmp_path / f'blobs.{output_format}'
+
+    with pytest.raises(RuntimeError):
+        write_blobs(_interrupted_slice_blobs(2), output_path, ndim=3)
+
+    assert not is_complete(output_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_main_detects_images_with_interrupted_outputs(tmp_path):
+    pytest.importorskip('zarr')
+    np.save(tmp_path / 'image.npy', _make_image(0))
+    output_path = tmp_path / 'image-blobs.zarr'
+    with pytest.raises(RuntimeError):
+        write_blobs(_interrupted_slice_blobs(1), output_path, ndim=3)
+
+    assert main([str(tmp_path / 'image.npy'), '--format', 'zarr', '--max-sigma', '5']) == 0
+
+    assert is_complete(output_path)
+    np.testing.assert_allclose(load_blobs(output_path).coords, detect_blobs(_make_image(0), max_sigma=5).coords)
@@ -1,7 +1,19 @@
+import gc
+import threading
+import time
+
 import pytest
 import numpy as np
-from napari.layers import Image
-from .. import difference_of_gaussian, laplacian_of_gaussian
+from scipy import ndimage as ndi
+from napari.layers import Image, Labels, Shapes
+from skimage.feature import blob_dog, blob_doh, blob_log
+from skimage.feature.blob import _blob_overlap, _prune_blobs
+from .. import Profile, ScaleSpaceCache, detect_blobs, determinant_of_hessian, difference_of_gaussian, laplacian_of_gaussian, load_blobs
+from .._blobs import slice_rows
+from .._parallel import map_in_order
+from .._prune import overlap_fractions, prune_blobs
+from .._scale_space import FAST_METHODS, SCALE_SPACES, ScaleSpace, max_filter_sigma
+from .._tiling import halo_size, make_tiles, tile_grid
 
 
 METHODS = (difference_of_gaussian, laplacian_of_gaussian)
@@ -68,3 +80,622 @@ def test_detect_with_2d_image_3d_features(method):
     
     with pytest.raises(ValueError):
         method(image, dimensionality=3)
+
+
+@pytest.mark.parametrize('method', METHODS)
+@pytest.mark.parametrize('worker_type', ('thread', 'process'))
+def test_detect_with_many_workers_matches_serial(method, worker_type):
+    image = Image(np.zeros((5, 10, 10)))
+    for t in range(5):
+        image.data[t, t:t + 3, 5:8] = 1
+
+    serial_data, serial_state, _ = method(image, dimensionality=2)
+    parallel_data, parallel_state, _ = method(
+        image, dimensionality=2, num_workers=3, worker_type=worker_type,
+    )
+
+    np.testing.assert_array_equal(parallel_data, serial_data)
+    np.testing.assert_array_equal(parallel_state['features']['sigma'], serial_state['features']['sigma'])
+
+
+def test_closing_parallel_map_does_not_wait_for_running_work():
+    release = threading.Event()
+
+    def _wait_unless_first(i):
+        if i > 0:
+            release.wait(10)
+        return i
+
+    results = map_in_order(_wait_unless_first, range(10), num_workers=2)
+    assert next(results) == 0
+
+    start = time.perf_counter()
+    results.close()
+    seconds = time.perf_counter() - start
+    release.set()
+
+    assert seconds < 5
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_tiles_matches_whole_image(method):
+    image = Image(np.zeros((2, 40, 40)))
+    for y, x in ((3, 5), (14, 14), (15, 30), (30, 16), (33, 33)):
+        image.data[:, y:y + 3, x:x + 3] = 1
+
+    whole_data, whole_state, _ = method(image, dimensionality=2, max_sigma=2)
+    tiled_data, tiled_state, _ = method(image, dimensionality=2, max_sigma=2, tile_size=16)
+
+    whole = np.column_stack([whole_data, whole_state['features']['sigma']])
+    tiled = np.column_stack([tiled_data, tiled_state['features']['sigma']])
+    np.testing.assert_allclose(np.unique(tiled, axis=0), np.unique(whole, axis=0))
+
+
+@pytest.mark.parametrize('method', (blob_dog, blob_log))
+def test_tile_scale_space_matches_whole_image_in_core(method):
+    image = np.random.default_rng(0).random((200, 200))
+    grid = tile_grid(image.shape, tile_size=40)
+    halo = halo_size(max_filter_sigma(method, min_sigma=1, max_sigma=10))
+    # The middle tile, whose halo does not reach the edges of the image.
+    tile = list(make_tiles((), grid, halo=halo))[12]
+
+    whole = SCALE_SPACES[method](image, min_sigma=1, max_sigma=10)
+    tiled = SCALE_SPACES[method](image[tile.outer], min_sigma=1, max_sigma=10)
+
+    core = tuple(slice(a - o.start, b - o.start) for a, b, o in zip(tile.core_start, tile.core_stop, tile.outer))
+    whole_core = tuple(slice(a, b) for a, b in zip(tile.core_start, tile.core_stop))
+    np.testing.assert_allclose(tiled.cube[core], whole.cube[whole_core], atol=1e-12)
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_dask_image_matches_numpy(method):
+    da = pytest.importorskip('dask.array')
+    data = np.zeros((2, 40, 40))
+    for y, x in ((3, 5), (14, 14), (15, 30), (30, 16), (33, 33)):
+        data[:, y:y + 3, x:x + 3] = 1
+
+    numpy_data, numpy_state, _ = method(Image(data), dimensionality=2, max_sigma=2)
+    dask_image = Image(da.from_array(data, chunks=(1, 16, 16)))
+    dask_data, dask_state, _ = method(dask_image, dimensionality=2, max_sigma=2)
+
+    numpy_blobs = np.column_stack([numpy_data, numpy_state['features']['sigma']])
+    dask_blobs = np.column_stack([dask_data, dask_state['features']['sigma']])
+    np.testing.assert_allclose(np.unique(dask_blobs, axis=0), np.unique(numpy_blobs, axis=0))
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_cache_matches_uncached(method):
+    image = Image(np.zeros((2, 20, 20)))
+    image.data[0, 3:6, 5:8] = 1
+    image.data[1, 12:16, 10:14] = 0.4
+    cache = ScaleSpaceCache()
+
+    for threshold in (0.5, 0.1, 0.01):
+        expected_data, expected_state, _ = method(image, max_sigma=5, threshold=threshold)
+        cached_data, cached_state, _ = method(image, max_sigma=5, threshold=threshold, cache=cache)
+
+        np.testing.assert_allclose(cached_data, expected_data)
+        np.testing.assert_allclose(cached_state['features']['sigma'], expected_state['features']['sigma'])
+        assert len(cache) == 2
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_cache_follows_data_edited_in_place(method):
+    image = Image(np.zeros((30, 30)))
+    image.data[5:8, 5:8] = 1
+    cache = ScaleSpaceCache()
+    method(image, max_sigma=5, threshold=0.1, cache=cache)
+
+    image.data[:] = 0
+    image.data[20:23, 20:23] = 1
+    cached_data, _, _ = method(image, max_sigma=5, threshold=0.1, cache=cache)
+    expected_data, _, _ = method(image, max_sigma=5, threshold=0.1)
+
+    np.testing.assert_allclose(cached_data, expected_data)
+
+
+def test_scale_space_cache_evicts_layer_when_its_data_changes():
+    image = Image(np.zeros((20, 20)))
+    other = Image(np.zeros((20, 20)))
+    cache = ScaleSpaceCache()
+    laplacian_of_gaussian(image, max_sigma=5, cache=cache)
+    laplacian_of_gaussian(other, max_sigma=5, cache=cache)
+
+    image.data = np.ones((20, 20))
+
+    assert len(cache) == 1
+    laplacian_of_gaussian(other, max_sigma=5, threshold=0.1, cache=cache)
+    assert len(cache) == 1
+
+
+def test_scale_space_cache_evicts_deleted_layer():
+    image = Image(np.zeros((20, 20)))
+    cache = ScaleSpaceCache()
+    laplacian_of_gaussian(image, max_sigma=5, cache=cache)
+    assert len(cache) == 1
+
+    del image
+    gc.collect()
+
+    assert len(cache) == 0
+
+
+def test_scale_space_cache_evicts_least_recently_used():
+    scale_space = ScaleSpace(cube=np.zeros((10, 10, 2)), sigmas=np.ones((2, 2)))
+    cache = ScaleSpaceCache(max_bytes=2 * scale_space.nbytes)
+    cache.put('a', scale_space)
+    cache.put('b', scale_space)
+    cache.get('a')
+
+    cache.put('c', scale_space)
+
+    assert cache.get('b') is None
+    assert cache.get('a') is scale_space
+    assert cache.get('c') is scale_space
+    assert cache.nbytes == 2 * scale_space.nbytes
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_indices(method):
+    image = Image(np.zeros((3, 10, 10)))
+    image.data[0, 3:6, 5:8] = 1
+    image.data[2, 5:8, 3:6] = 1
+
+    points_data, _, _ = method(image, dimensionality=2, indices=[(2,), (1,)])
+
+    np.testing.assert_allclose(points_data, [[2, 6, 4]])
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_slice_rows(method):
+    image = Image(np.zeros((3, 10, 10)))
+    image.data[0, 3:6, 5:8] = 1
+    image.data[2, 1:4, 6:9] = 1
+    image.data[2, 6:9, 1:4] = 1
+
+    points_data, points_state, _ = method(image, dimensionality=2, max_sigma=2)
+
+    metadata = points_state['metadata']
+    np.testing.assert_array_equal(metadata['slice_indices'], [[0], [1], [2]])
+    np.testing.assert_array_equal(metadata['slice_offsets'], [0, 1, 1, 3])
+    assert slice_rows(metadata, (1,)) == slice(1, 1)
+    np.testing.assert_array_equal(points_data[slice_rows(metadata, (2,)), 0], [2, 2])
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_fast_engine_matches_scikit_image(method):
+    image = Image(np.zeros((3, 128, 128)))
+    rows, cols = np.mgrid[:128, :128]
+    for i, (row, col, sigma) in enumerate([(30, 40, 2), (80, 70, 6), (64, 64, 12)]):
+        image.data[i] = np.exp(-((rows - row) ** 2 + (cols - col) ** 2) / (2 * sigma ** 2))
+
+    expected_data, expected_state, _ = method(image, max_sigma=32, threshold=0.1)
+    data, state, _ = method(image, max_sigma=32, threshold=0.1, engine='fast')
+
+    np.testing.assert_allclose(data, expected_data, atol=1)
+    np.testing.assert_allclose(state['features']['sigma'], expected_state['features']['sigma'])
+
+
+@pytest.mark.parametrize('method', (blob_dog, blob_log))
+def test_fast_scale_space_is_close_to_scikit_image(method):
+    rows, cols = np.mgrid[:256, :256]
+    image = np.exp(-((rows - 100) ** 2 + (cols - 150) ** 2) / (2 * 30 ** 2))
+
+    expected = SCALE_SPACES[method](image, min_sigma=2, max_sigma=100)
+    actual = SCALE_SPACES[FAST_METHODS[method]](image, min_sigma=2, max_sigma=100)
+
+    assert actual.cube.dtype == np.float32
+    np.testing.assert_allclose(actual.sigmas, expected.sigmas)
+    np.testing.assert_allclose(actual.cube, expected.cube, atol=0.01)
+
+
+def test_determinant_of_hessian_matches_scikit_image():
+    image = Image(np.zeros((2, 64, 64)), scale=(1, 2, 2))
+    image.data[0, 10:20, 30:40] = 1
+    image.data[1, 30:50, 20:40] = 1
+    expected = [blob_doh(image.data[i], min_sigma=2, max_sigma=20) for i in range(2)]
+
+    points_data, points_state, _ = determinant_of_hessian(image, min_sigma=2, max_sigma=20)
+
+    np.testing.assert_allclose(points_data[:, 0], [0] * len(expected[0]) + [1] * len(expected[1]))
+    np.testing.assert_allclose(points_data[:, 1:], np.concatenate(expected)[:, :2])
+    np.testing.assert_allclose(points_state['features']['sigma'], np.concatenate(expected)[:, 2])
+    np.testing.assert_allclose(points_state['scale'], image.scale)
+
+
+def test_determinant_of_hessian_with_cache_matches_uncached():
+    image = Image(np.zeros((64, 64)))
+    image.data[10:20, 30:40] = 1
+    image.data[30:50, 20:40] = 0.5
+    cache = ScaleSpaceCache()
+
+    expected_data, _, _ = determinant_of_hessian(image, threshold=0.001)
+    determinant_of_hessian(image, threshold=0.005, cache=cache)
+    points_data, _, _ = determinant_of_hessian(image, threshold=0.001, cache=cache)
+
+    assert len(cache) == 1
+    np.testing.assert_allclose(points_data, expected_data)
+
+
+def test_doh_scale_space_without_private_scikit_image_function(monkeypatch):
+    from .. import _scale_space
+
+    image = np.zeros((64, 64))
+    image[10:20, 30:40] = 1
+    expected = _scale_space.doh_scale_space(image, min_sigma=2, max_sigma=20)
+    monkeypatch.setattr(_scale_space, '_hessian_matrix_det', None)
+
+    actual = _scale_space.doh_scale_space(image, min_sigma=2, max_sigma=20)
+
+    np.testing.assert_array_equal(actual.cube, expected.cube)
+
+
+def test_determinant_of_hessian_with_3d_features():
+    image = Image(np.zeros((10, 10, 10)))
+
+    with pytest.raises(ValueError):
+        determinant_of_hessian(image, dimensionality=3)
+
+
+@pytest.mark.parametrize('suffix', ('.parquet', '.zarr'))
+def test_detect_with_output_path_loads_requested_slices(tmp_path, suffix):
+    pytest.importorskip('pyarrow' if suffix == '.parquet' else 'zarr')
+    image = Image(np.zeros((3, 10, 10)))
+    image.data[0, 3:6, 5:8] = 1
+    image.data[2, 2:5, 2:5] = 1
+    output_path = tmp_path / f'blobs{suffix}'
+    expected_data, expected_state, _ = difference_of_gaussian(image)
+
+    points_data, points_state, _ = difference_of_gaussian(image, output_path=output_path)
+    blobs = load_blobs(output_path, indices=[(2,), (1,)])
+
+    assert points_data.shape == (0, 3)
+    assert points_state['metadata']['blobs_path'] == str(output_path)
+    np.testing.assert_allclose(blobs.coords, expected_data[[1]])
+    np.testing.assert_allclose(blobs.sigmas, expected_state['features']['sigma'][[1]])
+    np.testing.assert_array_equal(blobs.slice_indices, [[2], [1]])
+    np.testing.assert_array_equal(blobs.slice_offsets, [0, 1, 1])
+    np.testing.assert_allclose(load_blobs(output_path).coords, expected_data)
+
+
+def test_detect_with_checkpoint_only_detects_unfinished_slices(tmp_path):
+    data = np.zeros((3, 10, 10))
+    data[0, 3:6, 5:8] = 1
+    data[1, 5:8, 3:6] = 1
+    data[2, 2:5, 2:5] = 1
+    detected = []
+
+    def method(image, **kwargs):
+        detected.append(image.copy())
+        return blob_log(image, **kwargs)
+
+    expected = detect_blobs(data, method=method, max_sigma=5)
+    detected.clear()
+
+    blobs = detect_blobs(data, method=method, max_sigma=5, checkpoint_dir=tmp_path)
+    assert len(detected) == 3
+    np.testing.assert_allclose(blobs.coords, expected.coords)
+
+    checkpoint_files = sorted(tmp_path.glob('*/*.npz'))
+    assert [f.name for f in checkpoint_files] == ['0.npz', '1.npz', '2.npz']
+    checkpoint_files[1].unlink()
+    detected.clear()
+    blobs = detect_blobs(data, method=method, max_sigma=5, checkpoint_dir=tmp_path)
+    assert len(detected) == 1
+    np.testing.assert_array_equal(detected[0], data[1])
+    np.testing.assert_allclose(blobs.coords, expected.coords)
+
+    data[2] = 0
+    detected.clear()
+    blobs = detect_blobs(data, method=method, max_sigma=5, checkpoint_dir=tmp_path)
+    assert len(detected) == 1
+    np.testing.assert_allclose(blobs.coords, expected.coords[:2])
+
+    detected.clear()
+    detect_blobs(data, method=method, max_sigma=4, checkpoint_dir=tmp_path)
+    assert len(detected) == 3
+
+
+@pytest.mark.parametrize('worker_type', ('thread', 'process'))
+def test_detect_with_profile(worker_type):
+    image = Image(np.zeros((2, 20, 20)))
+    image.data[0, 3:6, 5:8] = 1
+    image.data[1, 12:15, 13:16] = 1
+
+    _, points_state, _ = difference_of_gaussian(
+        image,
+        max_sigma=5,
+        tile_size=10,
+        num_workers=2,
+        worker_type=worker_type,
+        profile=True,
+    )
+
+    report = points_state['metadata']['profile']
+    stages = report['stages']
+    assert {'read', 'scale_space', 'peaks', 'prune', 'tile', 'merge', 'slices', 'assemble'} <= set(stages)
+    assert stages['tile']['count'] == 8
+    assert stages['merge']['count'] == 2
+    assert stages['read']['nbytes'] > 0
+    assert [s['index'] for s in report['slices']] == [(0,), (1,)]
+    assert [s['num_blobs'] for s in report['slices']] == [1, 1]
+    assert 'scale_space' in Profile.from_report(report).summary()
+
+
+@pytest.mark.parametrize('ndim', (2, 3))
+def test_overlap_fractions_match_scikit_image(ndim):
+    rng = np.random.default_rng(0)
+    blobs = np.hstack([rng.uniform(0, 20, (200, ndim)), rng.choice([1, 2, 3.5], (200, 1))])
+    other_blobs = blobs[rng.permutation(200)]
+
+    fractions = overlap_fractions(blobs, other_blobs)
+
+    expected = [_blob_overlap(b1, b2) for b1, b2 in zip(blobs, other_blobs)]
+    np.testing.assert_allclose(fractions, expected, atol=1e-12)
+
+
+def test_detect_with_checkpoint_follows_edits_of_zarr_mask(tmp_path):
+    zarr = pytest.importorskip('zarr')
+    data = np.zeros((2, 20, 20))
+    data[:, 3:6, 3:6] = 1
+    data[:, 13:16, 13:16] = 1
+    mask = zarr.zeros((20, 20), dtype=bool, chunks=(10, 10))
+    mask[:10, :10] = True
+
+    blobs = detect_blobs(data, max_sigma=3, mask=mask, checkpoint_dir=tmp_path)
+    np.testing.assert_allclose(blobs.coords[:, 1:], [[4, 4], [4, 4]])
+
+    mask[:] = False
+    mask[10:, 10:] = True
+    blobs = detect_blobs(data, max_sigma=3, mask=mask, checkpoint_dir=tmp_path)
+
+    np.testing.assert_allclose(blobs.coords[:, 1:], [[14, 14], [14, 14]])
+
+
+def test_prune_blobs_only_keeps_blobs_that_do_not_overlap():
+    rng = np.random.default_rng(0)
+    blobs = np.hstack([rng.uniform(0, 200, (5000, 2)), rng.choice([1, 1.6, 2.56, 4.1, 6.5], (5000, 1))])
+
+    kept = prune_blobs(blobs, 0.3)
+
+    pairs = np.array([(i, j) for i in range(len(kept)) for j in range(i + 1, len(kept))])
+    assert np.all(overlap_fractions(kept[pairs[:, 0]], kept[pairs[:, 1]]) <= 0.3)
+    # Every removed blob overlaps a larger blob that was kept.
+    removed = blobs[~np.isin(blobs[:, 0], kept[:, 0])]
+    for blob in removed:
+        larger = kept[kept[:, -1] >= blob[-1]]
+        assert np.any(overlap_fractions(np.broadcast_to(blob, larger.shape), larger) > 0.3)
+
+
+def test_prune_blobs_matches_scikit_image_without_chains():
+    # Pairs of blobs that overlap, which scikit-image prunes the same way
+    # whatever order it visits them in.
+    small = np.array([[10, 10, 2], [50, 50, 3], [90, 10, 2]], dtype=float)
+    large = small + [1, 0, 2]
+
+    blobs = np.concatenate([small, large])
+
+    np.testing.assert_array_equal(prune_blobs(blobs, 0.5), large)
+    np.testing.assert_array_equal(prune_blobs(blobs, 0.5), _prune_blobs(blobs.copy(), 0.5))
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_overlap(method):
+    image = Image(np.zeros((20, 20)))
+    image.data[5:10, 5:10] = 1
+    image.data[8:13, 8:13] = 1
+
+    num_blobs = [len(method(image, max_sigma=5, threshold=0.01, overlap=overlap)[0]) for overlap in (0, 1)]
+
+    assert num_blobs[0] < num_blobs[1]
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_prune_window_keeps_one_blob_per_stack(method):
+    # The same blob in 3 neighboring planes of 2 time points.
+    image = Image(np.zeros((2, 3, 10, 10)))
+    image.data[:, :, 3:6, 5:8] = 1
+
+    points_data, _, _ = method(image, dimensionality=2, prune_window=2)
+
+    np.testing.assert_allclose(points_data, [[0, 2, 4, 6], [1, 2, 4, 6]])
+    assert len(method(image, dimensionality=2)[0]) == 6
+
+
+def _make_multiscale_blobs(shape):
+    # A small blob and a large blob, with one downsampled level.
+    grid = np.indices(shape, dtype=float)
+    data = np.zeros(shape)
+    for center, sigma in (((20, 28), 2), ((100, 90), 10)):
+        distance2 = sum((g - c) ** 2 for g, c in zip(grid, center))
+        data += np.exp(-distance2 / (2 * sigma ** 2))
+    coarse = data.reshape(shape[0] // 2, 2, shape[1] // 2, 2).mean(axis=(1, 3))
+    return [data, coarse]
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_multiscale_full_resolution_matches_first_level(method):
+    levels = _make_multiscale_blobs((160, 160))
+    image = Image(levels, multiscale=True)
+
+    points_data, points_state, _ = method(image, max_sigma=16, threshold=0.05)
+
+    expected_data, expected_state, _ = method(Image(levels[0]), max_sigma=16, threshold=0.05)
+    np.testing.assert_allclose(points_data, expected_data)
+    np.testing.assert_allclose(points_state['features']['sigma'], expected_state['features']['sigma'])
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_multiscale_coarse_to_fine(method):
+    levels = _make_multiscale_blobs((160, 160))
+    image = Image(levels, multiscale=True)
+
+    points_data, points_state, _ = method(image, max_sigma=16, threshold=0.05, coarse_level=1)
+
+    expected_data, expected_state, _ = method(Image(levels[0]), max_sigma=16, threshold=0.05)
+    assert points_data.shape == expected_data.shape
+    order = np.argsort(points_data[:, 0])
+    expected_order = np.argsort(expected_data[:, 0])
+    # Large blobs are found on the coarse level, so they are only accurate
+    # to its pixel size.
+    np.testing.assert_allclose(points_data[order], expected_data[expected_order], atol=1)
+    np.testing.assert_allclose(
+        points_state['features']['sigma'][order],
+        expected_state['features']['sigma'][expected_order],
+        rtol=0.5,
+    )
+
+
+def test_detect_multiscale_with_downsampled_leading_dimension():
+    levels = [np.zeros((4, 16, 16)), np.zeros((2, 8, 8))]
+
+    with pytest.raises(ValueError):
+        detect_blobs(levels, coarse_level=1)
+
+
+def _make_two_blobs_image():
+    # Blobs in the top left and bottom right of 2 slices.
+    image = Image(np.zeros((2, 64, 64)))
+    image.data[:, 10:15, 10:15] = 1
+    image.data[:, 45:50, 45:50] = 1
+    return image
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_mask_array(method):
+    image = _make_two_blobs_image()
+    mask = np.zeros((2, 64, 64), dtype=bool)
+    mask[0, :32, :32] = True
+    mask[1, 32:, 32:] = True
+
+    points_data, _, _ = method(image, max_sigma=5, mask=mask)
+
+    np.testing.assert_allclose(points_data, [[0, 12, 12], [1, 47, 47]])
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_mask_layers_matches_array(method):
+    image = _make_two_blobs_image()
+    mask = np.zeros((64, 64), dtype=bool)
+    mask[5:20, 5:20] = True
+    labels = Labels(mask.astype(np.uint8) * 3)
+    shapes = Shapes([np.array([[5, 5], [19, 19]])], shape_type='rectangle')
+
+    expected_data, _, _ = method(image, max_sigma=5, mask=mask)
+    labels_data, _, _ = method(image, max_sigma=5, mask=labels)
+    shapes_data, _, _ = method(image, max_sigma=5, mask=shapes)
+
+    np.testing.assert_allclose(expected_data, [[0, 12, 12], [1, 12, 12]])
+    np.testing.assert_allclose(labels_data, expected_data)
+    np.testing.assert_allclose(shapes_data, expected_data)
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_mask_layers_in_world_coordinates(method):
+    image = _make_two_blobs_image()
+    image.scale = (1, 2, 2)
+    mask = np.zeros((32, 32), dtype=bool)
+    mask[2:10, 2:10] = True
+    labels = Labels(mask, scale=(4, 4))
+    # Around the top left blob at (24, 24) in world coordinates.
+    shapes = Shapes([np.array([[20, 20], [30, 30]])], shape_type='rectangle')
+
+    labels_data, _, _ = method(image, max_sigma=5, mask=labels)
+    shapes_data, _, _ = method(image, max_sigma=5, mask=shapes)
+
+    np.testing.assert_allclose(labels_data, [[0, 12, 12], [1, 12, 12]])
+    np.testing.assert_allclose(shapes_data, [[0, 12, 12], [1, 12, 12]])
+
+
+def test_detect_with_mask_only_filters_masked_regions():
+    image = _make_two_blobs_image()
+    mask = np.zeros((64, 64), dtype=bool)
+    mask[10:15, 10:15] = True
+    profile = Profile()
+
+    detect_blobs(image.data, max_sigma=5, mask=mask, profile=profile)
+
+    # Only the bounding box of the mask, padded by the halo and clipped to
+    # the image, is read from each slice.
+    halo = 4 * 5 + 1
+    assert profile.stages['read'].nbytes == 2 * (15 + halo) ** 2 * image.data.itemsize
+
+
+def test_detect_with_mask_of_wrong_shape():
+    image = _make_two_blobs_image()
+
+    with pytest.raises(ValueError):
+        laplacian_of_gaussian(image, mask=np.ones((32, 32), dtype=bool))
+
+
+def _make_anisotropic_blobs():
+    # Three blobs in a stack whose z spacing is 5 times its xy spacing.
+    data = np.zeros((20, 64, 64))
+    for center in ((5, 20, 20), (12, 44, 24), (8, 32, 48)):
+        data[center] = 1
+    data = ndi.gaussian_filter(data, (0.6, 3, 3))
+    return data / data.max()
+
+
+@pytest.mark.parametrize('method, blob_method', ((difference_of_gaussian, blob_dog), (laplacian_of_gaussian, blob_log)))
+def test_detect_with_anisotropic_scale_matches_scikit_image_sigmas_per_axis(method, blob_method):
+    data = _make_anisotropic_blobs()
+    image = Image(data, scale=(5, 1, 1))
+
+    points_data, points_state, _ = method(image, dimensionality=3, min_sigma=1, max_sigma=6, threshold=0.05, tile_size=32)
+
+    expected = blob_method(data, min_sigma=(0.2, 1, 1), max_sigma=(1.2, 6, 6), threshold=0.05)
+    order = np.lexsort(points_data.T[::-1])
+    expected = expected[np.lexsort(expected[:, :3].T[::-1])]
+    features = points_state['features']
+    np.testing.assert_allclose(points_data[order], expected[:, :3])
+    np.testing.assert_allclose(features['sigma'][order], expected[:, 5])
+    for axis in range(3):
+        np.testing.assert_allclose(features[f'sigma_{axis}'][order], expected[:, 3 + axis])
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_with_isotropic_scale_ignores_scale(method):
+    data = _make_anisotropic_blobs()
+
+    points_data, points_state, _ = method(Image(data, scale=(2, 2, 2)), dimensionality=3, max_sigma=6, threshold=0.05)
+
+    expected_data, expected_state, _ = method(Image(data), dimensionality=3, max_sigma=6, threshold=0.05)
+    np.testing.assert_allclose(points_data, expected_data)
+    assert list(points_state['features']) == ['sigma']
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_detect_without_scale_ignores_anisotropic_scale(method):
+    data = _make_anisotropic_blobs()
+
+    points_data, points_state, _ = method(Image(data, scale=(5, 1, 1)), dimensionality=3, max_sigma=6, threshold=0.05, use_scale=False)
+
+    expected_data, expected_state, _ = method(Image(data), dimensionality=3, max_sigma=6, threshold=0.05)
+    np.testing.assert_allclose(points_data, expected_data)
+    np.testing.assert_allclose(points_state['features']['sigma'], expected_state['features']['sigma'])
+    assert list(points_state['features']) == ['sigma']
+
+
+@pytest.mark.parametrize('method', METHODS + (determinant_of_hessian,))
+def test_detect_with_nearly_isotropic_scale_ignores_scale(method):
+    image = Image(np.zeros((30, 30)), scale=(0.1083, 0.1082))
+    image.data[10:14, 12:16] = 1
+
+    points_data, points_state, _ = method(image, max_sigma=5, threshold=0.05)
+
+    expected_data, _, _ = method(Image(image.data), max_sigma=5, threshold=0.05)
+    np.testing.assert_allclose(points_data, expected_data)
+    assert list(points_state['features']) == ['sigma']
+
+
+def test_detect_multiscale_with_anisotropic_spacing_matches_first_level():
+    data = _make_anisotropic_blobs()
+    coarse = data.reshape(20, 32, 2, 32, 2).mean(axis=(2, 4))
+
+    blobs = detect_blobs([data, coarse], dimensionality=3, max_sigma=6, threshold=0.05, spacing=(5, 1, 1), coarse_level=1)
+
+    expected = detect_blobs(data, dimensionality=3, max_sigma=6, threshold=0.05, spacing=(5, 1, 1))
+    order = np.lexsort(blobs.coords.T[::-1])
+    expected_order = np.lexsort(expected.coords.T[::-1])
+    np.testing.assert_allclose(blobs.coords[order], expected.coords[expected_order], atol=1)
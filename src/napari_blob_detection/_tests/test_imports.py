@@ -0,0 +1,47 @@
+import subprocess
+import sys
+
+import pytest
+
+import napari_blob_detection
+
+# Imported by the commands that need them, but never just by importing the package.
+HEAVY_MODULES = ('magicgui', 'napari', 'qtpy', 'scipy', 'skimage')
+
+
+def _imported_modules(code):
+    # Returns the top level modules that are imported by running some code
+    # in a fresh interpreter.
+    script = f'{code}\nimport sys\nprint(" ".join(sorted({{m.partition(".")[0] for m in sys.modules}})))'
+    output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+    return set(output.split())
+
+
+def test_import_package_does_not_import_heavy_modules():
+    modules = _imported_modules('import napari_blob_detection')
+
+    assert modules.isdisjoint(HEAVY_MODULES)
+
+
+@pytest.mark.parametrize('code', (
+    'import napari_blob_detection._cli',
+    'from napari_blob_detection import detect_blobs',
+    'from napari_blob_detection import sweep',
+    'from napari_blob_detection import detect_channel_blobs',
+))
+def test_headless_detection_does_not_import_napari_or_magicgui(code):
+    modules = _imported_modules(code)
+
+    assert 'skimage' in modules
+    assert modules.isdisjoint(('magicgui', 'napari', 'qtpy'))
+
+
+@pytest.mark.parametrize('name', napari_blob_detection.__all__)
+def test_lazy_names_are_defined(name):
+    assert getattr(napari_blob_detection, name).__name__ == name
+    assert name in dir(napari_blob_detection)
+
+
+def test_unknown_name_raises_attribute_error():
+    with pytest.raises(AttributeError):
+        napari_blob_detection.not_a_name
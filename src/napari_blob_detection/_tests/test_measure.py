@@ -0,0 +1,100 @@
+import numpy as np
+from napari.layers import Image, Points
+from skimage.measure import regionprops_table
+from .. import blob_intensities, laplacian_of_gaussian, measure_blobs, points_to_labels
+from .._measure import STATISTICS
+
+
+def test_blob_intensities_of_one_blob_on_background():
+    data = np.ones((20, 20))
+    data[9:12, 9:12] = 5
+    sigma = 2 / np.sqrt(2)
+
+    statistics = blob_intensities(data, [[10, 10]], [sigma], background_width=2)
+
+    # The window is the disk of radius 1 around the center.
+    np.testing.assert_allclose(statistics['intensity_mean'], [5])
+    np.testing.assert_allclose(statistics['intensity_max'], [5])
+    np.testing.assert_allclose(statistics['intensity_integrated'], [25])
+    np.testing.assert_allclose(statistics['background'], [1])
+    np.testing.assert_allclose(statistics['intensity_mean_corrected'], [4])
+    np.testing.assert_allclose(statistics['intensity_integrated_corrected'], [20])
+
+
+def test_blob_intensities_with_leading_dimensions_and_blobs_outside():
+    data = np.zeros((2, 10, 10))
+    data[1] = 3
+
+    statistics = blob_intensities(data, [[1, 5, 5], [0, 0, 0], [2, 5, 5], [0, 20, 20]], [1, 1, 1, 1])
+
+    np.testing.assert_allclose(statistics['intensity_mean'][:2], [3, 0])
+    # Blobs in slices outside the data, or without any pixels, are NaN.
+    for name in STATISTICS:
+        assert np.all(np.isnan(statistics[name][2:]))
+
+
+def test_blob_intensities_of_no_blobs():
+    statistics = blob_intensities(np.zeros((10, 10)), np.empty((0, 2)), np.empty(0))
+
+    assert set(statistics) == set(STATISTICS)
+    assert all(values.shape == (0,) for values in statistics.values())
+
+
+def test_measure_blobs_adds_features():
+    image = Image(np.zeros((30, 30)))
+    image.data[5:8, 5:8] = 1
+    image.data[20:25, 20:25] = 2
+    points_data, points_state, _ = laplacian_of_gaussian(image, max_sigma=5)
+    points = Points(points_data, **points_state)
+
+    measure_blobs(points, image)
+
+    assert list(points.features.columns) == ['sigma', *STATISTICS]
+    np.testing.assert_allclose(points.features['intensity_max'], [2, 1])
+
+
+def test_measure_blobs_matches_labels_regionprops():
+    rng = np.random.default_rng(0)
+    image = Image(rng.random((60, 60)), scale=(2, 2))
+    points = Points([[10, 15], [30, 40], [50, 20]], size=[6, 10, 8], scale=(2, 2))
+
+    measure_blobs(points, image)
+
+    labels = points_to_labels(points, image)[0]
+    expected = regionprops_table(labels, image.data, properties=('intensity_mean', 'intensity_max'))
+    np.testing.assert_allclose(points.features['intensity_mean'], expected['intensity_mean'])
+    np.testing.assert_allclose(points.features['intensity_max'], expected['intensity_max'])
+
+
+def test_blob_intensities_with_sigmas_per_axis():
+    data = np.zeros((9, 20, 20))
+    data[4] = 1
+    data[3, 10, 10] = 100
+
+    statistics = blob_intensities(data, [[4, 10, 10]], [[0.2, 2, 2]], dimensionality=3, background_width=0)
+
+    # The window is the 3x3 square within a radius of sqrt(3) in one plane,
+    # so the bright pixel above it is not in it.
+    np.testing.assert_allclose(statistics['intensity_max'], [1])
+    np.testing.assert_allclose(statistics['intensity_integrated'], [9])
+
+
+def test_blob_intensities_reads_each_slice_once():
+    class _CountingArray:
+        def __init__(self, data):
+            self._data = data
+            self.shape = data.shape
+            self.ndim = data.ndim
+            self.keys = []
+
+        def __getitem__(self, key):
+            self.keys.append(key)
+            return self._data[key]
+
+    data = _CountingArray(np.ones((3, 20, 20)))
+    coords = [[2, 5, 5], [0, 5, 5], [2, 10, 10], [0, 12, 12], [2, 15, 15]]
+
+    statistics = blob_intensities(data, coords, [1, 4, 2, 1, 4])
+
+    assert sorted(data.keys) == [(0,), (2,)]
+    np.testing.assert_allclose(statistics['intensity_mean'], 1)
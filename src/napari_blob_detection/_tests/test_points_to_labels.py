@@ -1,3 +1,4 @@
+import pytest
 import numpy as np
 from napari.layers import Image, Points
 from .. import points_to_labels 
@@ -56,3 +57,81 @@ def test_points_to_labels_2d_with_two_one_pixel_points():
     expected_labels_data[4, 6] = 1
     expected_labels_data[7, 5] = 2
     np.testing.assert_array_equal(labels_data, expected_labels_data)
+
+
+@pytest.mark.parametrize('ndim', (2, 3))
+@pytest.mark.parametrize('scale', (1, 2))
+def test_points_to_labels_sparse_matches_dense(ndim, scale):
+    rng = np.random.default_rng(0)
+    reference_image = Image(np.zeros((24,) * ndim), scale=(scale,) * ndim)
+    points_data = rng.uniform(-2, 26, size=(30, ndim)) * scale
+    points = Points(points_data, size=rng.uniform(1, 8, size=30) * scale)
+
+    dense_data, _, _ = points_to_labels(points, reference_image)
+    sparse_data, _, _ = points_to_labels(points, reference_image, sparse=True)
+
+    assert dense_data.max() > 1
+    np.testing.assert_array_equal(sparse_data, dense_data)
+
+
+@pytest.mark.parametrize('sparse', (False, True))
+def test_points_to_labels_smallest_dtype(sparse):
+    reference_image = Image(np.zeros((40, 40)))
+    points_data = np.stack(np.meshgrid(np.arange(0, 40, 2), np.arange(0, 40, 2)), axis=-1).reshape(-1, 2)
+    points = Points(points_data, size=[1])
+
+    labels_data, _, _ = points_to_labels(points, reference_image, sparse=sparse)
+
+    assert labels_data.dtype == np.uint16
+    assert labels_data.max() == 20 * 20
+
+
+@pytest.mark.parametrize('suffix', ('.npy', '.zarr'))
+def test_points_to_labels_to_file(tmp_path, suffix):
+    if suffix == '.zarr':
+        pytest.importorskip('zarr')
+    reference_image = Image(np.zeros((10, 10)))
+    points = Points([[4, 6], [7, 5]], size=[1])
+    output_path = tmp_path / f'labels{suffix}'
+
+    labels_data, _, _ = points_to_labels(points, reference_image, output_path=output_path)
+
+    expected_labels_data = np.zeros((10, 10))
+    expected_labels_data[4, 6] = 1
+    expected_labels_data[7, 5] = 2
+    assert labels_data.dtype == np.uint8
+    np.testing.assert_array_equal(labels_data[:], expected_labels_data)
+    assert output_path.exists()
+
+
+@pytest.mark.parametrize('sparse', (False, True))
+def test_points_to_labels_with_profile(sparse):
+    reference_image = Image(np.zeros((10, 10)))
+    points = Points([[4, 6]], size=[3])
+
+    _, labels_state, _ = points_to_labels(points, reference_image, sparse=sparse, profile=True)
+
+    stages = labels_state['metadata']['profile']['stages']
+    expected_stages = ['label_balls', 'write_labels'] if sparse else ['to_mask', 'label']
+    assert list(stages) == expected_stages
+    assert all(stats['count'] == 1 for stats in stages.values())
+
+
+@pytest.mark.parametrize('sparse', (False, True))
+def test_points_to_labels_with_sigmas_per_axis(sparse):
+    reference_image = Image(np.zeros((2, 10, 20, 20)), scale=(1, 4, 1, 1))
+    points = Points(
+        [[0, 5, 10, 10]],
+        size=[2 * np.sqrt(3)],
+        features={'sigma': [2], 'sigma_1': [0.5], 'sigma_2': [2], 'sigma_3': [2]},
+        scale=(1, 4, 1, 1),
+    )
+
+    labels_data, _, _ = points_to_labels(points, reference_image, sparse=sparse)
+
+    # The radii are sqrt(3) / 2 times the sigmas: within the plane, along
+    # rows and columns, and not along the leading dimension.
+    expected_labels_data = np.zeros((2, 10, 20, 20), dtype=np.uint8)
+    grid = np.indices((20, 20))
+    expected_labels_data[0, 5] = ((grid[0] - 10) ** 2 + (grid[1] - 10) ** 2) <= 3
+    np.testing.assert_array_equal(labels_data, expected_labels_data)
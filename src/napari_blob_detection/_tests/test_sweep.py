@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from napari.layers import Image
+from .. import detect_blobs, sweep, sweep_points
+
+
+def _blobs_image():
+    data = np.zeros((2, 40, 40))
+    data[0, 5:8, 5:8] = 1
+    data[0, 20:30, 20:30] = 0.5
+    data[1, 10:14, 25:29] = 2
+    return data
+
+
+def test_sweep_matches_detecting_each_combination():
+    data = _blobs_image()
+    thresholds = [0.05, 0.2, 0.5]
+    sigma_ranges = [(1, 8), (1, 3), (3, 8)]
+
+    result = sweep(data, thresholds=thresholds, sigma_ranges=sigma_ranges, min_sigma=1, max_sigma=8, num_sigma=8)
+
+    assert result.counts.shape == (3, 3)
+    for i, (min_sigma, max_sigma) in enumerate(sigma_ranges):
+        for j, threshold in enumerate(thresholds):
+            expected = detect_blobs(
+                data,
+                min_sigma=min_sigma,
+                max_sigma=max_sigma,
+                num_sigma=max_sigma - min_sigma + 1,
+                threshold=threshold,
+            )
+            blobs = result.blobs[i][j]
+            np.testing.assert_array_equal(blobs.coords, expected.coords)
+            np.testing.assert_array_equal(blobs.sigmas, expected.sigmas)
+            np.testing.assert_array_equal(blobs.slice_offsets, expected.slice_offsets)
+            assert result.counts[i, j] == expected.coords.shape[0]
+
+
+def test_sweep_rejects_sigma_range_outside_scale_space():
+    with pytest.raises(ValueError, match='sigma range'):
+        sweep(_blobs_image(), thresholds=[0.1], sigma_ranges=[(1, 20)], max_sigma=10)
+
+
+def test_sweep_points_makes_layer_per_combination():
+    image = Image(_blobs_image(), name='cells')
+
+    layers = sweep_points(image, thresholds=[0.1, 1], sigma_ranges=[(1, 8)], min_sigma=1, max_sigma=8, num_sigma=8)
+
+    assert [state['name'] for _, state, _ in layers] == [
+        'cells-features-blob_log-sigma-1-8-threshold-0.1',
+        'cells-features-blob_log-sigma-1-8-threshold-1',
+    ]
+    assert [state['metadata']['count'] for _, state, _ in layers] == [3, 1]
+    assert layers[1][2] == 'Points'
+    np.testing.assert_allclose(layers[1][0], [[1, 11.5, 26.5]], atol=0.5)
@@ -1,6 +1,11 @@
+import numpy as np
+import pytest
+from magicgui import magicgui
+from napari.layers import Image
+from napari.components import ViewerModel
 from magicgui.widgets import ComboBox, Container, FunctionGui
 
-from .. import detect_blobs_widget
+from .. import detect_blobs_in_channels_widget, detect_blobs_widget
 
 
 def test_detect_blobs_widget():
@@ -15,3 +20,166 @@ def test_change_method():
     widget = detect_blobs_widget()
     widget.method.value = 'Laplacian of Gaussian'
     assert isinstance(widget.laplacian_of_gaussian, FunctionGui)
+
+
+def test_detect_blobs_widget_hides_bound_parameters(qtbot):
+    widget = detect_blobs_widget()
+    qtbot.addWidget(widget.native)
+    widget.show()
+
+    subwidget = widget.difference_of_gaussian
+    assert subwidget.threshold.visible
+    for name in ('cache', 'indices', 'output_path'):
+        assert not subwidget[name].visible
+
+
+def test_detect_current_slice_first(qtbot, monkeypatch):
+    from .. import _widget
+
+    # Only yield the current slice on its own.
+    monkeypatch.setattr(_widget, '_YIELD_INTERVAL', 1000)
+    viewer = ViewerModel()
+    image_data = np.zeros((3, 10, 10))
+    image_data[0, 3:6, 5:8] = 1
+    image_data[1, 5:8, 3:6] = 1
+    image_data[2, 2:5, 2:5] = 1
+    image = viewer.add_image(image_data)
+    viewer.dims.set_current_step(0, 1)
+    widget = detect_blobs_widget(viewer)
+    widget.current_slice_first.value = True
+    added_data = []
+    viewer.layers.events.inserted.connect(lambda event: added_data.append(event.value.data.copy()))
+
+    widget.difference_of_gaussian(image=image)
+
+    # The current slice is detected in the background too.
+    assert len(viewer.layers) == 1
+    qtbot.waitUntil(lambda: len(viewer.layers) == 2)
+    np.testing.assert_allclose(added_data[0], [[1, 6, 4]])
+    points = viewer.layers[-1]
+    qtbot.waitUntil(lambda: len(points.data) == 3)
+    np.testing.assert_allclose(points.data, [[1, 6, 4], [0, 4, 6], [2, 3, 3]])
+    np.testing.assert_allclose(points.size, np.sqrt(2) * points.features['sigma'])
+    np.testing.assert_array_equal(points.metadata['slice_indices'], [[1], [0], [2]])
+    np.testing.assert_array_equal(points.metadata['slice_offsets'], [0, 1, 2, 3])
+
+
+def test_detect_in_background(qtbot):
+    viewer = ViewerModel()
+    image_data = np.zeros((4, 10, 10))
+    image_data[:, 4:7, 4:7] = 1
+    image = viewer.add_image(image_data)
+    widget = detect_blobs_widget(viewer)
+    qtbot.addWidget(widget.native)
+    widget.show()
+
+    widget.difference_of_gaussian(image=image)
+
+    points = viewer.layers[-1]
+    assert widget.progress.visible
+    assert widget.cancel.visible
+    qtbot.waitUntil(lambda: not widget.progress.visible)
+    assert widget.progress.value == 4
+    assert not widget.cancel.visible
+    np.testing.assert_allclose(points.data, [[i, 5, 5] for i in range(4)])
+    np.testing.assert_array_equal(points.metadata['slice_offsets'], [0, 1, 2, 3, 4])
+
+
+def test_cancel_keeps_partial_results(qtbot):
+    viewer = ViewerModel()
+    image_data = np.zeros((1000, 32, 32))
+    image_data[:, 14:17, 14:17] = 1
+    image = viewer.add_image(image_data)
+    widget = detect_blobs_widget(viewer)
+    qtbot.addWidget(widget.native)
+    widget.show()
+
+    widget.difference_of_gaussian(image=image, max_sigma=8)
+    qtbot.waitUntil(lambda: widget.progress.value > 0)
+    widget.cancel.changed.emit(True)
+
+    points = viewer.layers[-1]
+    qtbot.waitUntil(lambda: not widget.progress.visible)
+    assert not widget.cancel.visible
+    num_slices = len(points.metadata['slice_indices'])
+    assert 0 < num_slices < 1000
+    assert widget.progress.value == num_slices
+    np.testing.assert_array_equal(points.metadata['slice_offsets'], np.arange(num_slices + 1))
+    np.testing.assert_allclose(points.data[:, 1:], [[15, 15]] * num_slices)
+
+
+def test_change_method_to_determinant_of_hessian():
+    widget = detect_blobs_widget()
+    widget.method.value = 'Determinant of Hessian'
+    assert isinstance(widget.determinant_of_hessian, FunctionGui)
+
+
+def test_detect_in_background_with_profile(qtbot):
+    viewer = ViewerModel()
+    image_data = np.zeros((3, 10, 10))
+    image_data[:, 4:7, 4:7] = 1
+    image = viewer.add_image(image_data)
+    widget = detect_blobs_widget(viewer)
+    qtbot.addWidget(widget.native)
+    widget.show()
+    widget.current_slice_first.value = True
+
+    widget.difference_of_gaussian(image=image, profile=True)
+
+    qtbot.waitUntil(lambda: not widget.progress.visible)
+    points = viewer.layers[-1]
+    assert [s['index'] for s in points.metadata['profile']['slices']] == [(1,), (0,), (2,)]
+    assert widget.profile_report.visible
+    assert 'scale_space' in widget.profile_report.value
+
+
+def test_watch_detects_only_new_frames(qtbot, monkeypatch):
+    from .. import _widget
+
+    detected_indices = []
+    iter_image_blobs = _widget._iter_image_blobs
+
+    def _record_indices(**kwargs):
+        detected_indices.append(list(kwargs['indices']))
+        return iter_image_blobs(**kwargs)
+
+    monkeypatch.setattr(_widget, '_iter_image_blobs', _record_indices)
+    viewer = ViewerModel()
+    frame = np.zeros((10, 10))
+    frame[4:7, 4:7] = 1
+    image = viewer.add_image(np.stack([frame] * 2))
+    widget = detect_blobs_widget(viewer)
+    qtbot.addWidget(widget.native)
+    widget.watch.value = True
+
+    widget.difference_of_gaussian(image=image)
+    points = viewer.layers[-1]
+    qtbot.waitUntil(lambda: not widget.progress.visible)
+    image.data = np.stack([frame] * 4)
+    qtbot.waitUntil(lambda: len(points.data) == 4)
+
+    assert detected_indices == [[(0,), (1,)], [(2,), (3,)]]
+    np.testing.assert_allclose(points.data[:, 0], [0, 1, 2, 3])
+    np.testing.assert_array_equal(points.metadata['slice_indices'], [[0], [1], [2], [3]])
+
+    # Unchecking the box stops watching.
+    widget.watch.value = False
+    image.data = np.stack([frame] * 5)
+    qtbot.wait(200)
+    assert len(detected_indices) == 2
+    assert len(points.data) == 4
+
+
+def test_detect_blobs_in_channels_widget_with_thresholds_per_layer():
+    widget = magicgui(detect_blobs_in_channels_widget)
+    data = np.zeros((30, 30))
+    data[5:8, 5:8] = 1
+    data[20:23, 20:23] = 0.3
+    images = [Image(data, name='dapi'), Image(data, name='gfp')]
+
+    points_data, state, _ = widget(images=images, thresholds=[0.5, 0.1], max_sigma=5)
+
+    assert list(state['features']['channel']) == ['dapi', 'gfp', 'gfp']
+    np.testing.assert_allclose(points_data, [[6, 6], [6, 6], [21, 21]])
+    with pytest.raises(ValueError, match='3 thresholds, but 2 image layers'):
+        widget(images=images, thresholds=[0.5, 0.1, 0.2], max_sigma=5)
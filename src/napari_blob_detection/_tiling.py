@@ -0,0 +1,235 @@
+import itertools
+import math
+from typing import Callable, Hashable, Iterator, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from ._cache import ScaleSpaceCache, detect_with_cache
+from ._profile import Profile, measure
+from ._prune import prune_blobs
+from ._scale_space import SCALE_SPACES
+
+# The Gaussian filters used by scikit-image are truncated at this many
+# standard deviations, so a filtered pixel only depends on input pixels
+# that are at most this many sigmas away.
+_GAUSSIAN_TRUNCATE = 4
+
+# The boundaries of the tiles along each feature dimension, including the
+# start and end of the dimension.
+TileGrid = Tuple[Tuple[int, ...], ...]
+
+
+class Tile(NamedTuple):
+    """ A region of the feature dimensions of one leading dimension slice.
+
+    The core of each tile owns the blobs whose centers lie inside it and
+    cores do not overlap. The outer region extends the core by a halo so that
+    filtering near the core's edges sees the same data as the whole image.
+    """
+    index: Tuple[int, ...]
+    outer: Tuple[slice, ...]
+    core_start: Tuple[int, ...]
+    core_stop: Tuple[int, ...]
+
+
+def halo_size(max_sigma: float) -> int:
+    """ Returns the number of pixels that tiles should overlap by.
+
+    The sigma should be the largest that the image is filtered with, like
+    the one returned by `max_filter_sigma`.
+    """
+    return int(math.ceil(_GAUSSIAN_TRUNCATE * max_sigma)) + 1
+
+
+def tile_grid(
+    shape: Sequence[int],
+    *,
+    tile_size: int = 0,
+    chunks: Optional[Sequence[Sequence[int]]] = None,
+) -> TileGrid:
+    """ Returns the boundaries of the tiles along each feature dimension.
+
+    If the tile size is positive, tiles have that size. Otherwise if chunk
+    sizes are given (in the style of dask's chunks), tiles follow those chunks.
+    Otherwise there is exactly one tile covering the whole slice.
+    """
+    if tile_size > 0:
+        return tuple(tuple(range(0, n, tile_size)) + (n,) for n in shape)
+    if chunks is not None:
+        return tuple((0,) + tuple(itertools.accumulate(c)) for c in chunks)
+    return tuple((0, n) for n in shape)
+
+
+def make_tiles(
+    index: Tuple[int, ...],
+    grid: TileGrid,
+    *,
+    halo: Union[int, Sequence[int]] = 0,
+    regions: Optional[np.ndarray] = None,
+) -> Iterator[Tile]:
+    """ Generates the tiles that cover a slice using the given tile grid.
+
+    The halo can be different along each dimension, e.g. for anisotropic
+    sigmas.
+
+    If regions are given, as the start and stop corners of boxes in the
+    feature dimensions with the shape (n, 2, ndim), the tiles only cover
+    those regions: their cores are the parts of the grid's cells that are in
+    each region. Regions should not overlap, like those from `merge_regions`.
+    """
+    cores_per_dim = [tuple(zip(bounds[:-1], bounds[1:])) for bounds in grid]
+    halos = np.broadcast_to(halo, len(grid))
+    for cores in itertools.product(*cores_per_dim):
+        core_start = tuple(start for start, _ in cores)
+        core_stop = tuple(stop for _, stop in cores)
+        if regions is None:
+            boxes = [(core_start, core_stop)]
+        else:
+            starts = np.maximum(regions[:, 0], core_start)
+            stops = np.minimum(regions[:, 1], core_stop)
+            nonempty = np.all(stops > starts, axis=1)
+            boxes = [
+                (tuple(map(int, start)), tuple(map(int, stop)))
+                for start, stop in zip(starts[nonempty], stops[nonempty])
+            ]
+        for start, stop in boxes:
+            outer = tuple(
+                slice(max(0, a - int(h)), min(bounds[-1], b + int(h)))
+                for a, b, h, bounds in zip(start, stop, halos, grid)
+            )
+            yield Tile(index=index, outer=outer, core_start=start, core_stop=stop)
+
+
+def merge_regions(regions: np.ndarray) -> np.ndarray:
+    """ Replaces overlapping regions with their bounding boxes until none overlap.
+
+    Regions are boxes given by their start and stop corners, with the shape
+    (n, 2, ndim), and empty regions are dropped.
+    """
+    regions = regions[np.all(regions[:, 1] > regions[:, 0], axis=1)]
+    while regions.shape[0] > 1:
+        # Boxes overlap when their centers are closer than the sum of their
+        # half extents along every dimension, so only pairs of centers that
+        # are closer than twice the largest half extent need to be checked.
+        centers = regions.mean(axis=1)
+        extents = (regions[:, 1] - regions[:, 0]) / 2
+        pairs = cKDTree(centers).query_pairs(2 * extents.max(), p=np.inf, output_type='ndarray')
+        i, j = pairs[:, 0], pairs[:, 1]
+        overlapping = np.all(np.abs(centers[i] - centers[j]) < extents[i] + extents[j], axis=1)
+        if not np.any(overlapping):
+            break
+        n = regions.shape[0]
+        graph = coo_matrix((np.ones(np.count_nonzero(overlapping)), (i[overlapping], j[overlapping])), shape=(n, n))
+        _, labels = connected_components(graph, directed=False)
+        starts = np.full((labels.max() + 1, regions.shape[2]), np.inf)
+        stops = np.full((labels.max() + 1, regions.shape[2]), -np.inf)
+        np.minimum.at(starts, labels, regions[:, 0])
+        np.maximum.at(stops, labels, regions[:, 1])
+        regions = np.stack([starts, stops], axis=1).astype(regions.dtype)
+    return regions
+
+
+def detect_in_tile(
+    task: Tuple[Tile, np.ndarray],
+    *,
+    method: Callable[..., np.ndarray],
+    cache: Optional[ScaleSpaceCache] = None,
+    cache_key: Hashable = None,
+    profile: Optional[Profile] = None,
+    **kwargs,
+) -> Tuple[Tuple[int, ...], np.ndarray]:
+    """ Detects blobs in one tile's data and returns those in the tile's core.
+
+    The returned coordinates are relative to the slice that contains the tile,
+    and are paired with that slice's leading dimension index.
+    If a cache is given, the cache key should identify the whole image data.
+    If a profile is given, the stages of detection are recorded in it.
+    """
+    tile, data = task
+    with measure(profile, 'read') as measurement:
+        image = np.asarray(data)
+        measurement.nbytes = image.nbytes
+    if method not in SCALE_SPACES:
+        with measure(profile, 'detect'):
+            blobs = method(image, **kwargs)
+    else:
+        # Methods with a known scale space are always detected in stages, so
+        # that they are pruned by this package rather than by scikit-image,
+        # and so that the stages can be cached and profiled.
+        blobs = detect_with_cache(
+            image,
+            method=method,
+            cache=cache,
+            key=(cache_key, tile.index, tuple((s.start, s.stop) for s in tile.outer)),
+            profile=profile,
+            **kwargs,
+        )
+    dimensionality = len(tile.outer)
+    offset = np.array([s.start for s in tile.outer])
+    blobs[:, :dimensionality] += offset
+    coords = blobs[:, :dimensionality]
+    in_core = np.all(
+        (coords >= tile.core_start) & (coords < tile.core_stop),
+        axis=1,
+    )
+    return tile.index, blobs[in_core]
+
+
+def profile_tile(
+    task: Tuple[Tile, np.ndarray],
+    *,
+    detect: Callable[..., Tuple[Tuple[int, ...], np.ndarray]],
+) -> Tuple[Tuple[int, ...], np.ndarray, Profile]:
+    """ Detects blobs in a tile like `detect_in_tile` and also returns a profile of it.
+
+    Each task has its own profile, so that this works in other processes.
+    The whole task is recorded as the 'tile' stage.
+    """
+    profile = Profile()
+    with measure(profile, 'tile'):
+        index, blobs = detect(task, profile=profile)
+    return index, blobs, profile
+
+
+def merge_tiles(
+    tile_blobs: Sequence[np.ndarray],
+    *,
+    grid: TileGrid,
+    overlap: float = 0.5,
+    sigma_dim: int = 1,
+) -> np.ndarray:
+    """ Merges the blobs from the tiles of one slice.
+
+    Blobs detected in different tiles near a seam may overlap, so the blobs
+    near seams are pruned again using the same overlap criteria that
+    is used within each tile. The blobs have `sigma_dim` sigma columns.
+    """
+    dimensionality = len(grid)
+    if len(tile_blobs) == 0:
+        return np.empty((0, dimensionality + sigma_dim))
+    blobs = np.concatenate(tile_blobs, axis=0)
+    if len(tile_blobs) == 1 or blobs.shape[0] < 2:
+        return blobs
+    # Two blobs can only overlap when they are closer than this, which is
+    # also the largest distance used by pruning.
+    distance = 2 * math.sqrt(dimensionality) * blobs[:, dimensionality:].max()
+    near_seam = np.zeros(blobs.shape[0], dtype=bool)
+    for d, bounds in enumerate(grid):
+        seams = np.asarray(bounds[1:-1])
+        if seams.size == 0:
+            continue
+        coords = blobs[:, d]
+        after = np.clip(np.searchsorted(seams, coords), 0, seams.size - 1)
+        before = np.clip(after - 1, 0, seams.size - 1)
+        distance_to_seam = np.minimum(
+            np.abs(coords - seams[before]),
+            np.abs(coords - seams[after]),
+        )
+        near_seam |= distance_to_seam < distance
+    if np.count_nonzero(near_seam) < 2:
+        return blobs
+    pruned = prune_blobs(blobs[near_seam], overlap, sigma_dim=sigma_dim)
+    return np.concatenate([blobs[~near_seam], pruned], axis=0)
@@ -1,26 +1,167 @@
+import inspect
+import time
+from functools import wraps
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from typing_extensions import Annotated
 from magicgui import magicgui
-from magicgui.widgets import ComboBox, Container
-from ._detect import difference_of_gaussian, laplacian_of_gaussian
+from magicgui.widgets import CheckBox, ComboBox, Container, FunctionGui, ProgressBar, PushButton, TextEdit
+from napari.layers import Image, Points
+from napari.types import LayerDataTuple
+from napari.viewer import Viewer
+from ._blobs import assemble_blobs
+from ._cache import ScaleSpaceCache
+from ._profile import Profile
+from ._detect import (
+    _BLOB_METHODS,
+    Dimensionality,
+    Mask,
+    MaxSigma,
+    MinSigma,
+    NumWorkers,
+    Overlap,
+    _iter_image_blobs,
+    _points_layer_data,
+    detect_blobs_in_channels,
+    determinant_of_hessian,
+    difference_of_gaussian,
+    laplacian_of_gaussian,
+)
+
+if TYPE_CHECKING:
+    from napari.qt.threading import GeneratorWorker
 
 
 _METHODS = {
     'Difference of Gaussian': difference_of_gaussian,
     'Laplacian of Gaussian': laplacian_of_gaussian,
+    'Determinant of Hessian': determinant_of_hessian,
 }
 
+# Shared by all detection widgets so that re-running detection with only a
+# different threshold does not need to filter the image again.
+_SCALE_SPACE_CACHE = ScaleSpaceCache()
+
+
+def _image_layers(widget: Any) -> List[Image]:
+    # The image layers of the viewer that a widget is docked in.
+    from napari.utils._magicgui import find_viewer_ancestor
+
+    viewer = find_viewer_ancestor(widget.native)
+    return [] if viewer is None else [layer for layer in viewer.layers if isinstance(layer, Image)]
+
+
+ChannelImages = Annotated[List[Image], {'widget_type': 'Select', 'choices': _image_layers}]
+MethodName = Annotated[str, {'choices': tuple(_METHODS)}]
+ChannelThresholds = Annotated[List[float], {'options': {'min': 0, 'max': 1000, 'step': 0.01}}]
+
 
-def detect_blobs_widget() -> Container:
+def detect_blobs_in_channels_widget(
+    images: ChannelImages,
+    method: MethodName = 'Laplacian of Gaussian',
+    dimensionality: Dimensionality = 2,
+    min_sigma: MinSigma = 1,
+    max_sigma: MaxSigma = 50,
+    thresholds: ChannelThresholds = (0.5,),
+    overlap: Overlap = 0.5,
+    num_workers: NumWorkers = 1,
+    use_scale: bool = True,
+    mask: Mask = None,
+) -> LayerDataTuple:
+    """ Detects blobs in several image layers, like the channels of an acquisition.
+
+    Each leading dimension slice of every layer is read once and the layers
+    are detected concurrently, into one points layer whose 'channel' feature
+    is the name of the layer of each blob.
+
+    Parameters
+    ----------
+    images : List[Image]
+        The image layers of the channels, which should have the same shape
+        and scale.
+    method : str
+        The name of the detection method, like in the detection widget.
+    dimensionality : Literal[2, 3]
+        The dimensionality of the blobs to find.
+    min_sigma : float
+        The smallest blob size to detect.
+    max_sigma : float
+        The largest blob size to detect.
+    thresholds : List[float]
+        Either one threshold for all layers, or one per layer in the order
+        that they are selected in.
+    overlap : float
+        A value between 0 and 1. If the fraction of the area (or volume) of a
+        blob that overlaps a larger blob is greater than this, the smaller
+        blob is removed.
+    num_workers : int
+        The number of workers used to detect the layers and slices
+        concurrently.
+    use_scale : bool
+        If True, the sigmas follow the scale of the first layer.
+    mask : Labels or Shapes, optional
+        If given, only detect blobs whose centers are inside this mask.
+
+    Returns
+    -------
+    LayerDataTuple
+        A 3-tuple containing the feature points data, other state, and 'Points'.
+    """
+    thresholds = list(thresholds)
+    if len(thresholds) not in (1, len(images)):
+        raise ValueError(f'There are {len(thresholds)} thresholds, but {len(images)} image layers.')
+    return detect_blobs_in_channels(
+        images,
+        parameters=[{'threshold': float(threshold)} for threshold in np.broadcast_to(thresholds, len(images))],
+        method=_BLOB_METHODS[_METHODS[method]],
+        dimensionality=dimensionality,
+        min_sigma=min_sigma,
+        max_sigma=max_sigma,
+        overlap=overlap,
+        num_workers=num_workers,
+        use_scale=use_scale,
+        mask=mask,
+    )
+
+
+def detect_blobs_widget(viewer: Optional[Viewer] = None) -> Container:
     # Make a widget function that will select from the methods.
     methods = tuple(_METHODS.keys())
     method_combo = ComboBox(choices=methods, name='method')
-    container = Container(widgets=[method_combo], labels=False)
+    current_slice_first = CheckBox(
+        name='current_slice_first',
+        text='Detect current slice first',
+        value=False,
+        visible=viewer is not None,
+    )
+    watch = CheckBox(
+        name='watch',
+        text='Watch for new frames',
+        value=False,
+        visible=viewer is not None,
+    )
+    # Only shown while detection is running in the background.
+    progress = ProgressBar(name='progress', visible=False)
+    cancel = PushButton(name='cancel', text='Cancel', visible=False)
+    # Only shown after profiled detection.
+    profile_report = TextEdit(name='profile_report', visible=False)
+    container = Container(
+        widgets=[method_combo, current_slice_first, watch, progress, cancel, profile_report],
+        labels=False,
+    )
 
     # When the method changes, populate the container with the correct widget.
     @method_combo.changed.connect
     def _add_subwidget(method_name: str):
-        if len(container) > 1:
+        if isinstance(container[-1], FunctionGui):
             container.pop(-1).native.close()
-        subwidget = magicgui(_METHODS[method_name])
+        subwidget = magicgui(
+            _make_detector(_METHODS[method_name], viewer, current_slice_first, watch, progress, cancel, profile_report),
+            cache={'bind': _SCALE_SPACE_CACHE},
+            indices={'bind': None, 'widget_type': 'EmptyWidget'},
+            output_path={'bind': None, 'visible': False},
+        )
         subwidget.margins = (0, 0, 0, 0)
         container.append(subwidget)
 
@@ -29,3 +170,363 @@ def detect_blobs_widget() -> Container:
     _add_subwidget(method_combo.value)
 
     return container
+
+
+def _make_detector(
+    function: Callable[..., LayerDataTuple],
+    viewer: Optional[Viewer],
+    current_slice_first: CheckBox,
+    watch: CheckBox,
+    progress: ProgressBar,
+    cancel: PushButton,
+    profile_report: TextEdit,
+) -> Callable[..., LayerDataTuple]:
+    # Wraps a detection function so that it runs in the background when
+    # there is a viewer to add the results to, optionally detecting the
+    # current slice first and watching for new frames.
+    @wraps(function)
+    def detect(*args, **kwargs):
+        if viewer is None:
+            layer_data = function(*args, **kwargs)
+            _show_profile(profile_report, layer_data[1]['metadata'].get('profile'))
+            return layer_data
+        arguments = inspect.signature(function).bind(*args, **kwargs)
+        arguments.apply_defaults()
+        _detect_in_background(
+            viewer,
+            function,
+            arguments.arguments,
+            current_slice_first=current_slice_first.value,
+            watch=watch,
+            progress=progress,
+            cancel=cancel,
+            profile_report=profile_report,
+        )
+        return None
+
+    return detect
+
+
+def _detect_in_background(
+    viewer: Viewer,
+    function: Callable[..., LayerDataTuple],
+    kwargs: Dict[str, Any],
+    *,
+    current_slice_first: bool = False,
+    watch: Optional[CheckBox] = None,
+    progress: Optional[ProgressBar] = None,
+    cancel: Optional[PushButton] = None,
+    profile_report: Optional[TextEdit] = None,
+) -> 'GeneratorWorker':
+    """ Detects blobs in a background thread without blocking the viewer.
+
+    A points layer is added immediately and the blobs are appended to it as
+    the slices finish, so that partial results can be inspected while
+    detection is running.
+    If `current_slice_first` is True, the currently viewed slice is detected
+    first in the background and the layer is only added with its blobs, so
+    that it is never empty, unless blobs are pruned across slices.
+    If the watch check box is checked, frames that are later appended to the
+    image are also detected and appended to the layer by a `FrameWatcher`,
+    until the box is unchecked or either layer is removed from the viewer.
+    The progress bar counts the detected slices and clicking the cancel
+    button stops detection, keeping the blobs found so far.
+    If profiling, the report of all slices is added to the layer's metadata
+    when detection finishes and its summary is shown in the report widget.
+    """
+    # Only import Qt dependencies when they are needed, so that this package
+    # can be imported without Qt for headless use.
+    from napari.qt.threading import thread_worker
+
+    image = kwargs['image']
+    dimensionality = kwargs['dimensionality']
+    leading_shape = image.data.shape[:image.ndim - dimensionality]
+    # Slices that are pruned against their neighbors cannot be detected alone.
+    if kwargs.get('prune_window', 0) > 0:
+        current_slice_first = False
+    first = [_current_index(viewer, image, leading_shape)] if current_slice_first else []
+    indices = first + [index for index in np.ndindex(leading_shape) if index not in first]
+
+    method = _BLOB_METHODS[function]
+    excluded = ('image', 'dimensionality', 'indices', 'output_path', 'profile')
+    other_kwargs = {k: v for k, v in kwargs.items() if k not in excluded}
+    profile = Profile() if kwargs.get('profile') else None
+    use_scale = other_kwargs.get('use_scale', True)
+    slice_blobs = _iter_image_blobs(
+        image=image,
+        method=method,
+        dimensionality=dimensionality,
+        indices=indices,
+        profile=profile,
+        **other_kwargs,
+    )
+    layer: Optional[Points] = None
+
+    def _add_layer(layer_data: LayerDataTuple) -> None:
+        nonlocal layer
+        data, state, _ = layer_data
+        layer = viewer.add_points(data, **state)
+        if watch is not None and watch.value:
+            _watch_while_checked(
+                viewer,
+                watch,
+                FrameWatcher(
+                    image,
+                    layer,
+                    method=method,
+                    dimensionality=dimensionality,
+                    detected=indices,
+                    **other_kwargs,
+                ),
+            )
+
+    def _add_empty_layer() -> None:
+        blobs = assemble_blobs([], ndim=image.ndim, dimensionality=dimensionality)
+        _add_layer(_points_layer_data(image, method, dimensionality, blobs, use_scale=use_scale))
+
+    # Without a current slice, add the layer before any slice is detected.
+    if len(first) == 0:
+        _add_empty_layer()
+
+    worker = thread_worker(_iter_batches)(
+        image,
+        method,
+        dimensionality,
+        slice_blobs,
+        num_first=len(first),
+        use_scale=use_scale,
+    )
+
+    @worker.yielded.connect
+    def _on_yielded(layer_data_count: Tuple[LayerDataTuple, int]):
+        layer_data, count = layer_data_count
+        if layer is None:
+            _add_layer(layer_data)
+        else:
+            _append_points(layer, layer_data)
+        if progress is not None:
+            progress.value += count
+
+    @worker.finished.connect
+    def _on_finished():
+        # Cancels any pending tasks if detection was stopped early.
+        slice_blobs.close()
+        # Detection may be cancelled before the current slice is detected.
+        if layer is None:
+            _add_empty_layer()
+        if cancel is not None:
+            cancel.changed.disconnect(worker.quit)
+            cancel.visible = False
+        if progress is not None:
+            progress.visible = False
+        if profile is not None:
+            report = profile.report()
+            layer.metadata['profile'] = report
+            _show_profile(profile_report, report)
+
+    if progress is not None:
+        progress.max = max(len(indices), 1)
+        progress.value = 0
+        progress.visible = True
+    if cancel is not None:
+        cancel.changed.connect(worker.quit)
+        cancel.visible = True
+    worker.start()
+    return worker
+
+
+# The minimum number of seconds between appending results to the layer.
+_YIELD_INTERVAL = 0.25
+
+
+class FrameWatcher:
+    """ Detects blobs on the frames that are appended to an image layer.
+
+    Each time the image's data is set, e.g. by an acquisition that appends
+    timepoints, blobs are detected in a background thread on only the
+    leading dimension slices that were not detected before, and are appended
+    to the points layer. So the time to detect new frames does not grow with
+    the number of frames. Frames that are appended while detecting are
+    detected once the current frames are done.
+
+    Parameters
+    ----------
+    image : Image
+        The image layer to watch.
+    points : Points
+        The points layer that the blobs of new frames are appended to.
+    method : Callable
+        The scikit-image detection method, like `skimage.feature.blob_log`.
+    dimensionality : int
+        The dimensionality of the blobs.
+    detected : Iterable[Tuple[int, ...]]
+        The indices of the slices that are already detected.
+    **kwargs
+        The other options of detection, like `min_sigma` and `threshold`.
+    """
+
+    def __init__(
+        self,
+        image: Image,
+        points: Points,
+        *,
+        method: Callable[..., np.ndarray],
+        dimensionality: int,
+        detected: Iterable[Tuple[int, ...]] = (),
+        **kwargs,
+    ):
+        self.image = image
+        self.points = points
+        self._method = method
+        self._dimensionality = dimensionality
+        self._kwargs = kwargs
+        self._detected = set(detected)
+        self._worker: Optional['GeneratorWorker'] = None
+        self._pending = False
+        image.events.data.connect(self._on_data)
+
+    @property
+    def busy(self) -> bool:
+        """ True while new frames are being detected. """
+        return self._worker is not None
+
+    def new_indices(self) -> List[Tuple[int, ...]]:
+        """ Returns the indices of the slices of the image that have not been detected. """
+        leading_shape = self.image.data.shape[:self.image.ndim - self._dimensionality]
+        return [index for index in np.ndindex(leading_shape) if index not in self._detected]
+
+    def stop(self) -> None:
+        """ Stops watching the image and detecting any new frames. """
+        self.image.events.data.disconnect(self._on_data)
+        self._pending = False
+        if self._worker is not None:
+            self._worker.quit()
+
+    def _on_data(self, event: Any = None) -> None:
+        if self._worker is not None:
+            self._pending = True
+            return
+        self._detect_new_frames()
+
+    def _detect_new_frames(self) -> None:
+        from napari.qt.threading import thread_worker
+
+        indices = self.new_indices()
+        if len(indices) == 0:
+            return
+        self._detected.update(indices)
+        slice_blobs = _iter_image_blobs(
+            image=self.image,
+            method=self._method,
+            dimensionality=self._dimensionality,
+            indices=indices,
+            **self._kwargs,
+        )
+        worker = thread_worker(_iter_batches)(
+            self.image,
+            self._method,
+            self._dimensionality,
+            slice_blobs,
+            use_scale=self._kwargs.get('use_scale', True),
+        )
+
+        @worker.yielded.connect
+        def _on_yielded(layer_data_count: Tuple[LayerDataTuple, int]):
+            _append_points(self.points, layer_data_count[0])
+
+        @worker.finished.connect
+        def _on_finished():
+            slice_blobs.close()
+            self._worker = None
+            if self._pending:
+                self._pending = False
+                self._detect_new_frames()
+
+        self._worker = worker
+        worker.start()
+
+
+def _watch_while_checked(viewer: Viewer, watch: CheckBox, watcher: FrameWatcher) -> None:
+    # Stops the watcher when the check box is unchecked or when its image or
+    # points layer is removed from the viewer.
+    def _stop_watching(*_):
+        if watch.value and watcher.image in viewer.layers and watcher.points in viewer.layers:
+            return
+        watcher.stop()
+        watch.changed.disconnect(_stop_watching)
+        viewer.layers.events.removed.disconnect(_stop_watching)
+
+    watch.changed.connect(_stop_watching)
+    viewer.layers.events.removed.connect(_stop_watching)
+
+
+def _iter_batches(
+    image: Image,
+    method: Callable[..., np.ndarray],
+    dimensionality: int,
+    slice_blobs: Iterable[Tuple[Tuple[int, ...], np.ndarray]],
+    *,
+    num_first: int = 0,
+    use_scale: bool = True,
+) -> Iterator[Tuple[LayerDataTuple, int]]:
+    # Appending to the layer copies its data, so yield batches of slices
+    # instead of every slice. The first slices are yielded as soon as they
+    # are detected, so that they can be shown before the others.
+    batch = []
+    last_yield = time.perf_counter()
+    for i, index_blobs in enumerate(slice_blobs):
+        batch.append(index_blobs)
+        if i + 1 == num_first or time.perf_counter() - last_yield >= _YIELD_INTERVAL:
+            yield _batch_layer_data(image, method, dimensionality, batch, use_scale=use_scale)
+            batch = []
+            last_yield = time.perf_counter()
+    if len(batch) > 0:
+        yield _batch_layer_data(image, method, dimensionality, batch, use_scale=use_scale)
+
+
+def _batch_layer_data(
+    image: Image,
+    method: Callable[..., np.ndarray],
+    dimensionality: int,
+    batch: List[Tuple[Tuple[int, ...], np.ndarray]],
+    *,
+    use_scale: bool = True,
+) -> Tuple[LayerDataTuple, int]:
+    blobs = assemble_blobs(batch, ndim=image.ndim, dimensionality=dimensionality)
+    return _points_layer_data(image, method, dimensionality, blobs, use_scale=use_scale), len(batch)
+
+
+def _show_profile(profile_report: Optional[TextEdit], report: Optional[Dict[str, Any]]) -> None:
+    if profile_report is None or report is None:
+        return
+    profile_report.value = Profile.from_report(report).summary()
+    profile_report.visible = True
+
+
+def _current_index(viewer: Viewer, image: Image, leading_shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    point = image.world_to_data(viewer.dims.point[-image.ndim:])
+    return tuple(
+        int(np.clip(np.round(p), 0, n - 1))
+        for p, n in zip(point, leading_shape)
+    )
+
+
+def _append_points(layer: Points, layer_data: LayerDataTuple) -> None:
+    data, state, _ = layer_data
+    metadata = state['metadata']
+    layer.metadata['slice_indices'] = np.concatenate(
+        [layer.metadata['slice_indices'], metadata['slice_indices']],
+    )
+    layer.metadata['slice_offsets'] = np.concatenate(
+        [layer.metadata['slice_offsets'], len(layer.data) + metadata['slice_offsets'][1:]],
+    )
+    if len(data) == 0:
+        return
+    features = {
+        name: np.concatenate([layer.features[name], values])
+        for name, values in state['features'].items()
+    }
+    sizes = np.concatenate([layer.size, state['size']])
+    layer.data = np.concatenate([layer.data, data])
+    layer.features = features
+    layer.size = sizes